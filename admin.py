@@ -0,0 +1,572 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the admin API for the registration server.  It is a small Twisted
+web site that should only be bound to localhost, and it is how operators
+start and watch bulk provisioning runs and account lifecycle jobs.
+
+    POST /bulk/            starts a bulk run from a CSV or JSONL body
+                           (use `?format=jsonl` for JSON lines)
+    GET  /bulk/<job id>    returns the progress and throughput report
+    POST /accounts/<action>
+                           runs delete, disable, enable or reset_password
+                           on the usernames in a CSV or JSONL body, or on
+                           `?user=<name>`.  The request is refused if any
+                           username is not a valid one.
+    POST /accounts/prune   finds accounts registered at least `?days=<n>`
+                           days ago that have never logged in, and deletes
+                           them if `&confirm=1` is given
+    GET  /accounts/<job id>
+                           returns the progress report, with any failures
+                           and the new passwords not yet reported
+    GET  /users/           searches the latest snapshot of ZNC's users by
+                           `?prefix=<text>` (with `&limit=<n>`), or finds
+                           the user with `?nick=<nick>`
+    GET  /users/<name>     returns a user's settings and networks from the
+                           snapshot
+    POST /users/           takes a new snapshot straight away
+    GET  /metrics          returns the server's metrics, in the Prometheus
+                           text format
+
+Jobs are kept only so they can be reported on: finished jobs are forgotten
+after `JOB_TTL` seconds, and no more than `MAX_JOBS` are kept.  A new
+password is only reported once, and is forgotten `DETAILS_TTL` seconds
+after its job finishes even if it was never read.
+
+"""
+
+from twisted.web.resource import Resource
+from twisted.web.server import Site, NOT_DONE_YET
+
+from collections import OrderedDict
+from functools import partial
+import itertools
+import json
+import time
+
+from bulk import BulkJob, parse_users
+from lifecycle import AccountJob, parse_usernames, ACTIONS, DELETE
+from metrics import REGISTRY, CONTENT_TYPE
+
+# The seconds a finished job is kept for
+JOB_TTL = 3600
+
+# The most jobs kept by each resource
+MAX_JOBS = 100
+
+# The seconds a finished job's details (such as new passwords) are kept for
+DETAILS_TTL = 300
+
+
+class JSONResource(Resource):
+    """ A Resource with a helper for returning JSON responses.
+
+    """
+
+    @staticmethod
+    def json_response(request, body, code=200):
+        """ Sets up the request for a JSON response.
+
+        :param request: the twisted.web request
+        :param body: the object to send as JSON
+        :param code: the HTTP status code
+
+        :return: the encoded response body
+
+        """
+
+        request.setResponseCode(code)
+        request.setHeader('Content-Type', 'application/json')
+
+        return json.dumps(body)
+
+
+class JobResource(JSONResource):
+    """ A JSONResource that keeps the jobs it starts, so they can be
+    reported on, and forgets them once they are old.
+
+    """
+
+    def __init__(self, job_ttl=JOB_TTL, max_jobs=MAX_JOBS):
+        """ Creates the resource.
+
+        :param job_ttl: the seconds a finished job is kept for
+        :param max_jobs: the most jobs kept at once; the oldest finished
+                         jobs are forgotten first
+
+        """
+
+        Resource.__init__(self)
+
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+
+        # {job id: job}, oldest first
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+
+    def add_job(self, job):
+        """ Keeps a new job, making room for it if needed.
+
+        :param job: the job, which has not been started
+
+        :return job_id: the id the job is reported under
+
+        """
+
+        job_id = str(next(self.job_ids))
+        self.jobs[job_id] = job
+
+        self.forget_jobs()
+
+        return job_id
+
+    def forget_jobs(self, now=None):
+        """ Forgets finished jobs that have passed their TTL, and then the
+        oldest finished jobs while there are too many.  Jobs that are still
+        running are always kept.
+
+        :param now: the current time (default = time.time())
+
+        """
+
+        now = time.time() if now is None else now
+
+        finished = [job_id for job_id, job in self.jobs.iteritems()
+                    if job.finished is not None]
+
+        for job_id in finished:
+
+            if now - self.jobs[job_id].finished > self.job_ttl or \
+                    len(self.jobs) > self.max_jobs:
+
+                del self.jobs[job_id]
+
+    def find_job(self, request):
+        """ Finds the job named in a request's path.
+
+        :param request: the twisted.web request
+
+        :return: the job, or None if there is no such job
+
+        """
+
+        self.forget_jobs()
+
+        return self.jobs.get(request.postpath[0])
+
+    def render_GET(self, request):
+        """ Returns the report for a job, or a list of all jobs.
+
+        :param request: the twisted.web request
+
+        :return: the report, as JSON
+
+        """
+
+        if not request.postpath or not request.postpath[0]:
+
+            self.forget_jobs()
+
+            return self.json_response(request, list(self.jobs))
+
+        job = self.find_job(request)
+
+        if job is None:
+
+            return self.json_response(request, {'error': 'no such job'}, 404)
+
+        return self.json_response(request, self.job_report(job))
+
+    def job_report(self, job):
+        """ Builds the report for a job.
+
+        :param job: the job
+
+        :return: the report, as a dict
+
+        """
+
+        return job.report()
+
+
+class BulkResource(JobResource):
+    """ Starts bulk provisioning runs, and reports on them.
+
+    """
+
+    isLeaf = True
+
+    def __init__(self, submit, window=20, validate=None):
+        """ Creates the resource.
+
+        :param submit: the function used by BulkJob to start a registration
+        :param window: the number of users each run keeps in flight
+        :param validate: the function used by BulkJob to check each user
+
+        """
+
+        JobResource.__init__(self)
+
+        self.submit = submit
+        self.window = window
+        self.validate = validate
+
+    def render_POST(self, request):
+        """ Starts a new bulk run from the request body.
+
+        :param request: the twisted.web request
+
+        :return: the new job id, as JSON
+
+        """
+
+        file_format = request.args.get('format', ['csv'])[0]
+
+        try:
+
+            users = parse_users(request.content.read().splitlines(),
+                                file_format)
+
+        except ValueError as error:
+
+            return self.json_response(request, {'error': str(error)}, 400)
+
+        job = BulkJob(users, self.submit, window=self.window,
+                      validate=self.validate)
+        job_id = self.add_job(job)
+
+        job.start()
+
+        return self.json_response(request, {'job': job_id,
+                                            'total': len(users)}, 202)
+
+
+class AccountsResource(JobResource):
+    """ Runs lifecycle actions over existing accounts, and reports on them.
+
+    """
+
+    isLeaf = True
+
+    def __init__(self, run, find_unused, window=20, time_limit=None,
+                 validate=None):
+        """ Creates the resource.
+
+        :param run: a function taking (action, username) and returning a
+                    Deferred that fires with (succeeded, message)
+        :param find_unused: a function taking a minimum age in seconds and
+                            returning a Deferred that fires with the
+                            usernames that could be pruned
+        :param window: the number of accounts each job keeps in flight
+        :param time_limit: the seconds after which a job starts no more
+                           accounts
+        :param validate: an optional function taking a username and
+                         returning a list of errors; a job is only started
+                         if every username passes it
+
+        """
+
+        JobResource.__init__(self)
+
+        self.run = run
+        self.find_unused = find_unused
+        self.window = window
+        self.time_limit = time_limit
+        self.validate = validate
+
+    def render_POST(self, request):
+        """ Starts a job for the action named in the path.
+
+        :param request: the twisted.web request
+
+        :return: the new job id, as JSON
+
+        """
+
+        action = request.postpath[0] if request.postpath else ''
+
+        if action == 'prune':
+
+            return self.prune(request)
+
+        if action not in ACTIONS:
+
+            return self.json_response(request, {'error': 'no such action'},
+                                      404)
+
+        if 'user' in request.args:
+
+            usernames = request.args['user']
+
+        else:
+
+            try:
+
+                usernames = parse_usernames(
+                    request.content.read().splitlines(),
+                    request.args.get('format', ['csv'])[0])
+
+            except (ValueError, KeyError) as error:
+
+                return self.json_response(request, {'error': str(error)},
+                                          400)
+
+        # Usernames are sent to ZNC as part of a command, so one that could
+        # carry extra lines or arguments must never get that far
+        if self.validate is not None:
+
+            invalid = dict((username, errors) for username, errors in
+                           ((username, self.validate(username))
+                            for username in usernames) if errors)
+
+            if invalid:
+
+                return self.json_response(request,
+                                          {'error': 'invalid usernames',
+                                           'invalid': invalid}, 400)
+
+        return self.json_response(request,
+                                  self.start_job(action, usernames), 202)
+
+    def prune(self, request):
+        """ Finds accounts that have never been used, and deletes them if
+        the request is confirmed.  Otherwise they are only listed.
+
+        :param request: the twisted.web request
+
+        :return: NOT_DONE_YET, as ZNC has to be asked first
+
+        """
+
+        try:
+
+            days = float(request.args.get('days', [''])[0])
+
+        except ValueError:
+
+            return self.json_response(request,
+                                      {'error': 'days must be a number'}, 400)
+
+        confirmed = request.args.get('confirm', ['0'])[0] == '1'
+
+        def found(usernames):
+
+            if confirmed:
+
+                body = self.start_job(DELETE, usernames)
+
+            else:
+
+                body = {'total': len(usernames), 'usernames': usernames}
+
+            request.write(self.json_response(request, body,
+                                             202 if confirmed else 200))
+            request.finish()
+
+        def failed(reason):
+
+            request.write(self.json_response(
+                request, {'error': reason.getErrorMessage()}, 502))
+            request.finish()
+
+        self.find_unused(days * 24 * 60 * 60).addCallbacks(found, failed)
+
+        return NOT_DONE_YET
+
+    def start_job(self, action, usernames):
+        """ Starts a job.
+
+        :param action: the action to run
+        :param usernames: the accounts to run it on
+
+        :return: a dict describing the job, suitable for sending as JSON
+
+        """
+
+        job = AccountJob(action, usernames, partial(self.run, action),
+                         self.window, self.time_limit)
+        job_id = self.add_job(job)
+
+        job.start()
+
+        return {'job': job_id, 'action': action, 'total': len(usernames)}
+
+    def forget_jobs(self, now=None):
+        """ Forgets old jobs, and the details of jobs that finished more
+        than `DETAILS_TTL` seconds ago.
+
+        :param now: the current time (default = time.time())
+
+        """
+
+        now = time.time() if now is None else now
+
+        JobResource.forget_jobs(self, now)
+
+        for job in self.jobs.itervalues():
+
+            if job.finished is not None and \
+                    now - job.finished > DETAILS_TTL:
+
+                job.forget_details()
+
+    def job_report(self, job):
+        """ Builds the report for a job.  The details in it (such as new
+        passwords) are only ever reported once.
+
+        :param job: the AccountJob
+
+        :return: the report, as a dict
+
+        """
+
+        report = job.report()
+
+        job.forget_details()
+
+        return report
+
+
+class UsersResource(JSONResource):
+    """ Answers lookups from the latest snapshot of ZNC's users, without
+    sending anything to ZNC.
+
+    """
+
+    isLeaf = True
+
+    def __init__(self, snapshots):
+        """ Creates the resource.
+
+        :param snapshots: the SnapshotCollector
+
+        """
+
+        Resource.__init__(self)
+
+        self.snapshots = snapshots
+
+    def render_GET(self, request):
+        """ Finds a user, or searches for users.
+
+        :param request: the twisted.web request
+
+        :return: the user or the search results, as JSON
+
+        """
+
+        snapshot = self.snapshots.current
+
+        if request.postpath and request.postpath[0]:
+
+            user = snapshot.lookup(request.postpath[0])
+
+            if user is None:
+
+                return self.json_response(request, {'error': 'no such user'},
+                                          404)
+
+            return self.json_response(request, user)
+
+        body = {'taken_at': snapshot.taken_at,
+                'total': len(snapshot.users),
+                'running': self.snapshots.running}
+
+        if 'nick' in request.args:
+
+            body['username'] = snapshot.find_nick(request.args['nick'][0])
+
+            return self.json_response(request, body,
+                                      404 if body['username'] is None
+                                      else 200)
+
+        try:
+
+            limit = int(request.args.get('limit', ['50'])[0])
+
+        except ValueError:
+
+            return self.json_response(request,
+                                      {'error': 'limit must be a number'},
+                                      400)
+
+        body['usernames'] = snapshot.search(
+            request.args.get('prefix', [''])[0], limit)
+
+        return self.json_response(request, body)
+
+    def render_POST(self, request):
+        """ Starts a new snapshot, unless one is already running.
+
+        :param request: the twisted.web request
+
+        :return: whether a snapshot is running, as JSON
+
+        """
+
+        self.snapshots.collect()
+
+        return self.json_response(request, {'running': True}, 202)
+
+
+class MetricsResource(Resource):
+    """ Serves the metrics registry in the Prometheus text format.
+
+    """
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        """ Renders the metrics.
+
+        :param request: the twisted.web request
+
+        :return: the metrics, as text
+
+        """
+
+        request.setHeader('Content-Type', CONTENT_TYPE)
+
+        return REGISTRY.render()
+
+
+def build_admin_site(submit, window=20, validate=None, run_action=None,
+                     find_unused=None, time_limit=None, snapshots=None,
+                     validate_account=None):
+    """ Builds the admin web site.
+
+    :param submit: the function used by bulk runs to start a registration
+    :param window: the number of users each bulk run (or account job) keeps
+                   in flight
+    :param validate: the function used by bulk runs to check each user
+    :param run_action: the function used by account jobs to act on an
+                       account (if None, there is no /accounts/)
+    :param find_unused: the function used to find accounts to prune
+    :param time_limit: the seconds after which an account job starts no
+                       more accounts
+    :param snapshots: the SnapshotCollector that user lookups are answered
+                      from (if None, there is no /users/)
+    :param validate_account: the function used by account jobs to check
+                             each username
+
+    :return: a twisted.web Site, ready to be passed to `listenTCP`
+
+    """
+
+    root = Resource()
+    root.putChild('bulk', BulkResource(submit, window, validate))
+    root.putChild('metrics', MetricsResource())
+
+    if run_action is not None:
+
+        root.putChild('accounts', AccountsResource(run_action, find_unused,
+                                                   window, time_limit,
+                                                   validate_account))
+
+    if snapshots is not None:
+
+        root.putChild('users', UsersResource(snapshots))
+
+    return Site(root)
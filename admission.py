@@ -0,0 +1,194 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the admission control module.  Every registration request passes
+through it before it is validated or queued, so a script hammering the
+registration page is turned away cheaply, and never reaches ZNC.
+
+A request is refused if:
+
+    - its source IP is a recent offender (one that kept going after being
+      told to slow down, without a quiet spell in between), or
+    - its source IP has used up its token bucket, or
+    - the registration queue is already full, because ZNC can only take
+      registrations so fast.
+
+Every refusal comes with a retry-after hint, in seconds.  All of the state
+is kept in memory, in LRU dicts with a fixed size, so an attacker with many
+addresses can't make it grow without bound.
+
+"""
+
+from collections import OrderedDict
+import math
+import time
+
+from scheduler import TokenBucket
+
+# Reasons a request can be refused
+OFFENDER = 'offender'
+RATE_LIMITED = 'rate_limited'
+BUSY = 'busy'
+
+
+class AdmissionController():
+    """ Decides whether a registration request may go ahead.
+
+    """
+
+    def __init__(self, rate, burst, max_queued, drain_rate,
+                 max_clients=10000, max_offenders=1000, strike_limit=10,
+                 penalty=300, strike_window=60, clock=time.time):
+        """ Creates the controller.
+
+        :param rate: the registrations per second each IP may make
+        :param burst: the registrations an IP may make at once
+        :param max_queued: the most registrations that may wait in the queue
+        :param drain_rate: the registrations per second ZNC can take, used to
+                           estimate how long a busy client should wait
+        :param max_clients: the most IPs whose buckets are remembered
+        :param max_offenders: the most offending IPs that are remembered
+        :param strike_limit: the number of refusals after which an IP is
+                             treated as an offender
+        :param penalty: the seconds an offender is refused for
+        :param strike_window: the seconds without a refusal after which an
+                              IP's strikes are forgotten
+        :param clock: a function returning the current time in seconds
+
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.drain_rate = drain_rate
+        self.max_clients = max_clients
+        self.max_offenders = max_offenders
+        self.strike_limit = strike_limit
+        self.penalty = penalty
+        self.strike_window = strike_window
+        self.clock = clock
+
+        # {ip: TokenBucket}, least recently used first
+        self.buckets = OrderedDict()
+
+        # {ip: [strikes, blocked until, last strike]}, least recently used
+        # first
+        self.offenders = OrderedDict()
+
+    def admit(self, ip, queued):
+        """ Decides whether a registration from an IP may go ahead, and
+        charges it to that IP's bucket if it may.
+
+        :param ip: the source IP of the request
+        :param queued: the number of registrations already queued
+
+        :return: a tuple of (reason, retry_after), where reason is None if
+                 the request may go ahead, and retry_after is a whole number
+                 of seconds
+
+        """
+
+        now = self.clock()
+
+        offender = self.offenders.get(ip)
+
+        if offender is not None and offender[1] > now:
+
+            return OFFENDER, int(math.ceil(offender[1] - now))
+
+        bucket = self.bucket(ip)
+
+        if not bucket.consume():
+
+            return RATE_LIMITED, self.strike(ip, bucket.delay())
+
+        if queued >= self.max_queued:
+
+            # Nothing was sent, so the IP gets its token back
+            bucket.tokens += 1
+
+            wait = (queued - self.max_queued + 1) / self.drain_rate
+
+            return BUSY, int(math.ceil(wait))
+
+        return None, 0
+
+    def bucket(self, ip):
+        """ Finds (or creates) the token bucket for an IP, and marks it as
+        recently used.
+
+        :param ip: the source IP
+
+        :return: the IP's TokenBucket
+
+        """
+
+        bucket = self.buckets.pop(ip, None)
+
+        if bucket is None:
+
+            bucket = TokenBucket(self.rate, self.burst, clock=self.clock)
+
+            if len(self.buckets) >= self.max_clients:
+
+                self.buckets.popitem(last=False)
+
+        self.buckets[ip] = bucket
+
+        return bucket
+
+    def strike(self, ip, wait):
+        """ Records a refusal against an IP.  Once it has too many, it is
+        refused outright for the penalty period.  Strikes only count while
+        they keep coming: after `strike_window` seconds without one (or
+        once a penalty is given), the count starts again, so a busy but
+        well-behaved IP (such as a NAT'd campus) that slips now and then is
+        never penalised for it.
+
+        :param ip: the source IP
+        :param wait: the seconds until its bucket has a token again
+
+        :return: the number of seconds the IP should wait, rounded up
+
+        """
+
+        now = self.clock()
+
+        offender = self.offenders.pop(ip, None)
+
+        if offender is None:
+
+            offender = [0, 0, now]
+
+            if len(self.offenders) >= self.max_offenders:
+
+                self.offenders.popitem(last=False)
+
+        elif now - offender[2] > self.strike_window:
+
+            offender[0] = 0
+
+        self.offenders[ip] = offender
+
+        offender[0] += 1
+        offender[2] = now
+
+        if offender[0] >= self.strike_limit:
+
+            offender[0] = 0
+            offender[1] = now + self.penalty
+
+            wait = self.penalty
+
+        return int(math.ceil(wait))
+
+    def blocked_count(self):
+        """ The number of IPs currently being refused as offenders.
+
+        """
+
+        now = self.clock()
+
+        return sum(1 for offender in self.offenders.itervalues()
+                   if offender[1] > now)
@@ -6,6 +6,17 @@ App.py houses the Flask app that serves the registration page.  The
 settings for this our housed in a config file and then loaded into the app.
 Client-side configuration is also loaded here and passed using JSON.
 
+The app can also be served by the registration server itself, on the same
+port as SockJS, with `main.py --web`.
+
+When users are spread over several ZNC backends, the ZNC and IRC client
+links take a `?user=<username>` and send the user to the backend that holds
+their account.
+
+If `build_assets.py` has been run, the pages use the hashed, precompressed
+copies of the static files under /assets/, which browsers may cache
+forever.  Otherwise they use the plain files under /static/.
+
     Usage:
         app.py
 
@@ -13,28 +24,252 @@ Client-side configuration is also loaded here and passed using JSON.
 
 from flask import Flask
 from flask import render_template
-from flask import jsonify
 from flask import redirect
+from flask import request
+from flask import g
+from flask import url_for
+from flask import safe_join
+from flask import send_from_directory
+from flask import abort
+
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+
+from load_settings import LazySettings
+from metrics import REGISTRY, CONTENT_TYPE
+from build_assets import MANIFEST_NAME, ASSET_MAX_AGE, ASSET_ENCODINGS
+from backends import JournalPlacements, find_backend
+from validation import PASSWORD_MAX_LENGTH
+
+# The config file is only read when a setting is first needed, so importing
+# the app never touches it
+CONFIG_FILE = 'znc_settings.conf'
+settings = LazySettings(CONFIG_FILE)
 
-from load_settings import LocalSettings
+# The URL that the registration page opens SockJS connections to, or None
+# for SOCKJS_URL from the settings.  When the app is served by `main.py
+# --web`, this is set to the shared /sockjs path.
+sockjs_url = None
 
-CONFIG_FILE = 'znc_settings.conf'
-settings = LocalSettings(CONFIG_FILE)
+# How long browsers may reuse the client config before checking its ETag
+CONFIG_MAX_AGE = 300
 
 app = Flask(__name__)
 
+ASSETS_FOLDER = os.path.join(app.static_folder, 'build')
+
+
+class ClientConfig():
+    """ The settings the registration page needs, serialized once.  The JSON
+    body, its ETag, and a copy that is safe to inline in a <script> tag are
+    all built up front, so serving them costs nothing per request.
+
+    """
+
+    def __init__(self, settings, sockjs_url):
+        """ Builds the client config from the app's settings.
+
+        :param settings: a LocalSettings instance
+        :param sockjs_url: the URL the page should open SockJS connections to
+
+        """
+
+        values = {
+            'URI': settings.znc_ip,
+            'USERNAME_CHARACTERS': settings.username_chars,
+            'PASSWORD_CHARACTERS': settings.password_chars,
+            'PASSWORD_MAX_LENGTH': PASSWORD_MAX_LENGTH,
+            'REGISTER_PORT': settings.register_port,
+            'REGISTER_IP': settings.register_ip,
+            'SOCKJS_URL': sockjs_url,
+        }
+
+        self.body = json.dumps(values, sort_keys=True)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:20]
+
+        # '</' could end the <script> tag early, so it is escaped
+        self.inline = self.body.replace('</', '<\\/')
+
+
+def refresh_client_config():
+    """ This function rebuilds the client config.  It is called when the
+    config is first needed, and again whenever the settings or the SockJS
+    URL change.
+
+    """
+
+    global client_config
+
+    client_config = ClientConfig(settings, settings.sockjs_url
+                                 if sockjs_url is None else sockjs_url)
+
+
+def current_client_config():
+    """ This function returns the client config, building it the first time.
+
+    :return: the ClientConfig
+
+    """
+
+    if client_config is None:
+
+        refresh_client_config()
+
+    return client_config
+
+
+def settings_reloaded(new_settings):
+    """ This function is called after the settings are reloaded, and rebuilds
+    everything that was built from them.
+
+    :param new_settings: the new LocalSettings instance
+
+    """
+
+    refresh_client_config()
+
+
+def watch_settings():
+    """ This function checks the config file for changes, forever.  It is run
+    on a daemon thread when the app is served on its own, so requests never
+    wait on the file system.
+
+    """
+
+    while True:
+
+        time.sleep(settings.reload_interval)
+
+        try:
+
+            settings.check_for_changes()
+
+        except ValueError as error:
+
+            app.logger.warning(str(error))
+
+
+def load_asset_manifest():
+    """ This function reads the hashed names written by `build_assets.py`.
+
+    :return: a dict of {name: hashed name}, which is empty if the assets
+             have not been built
+
+    """
+
+    try:
+
+        with open(os.path.join(ASSETS_FOLDER, MANIFEST_NAME)) as manifest:
+
+            return json.load(manifest)
+
+    except (IOError, ValueError):
+
+        return {}
+
+
+client_config = None
+
+asset_manifest = load_asset_manifest()
+
+# The backend each user was placed on, read from the registration journal.
+# The reader is created by the first lookup.
+placements = None
+
+
+def locate_backend(username):
+    """ This function finds the ZNC backend that holds a user's account.
+    When the app is served by `main.py --web`, this is replaced with the
+    registration server's own (live) lookup.
+
+    :param username: the username
+
+    :return: the Backend (the first backend if the user is unknown)
+
+    """
+
+    global placements
+
+    if placements is None:
+
+        placements = JournalPlacements(settings.journal_file)
+
+    return find_backend(settings.backends, placements.get(username))
+
+
+REQUESTS = REGISTRY.counter('znc_web_requests_total',
+                            'Requests served by the Flask app',
+                            ('endpoint', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('znc_web_request_seconds',
+                                     'Time taken to serve each request',
+                                     ('endpoint',))
+
+
+@app.before_request
+def start_timer():
+    """ Records when a request started, so its latency can be measured.
+
+    """
+
+    g.request_started = time.time()
+
+
+@app.after_request
+def record_request(response):
+    """ Records the outcome and latency of every request in the metrics
+    registry.
+
+    :param response: the response that is about to be sent
+
+    :return response: the same response, unchanged
+
+    """
+
+    endpoint = request.endpoint or 'unknown'
+
+    REQUESTS.inc(endpoint, response.status_code)
+    REQUEST_SECONDS.observe(time.time() - g.request_started, endpoint)
+
+    return response
+
+
+@app.template_global()
+def asset_url(name):
+    """ This function finds the URL of a static file, for the templates.
+
+    :param name: the file's name in the static folder, such as 'styles.css'
+
+    :return: the URL of its hashed copy, or of the plain file if the assets
+             have not been built
+
+    """
+
+    hashed = asset_manifest.get(name)
+
+    if hashed is None:
+
+        return url_for('static', filename=name)
+
+    return url_for('asset', filename=hashed)
+
 
 @app.route('/')
 def home():
     """ The default address for the web app, which links users to the
     registration page, our own KiwiIRC Client, and the ZNC web administration
-    page
+    page.  Given `?user=` (as it is after registering), the links lead to
+    that user's own backend.
 
     :return render_template(): a rendered web page from an html file
 
     """
 
-    return render_template('index.html')
+    return render_template('index.html', username=request.args.get('user',
+                                                                    ''))
 
 
 @app.route('/Register/')
@@ -46,19 +281,30 @@ def register():
 
     """
 
-    return render_template('register.html')
+    inline_config = current_client_config().inline \
+        if settings.inline_client_config else None
+
+    return render_template('register.html', inline_config=inline_config)
 
 
 @app.route('/IRC_client/')
 def load_irc_client():
     """ This function redirects to the IRC client page, which will either point
-    to a self-hosted IRC client or a publicly hosted one.
+    to a self-hosted IRC client or a publicly hosted one.  Given `?user=`,
+    it points to the client of the backend that holds that user, if it has
+    its own.
 
     :return redirect(): a redirect command to a specific URL
 
     """
 
-    if settings.client_enabled:
+    backend = locate_backend(request.args.get('user', ''))
+
+    if backend.client_url:
+
+        irc_client_url = backend.client_url
+
+    elif settings.client_enabled:
 
         irc_client_url = 'http://' + settings.client_ip + ':' +\
             str(settings.client_port) + '/'
@@ -72,7 +318,8 @@ def load_irc_client():
 
 @app.route('/ZNC_web_admin/')
 def load_znc_admin():
-    """ This function redirects to the ZNC web interface.
+    """ This function redirects to the ZNC web interface.  Given `?user=`,
+    it redirects to the web interface of the backend that holds that user.
 
     :return redirect(): a redirect command to a specific URL
 
@@ -80,32 +327,100 @@ def load_znc_admin():
 
     #TODO(kmjungersen) - change this back
 
-    znc_url = 'https://' + settings.znc_ip + ':' + \
-              str(settings.znc_port) + '/'
+    znc_url = locate_backend(request.args.get('user', '')).web_url
 
     return redirect(znc_url)
 
 
 @app.route('/register/config/')
 def config():
-    """ The function called at this route retrieves settings from a
-    configuration class
+    """ The function called at this route serves the settings that are
+    needed client-side.  The JSON is built once (see `ClientConfig`), and is
+    sent with an ETag so a browser that already has it gets a 304.
+
+    :return response: the config as JSON, or an empty 304 response
+
+    """
+
+    current = current_client_config()
+    response = app.response_class(current.body,
+                                  mimetype='application/json')
 
-    :return config_settings: a JSON file with all settings that are needed
-                             client-side
+    response.set_etag(current.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CONFIG_MAX_AGE
+
+    return response.make_conditional(request)
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """ The function called at this route serves a hashed asset.  If the
+    browser accepts brotli or gzip and a precompressed copy was built, that
+    copy is sent instead, so nothing is compressed per request.  Under
+    `main.py --web`, assets are served by Twisted instead (see `AssetFile`
+    in `web.py`), and never reach this.
+
+    :param filename: the hashed name of the asset
+
+    :return response: the asset, cached for a year
 
     """
 
-    config_settings = jsonify(URI=settings.znc_ip,
-                              USERNAME_CHARACTERS=settings.username_chars,
-                              PASSWORD_CHARACTERS=settings.password_chars,
-                              REGISTER_PORT=settings.register_port,
-                              REGISTER_IP=settings.register_ip,
-                              )
+    path = safe_join(ASSETS_FOLDER, filename)
+
+    if path is None or not os.path.isfile(path):
+
+        abort(404)
+
+    encoding = None
+    suffix = ''
 
-    return config_settings
+    for accepted, copy_suffix in ASSET_ENCODINGS:
+
+        if request.accept_encodings[accepted] and \
+                os.path.isfile(path + copy_suffix):
+
+            encoding = accepted
+            suffix = copy_suffix
+
+            break
+
+    response = send_from_directory(ASSETS_FOLDER, filename + suffix,
+                                   mimetype=mimetypes.guess_type(filename)[0],
+                                   cache_timeout=ASSET_MAX_AGE,
+                                   conditional=True)
+
+    if encoding is not None:
+
+        response.headers['Content-Encoding'] = encoding
+
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = \
+        'public, max-age={}, immutable'.format(ASSET_MAX_AGE)
+
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """ The function called at this route serves the app's metrics in the
+    Prometheus text format.
+
+    :return: the metrics, as text
+
+    """
+
+    return REGISTRY.render(), 200, {'Content-Type': CONTENT_TYPE}
 
 
 if __name__ == '__main__':
+    # Watch the config file for changes
+    settings.add_listener(settings_reloaded)
+
+    watcher = threading.Thread(target=watch_settings)
+    watcher.daemon = True
+    watcher.start()
+
     # Run the app
     app.run(settings.register_ip, debug=True)
@@ -0,0 +1,545 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the backends module.  New users can be spread over several ZNC
+servers (backends), listed in the `[ZNC BACKENDS]` section of the config
+file:
+
+    [ZNC BACKENDS]
+    znc1 = 10.0.0.1:6697 weight=2 capacity=5000
+    znc2 = 10.0.0.2:6697 capacity=2500 clone=TEMPLATE
+
+Each new user is placed by consistent hashing of their username, on a ring
+where each backend has points in proportion to its weight.  A backend that
+is full, or has no healthy admin session, is skipped for the next one
+around the ring.  Adding a backend only moves the new users that hash to
+its points.  Placement can also be `least_loaded`, which picks the backend
+with the fewest users for its weight.
+
+Once a user has been created, the backend is recorded in the registration
+journal, so their placement never changes: admin commands and web redirects
+for them always go to the backend that holds their account.  Users the
+journal knows nothing about (such as those registered before there were
+several backends) are on the first backend.
+
+"""
+
+from bisect import bisect
+from collections import Counter, OrderedDict
+import hashlib
+import json
+import os
+import time
+
+from journal import apply_placement
+
+# The ways a backend can be chosen for a new user
+HASH = 'hash'
+LEAST_LOADED = 'least_loaded'
+
+STRATEGIES = (HASH, LEAST_LOADED)
+
+# The name of the only backend, when the config file doesn't list any
+DEFAULT_BACKEND = 'default'
+
+# The points each unit of weight gets on the hash ring
+POINTS_PER_WEIGHT = 100
+
+
+class Backend():
+    """ A single ZNC server that users can be placed on.
+
+    """
+
+    def __init__(self, name, host, port, weight=1.0, capacity=None,
+                 user_to_clone=None, web_url=None, client_url=None):
+        """ Creates the backend.
+
+        :param name: the name of the backend (as it appears in the config
+                     file and the journal)
+        :param host: the ZNC address
+        :param port: the ZNC port
+        :param weight: the share of new users it gets, relative to the
+                       others
+        :param capacity: the most users it may hold, or None for no limit
+        :param user_to_clone: the template user new users are cloned from
+        :param web_url: the URL of its web interface (default =
+                        https://<host>:<port>/)
+        :param client_url: the URL of the IRC client for its users, or None
+                           for the one in the IRC CLIENT OPTIONS
+
+        """
+
+        self.name = name
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.capacity = capacity
+        self.user_to_clone = user_to_clone
+        self.web_url = web_url or 'https://{}:{}/'.format(host, port)
+        self.client_url = client_url
+
+    def __eq__(self, other):
+
+        return isinstance(other, Backend) and vars(self) == vars(other)
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    def __repr__(self):
+
+        return 'Backend({!r}, {!r}, {!r})'.format(self.name, self.host,
+                                                 self.port)
+
+
+def parse_backend(name, value, user_to_clone):
+    """ This function reads one backend from the config file, such as
+    `10.0.0.1:6697 weight=2 capacity=5000 clone=TEMPLATE`.  The other
+    options are `web=<url>` and `client=<url>`.
+
+    :param name: the name of the backend
+    :param value: its address and options
+    :param user_to_clone: the template user, if no `clone=` is given
+
+    :raises ValueError: if the address or an option is invalid
+
+    :return: a Backend
+
+    """
+
+    words = value.split()
+
+    if not words:
+
+        raise ValueError('No address for backend ' + name)
+
+    host, separator, port = words[0].rpartition(':')
+
+    if not separator or not host:
+
+        raise ValueError('Backend {} needs a host:port address'.format(name))
+
+    options = {}
+
+    for word in words[1:]:
+
+        option, separator, option_value = word.partition('=')
+
+        if not separator or option not in ('weight', 'capacity', 'clone',
+                                           'web', 'client'):
+
+            raise ValueError('Unknown option for backend {}: {}'.format(
+                name, word))
+
+        options[option] = option_value
+
+    capacity = options.get('capacity')
+
+    return Backend(name, host, int(port),
+                   weight=float(options.get('weight', 1)),
+                   capacity=int(capacity) if capacity else None,
+                   user_to_clone=options.get('clone', user_to_clone),
+                   web_url=options.get('web'),
+                   client_url=options.get('client'))
+
+
+def parse_backends(options, host, port, user_to_clone):
+    """ This function reads the `[ZNC BACKENDS]` section of the config
+    file.  Without one, there is a single backend at the ZNC address in the
+    ZNC CONFIGURATION OPTIONS.
+
+    :param options: a list of (name, value) pairs from the section, in order
+    :param host: the ZNC address from the ZNC CONFIGURATION OPTIONS
+    :param port: the ZNC port from the ZNC CONFIGURATION OPTIONS
+    :param user_to_clone: the template user, for backends without `clone=`
+
+    :raises ValueError: if a backend is invalid
+
+    :return: a list of Backends, the first of which is the primary
+
+    """
+
+    if not options:
+
+        return [Backend(DEFAULT_BACKEND, host, port,
+                        user_to_clone=user_to_clone)]
+
+    return [parse_backend(name, value, user_to_clone)
+            for name, value in options]
+
+
+def find_backend(backends, name):
+    """ This function finds a backend by name.
+
+    :param backends: the list of Backends
+    :param name: the name, or None
+
+    :return: the Backend with that name, or the first backend if there is
+             none
+
+    """
+
+    for backend in backends:
+
+        if backend.name == name:
+
+            return backend
+
+    return backends[0]
+
+
+def ring_hash(key):
+    """ This function hashes a key onto the ring.
+
+    :param key: a string
+
+    :return: an integer
+
+    """
+
+    return int(hashlib.md5(key).hexdigest()[:12], 16)
+
+
+class HashRing():
+    """ A consistent hash ring of backends, with points in proportion to
+    their weights.
+
+    """
+
+    def __init__(self, backends, points_per_weight=POINTS_PER_WEIGHT):
+        """ Builds the ring.
+
+        :param backends: the list of Backends
+        :param points_per_weight: the points each unit of weight gets
+
+        """
+
+        points = sorted(
+            (ring_hash('{}#{}'.format(backend.name, number)), backend.name)
+            for backend in backends
+            for number in range(max(1, int(round(points_per_weight *
+                                                 backend.weight)))))
+
+        self.hashes = [point for point, name in points]
+        self.names = [name for point, name in points]
+        self.count = len(set(self.names))
+
+    def walk(self, key):
+        """ Lists every backend, in the order a key meets them going around
+        the ring.
+
+        :param key: the key (a username)
+
+        :return: a generator of backend names
+
+        """
+
+        start = bisect(self.hashes, ring_hash(key))
+        seen = set()
+
+        for offset in range(len(self.names)):
+
+            name = self.names[(start + offset) % len(self.names)]
+
+            if name not in seen:
+
+                seen.add(name)
+
+                yield name
+
+                if len(seen) == self.count:
+
+                    return
+
+
+class BackendCluster():
+    """ Places new users on backends, and remembers where every user is.
+
+    A user is reserved a backend when their registration starts, and the
+    placement is confirmed once ZNC has created them.  Reservations count
+    towards a backend's capacity, so a rush of signups can't overfill it.
+
+    """
+
+    def __init__(self, backends, placements=None, strategy=HASH):
+        """ Creates the cluster.
+
+        :param backends: the list of Backends (the first is the primary)
+        :param placements: a dict of {username: backend name} for the users
+                           that already exist (see `journal.placements`)
+        :param strategy: HASH or LEAST_LOADED
+
+        """
+
+        self.backends = OrderedDict((backend.name, backend)
+                                    for backend in backends)
+        self.primary = backends[0].name
+        self.ring = HashRing(backends)
+        self.strategy = strategy
+
+        # {username: backend name}, for every placed or reserved user
+        self.placements = {}
+
+        # The usernames whose placement is only reserved
+        self.reserved = set()
+
+        self.counts = Counter()
+
+        for username, name in (placements or {}).iteritems():
+
+            self.assign(username, name if name in self.backends
+                        else self.primary)
+
+    def locate(self, username):
+        """ Finds the backend that holds a user.
+
+        :param username: the username
+
+        :return: the backend name (the primary if the user is unknown)
+
+        """
+
+        return self.placements.get(username, self.primary)
+
+    def backend_for(self, username):
+        """ Finds the backend that holds a user.
+
+        :param username: the username
+
+        :return: the Backend
+
+        """
+
+        return self.backends[self.locate(username)]
+
+    def is_full(self, name):
+        """ Whether a backend has reached its capacity.
+
+        :param name: the backend name
+
+        """
+
+        capacity = self.backends[name].capacity
+
+        return capacity is not None and self.counts[name] >= capacity
+
+    def candidates(self, username):
+        """ Lists the backends a new user could go on, best first.
+
+        :param username: the username
+
+        :return: a list of backend names
+
+        """
+
+        if self.strategy == LEAST_LOADED:
+
+            return sorted(self.backends, key=lambda name: (
+                self.counts[name] / self.backends[name].weight, name))
+
+        return list(self.ring.walk(username))
+
+    def place(self, username, available):
+        """ Reserves a backend for a new user.  A user who already exists
+        stays where they are, so ZNC can refuse the duplicate.
+
+        :param username: the username
+        :param available: the names of the backends that can take commands
+                          right now
+
+        :return: the backend name, or None if there is no room (or the
+                 user's backend is unavailable)
+
+        """
+
+        current = self.placements.get(username)
+
+        if current is not None and username not in self.reserved:
+
+            return current if current in available else None
+
+        if current is not None:
+
+            if current in available:
+
+                return current
+
+            # Only reserved, so it can go elsewhere
+            self.cancel(username)
+
+        for name in self.candidates(username):
+
+            if name in available and not self.is_full(name):
+
+                self.assign(username, name)
+                self.reserved.add(username)
+
+                return name
+
+        return None
+
+    def assign(self, username, name):
+        """ Records that a user is on a backend.
+
+        :param username: the username
+        :param name: the backend name
+
+        """
+
+        self.release(username)
+
+        self.placements[username] = name
+        self.counts[name] += 1
+
+    def confirm(self, username):
+        """ Confirms a reserved placement, once ZNC has created the user.
+
+        :param username: the username
+
+        """
+
+        self.reserved.discard(username)
+
+    def cancel(self, username):
+        """ Drops a reserved placement, when the user was not created.  A
+        confirmed placement is left alone.
+
+        :param username: the username
+
+        """
+
+        if username in self.reserved:
+
+            self.release(username)
+
+    def release(self, username):
+        """ Forgets a user's placement, when the user no longer exists.
+
+        :param username: the username
+
+        """
+
+        name = self.placements.pop(username, None)
+
+        self.reserved.discard(username)
+
+        if name is not None:
+
+            self.counts[name] -= 1
+
+    def learn(self, users_by_backend):
+        """ Brings the placements up to date with the users each backend
+        actually holds, from a snapshot.  Users found on a backend are
+        placed there.  Users placed on a listed backend, but not found on
+        it, are forgotten (unless they are only reserved).
+
+        :param users_by_backend: a dict of {backend name: usernames}, for
+                                 the backends that were listed
+
+        """
+
+        for name, usernames in users_by_backend.iteritems():
+
+            usernames = set(usernames)
+
+            for username in [username for username, placed
+                             in self.placements.iteritems()
+                             if placed == name and username not in usernames
+                             and username not in self.reserved]:
+
+                self.release(username)
+
+            for username in usernames:
+
+                if self.placements.get(username) != name:
+
+                    self.assign(username, name)
+
+
+class JournalPlacements():
+    """ The placements recorded in a registration journal, for a process
+    (such as the Flask app) that doesn't hold the live BackendCluster.  The
+    journal is read incrementally: only the lines added since the last
+    read, at most once every `refresh_interval` seconds.
+
+    """
+
+    def __init__(self, path, refresh_interval=1.0):
+        """ Creates the reader.  Nothing is read until the first lookup.
+
+        :param path: the path of the journal file
+        :param refresh_interval: the least time between reads, in seconds
+
+        """
+
+        self.path = path
+        self.refresh_interval = refresh_interval
+
+        self.placements = {}
+        self.offset = 0
+        self.last_read = None
+
+    def get(self, username):
+        """ Finds the backend recorded for a user.
+
+        :param username: the username
+
+        :return: the backend name, or None if none is recorded
+
+        """
+
+        now = time.time()
+
+        if self.last_read is None or \
+                now - self.last_read >= self.refresh_interval:
+
+            self.last_read = now
+            self.refresh()
+
+        return self.placements.get(username)
+
+    def refresh(self):
+        """ Reads any lines added to the journal since the last read.  If
+        the journal has shrunk (it was replaced), it is read from the start.
+
+        """
+
+        try:
+
+            size = os.path.getsize(self.path)
+
+        except OSError:
+
+            return
+
+        if size < self.offset:
+
+            self.placements = {}
+            self.offset = 0
+
+        if size == self.offset:
+
+            return
+
+        with open(self.path) as journal_file:
+
+            journal_file.seek(self.offset)
+
+            for line in journal_file:
+
+                # A line still being written is read next time
+                if not line.endswith('\n'):
+
+                    break
+
+                self.offset += len(line)
+
+                try:
+
+                    apply_placement(self.placements, json.loads(line))
+
+                except ValueError:
+
+                    continue
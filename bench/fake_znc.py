@@ -0,0 +1,465 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is a fake ZNC server for load testing.  It speaks just enough IRC over
+SSL for the registration bot to sign on, and answers `*controlpanel`
+commands the way ZNC does, with configurable latency and dropped replies.
+It also answers the `*blockuser` and `*lastseen` commands that account
+management uses (no fake user ever logs in).
+Point `ZNC_IP_ADDRESS`/`ZNC_PORT_NUMBER` in the config file at it, and then
+drive the registration server with `swarm.py`.
+
+Replies to each connection are sent in the order its commands arrived, as
+ZNC does, even when latency is randomised.
+
+With `--channels`, each connection is attached to that many busy channels
+when it signs on, with a backlog played back in each (until the admin user
+sets `AutoClearChanBuffer`), and `--chatter` messages a second in each
+channel until the client sends `DETACH` for it.
+
+    Usage:
+        fake_znc.py [options]
+
+    Options:
+        -h --help               Show this screen
+        --port=<port>           Port to listen on [default: 6697]
+        --latency=<ms>          Base reply latency in milliseconds [default: 5]
+        --jitter=<ms>           Extra random latency, up to this many
+                                milliseconds [default: 20]
+        --drop=<fraction>       Fraction of cloneuser replies to drop
+                                [default: 0]
+        --existing=<names>      Comma separated usernames that already exist
+                                [default: ]
+        --channels=<count>      Channels each connection is attached to
+                                [default: 0]
+        --chatter=<rate>        Messages a second in each attached channel
+                                [default: 10]
+
+"""
+
+from twisted.internet import reactor, ssl, task
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import LineReceiver
+
+from docopt import docopt
+
+from collections import deque
+import random
+
+CONTROL_PANEL = ':*controlpanel!znc@znc.in'
+BLOCK_USER = ':*blockuser!znc@znc.in'
+LAST_SEEN = ':*lastseen!znc@znc.in'
+
+# The lines of backlog played back in each channel
+PLAYBACK_LINES = 50
+
+
+class FakeZNCProtocol(LineReceiver):
+    """ One client connection to the fake ZNC.
+
+    """
+
+    delimiter = '\r\n'
+
+    def connectionMade(self):
+        self.nickname = '*'
+        self.last_reply = 0
+
+        # Replies waiting for their latency to pass, as (send at, lines).
+        # They are sent from one queue, as the reactor does not keep calls
+        # due at the same time in order.
+        self.pending_replies = deque()
+
+        # The channels the connection is attached to
+        self.channels = set()
+        self.chatter = None
+
+    def lineReceived(self, line):
+        """ Handles a line from the client.
+
+        :param line: the raw IRC line
+
+        """
+
+        command, _, rest = line.partition(' ')
+        command = command.upper()
+
+        if command == 'NICK':
+
+            self.nickname = rest.strip()
+
+        elif command == 'USER':
+
+            self.sendLine(':irc.znc.in 001 {} :Welcome to fake ZNC'.format(
+                self.nickname))
+
+            self.attach_channels()
+
+        elif command == 'DETACH':
+
+            for channel in rest.strip().split(','):
+
+                self.channels.discard(channel)
+
+        elif command == 'PING':
+
+            self.sendLine(':irc.znc.in PONG irc.znc.in ' + rest)
+
+        elif command == 'PRIVMSG':
+
+            # Like ZNC, take the rest of the line as the message, with or
+            # without the leading colon
+            target, _, message = rest.partition(' ')
+            message = message[1:] if message.startswith(':') else message
+
+            if target.lower() == '*controlpanel':
+
+                self.factory.counts['commands'] += 1
+
+                self.control_panel(message)
+
+            elif target.lower() == '*blockuser':
+
+                self.factory.counts['commands'] += 1
+
+                self.block_user(message)
+
+            elif target.lower() == '*lastseen':
+
+                self.factory.counts['commands'] += 1
+
+                self.last_seen(message)
+
+    def attach_channels(self):
+        """ Attaches the connection to its channels, as ZNC does on sign on:
+        a join, the names list and the backlog for each, and then chatter.
+
+        """
+
+        for number in range(self.factory.channels):
+
+            channel = '#busy{}'.format(number)
+            self.channels.add(channel)
+
+            self.sendLine(':{0}!{0}@znc.in JOIN :{1}'.format(self.nickname,
+                                                           channel))
+            self.sendLine(':irc.znc.in 353 {0} = {1} :{0} alice bob'.format(
+                self.nickname, channel))
+            self.sendLine(':irc.znc.in 366 {} {} :End of /NAMES list.'.format(
+                self.nickname, channel))
+
+            if self.factory.playback:
+
+                for line in range(PLAYBACK_LINES):
+
+                    self.sendLine(':alice!alice@example.com PRIVMSG {} '
+                                  ':[00:00:00] backlog {}'.format(channel,
+                                                                  line))
+
+                self.factory.counts['chatter'] += PLAYBACK_LINES
+
+        if self.channels and self.factory.chatter > 0:
+
+            self.chatter = task.LoopingCall(self.chat)
+            self.chatter.start(1.0 / self.factory.chatter, now=False)
+
+    def chat(self):
+        """ Sends a message in every channel the connection is still
+        attached to.
+
+        """
+
+        for channel in self.channels:
+
+            self.sendLine(':bob!bob@example.com PRIVMSG {} :chatter'.format(
+                channel))
+
+            self.factory.counts['chatter'] += 1
+
+    def connectionLost(self, reason):
+
+        if self.chatter is not None and self.chatter.running:
+
+            self.chatter.stop()
+
+    def control_panel(self, message):
+        """ Answers a `*controlpanel` command.
+
+        :param message: the command text
+
+        """
+
+        words = message.split()
+        command = words[0].lower() if words else ''
+
+        if command == 'cloneuser' and len(words) >= 3:
+
+            username = words[2]
+
+            if random.random() < self.factory.drop:
+
+                self.factory.counts['dropped'] += 1
+
+                return
+
+            if username in self.factory.users:
+
+                self.factory.counts['exists'] += 1
+
+                self.reply(['Error: User not added! [User already exists]'])
+
+            else:
+
+                self.factory.users.add(username)
+                self.factory.counts['added'] += 1
+
+                self.reply(['User [{}] added!'.format(username)])
+
+        elif command == 'deluser' and len(words) >= 2:
+
+            if words[1] in self.factory.users:
+
+                self.factory.users.discard(words[1])
+
+                self.reply(['User [{}] deleted!'.format(words[1])])
+
+            else:
+
+                self.reply(['Error: User [{}] does not exist.'.format(
+                    words[1])])
+
+        elif command == 'set' and len(words) >= 4:
+
+            if words[1].lower() == 'password':
+
+                self.reply(['Password has been changed!'])
+
+            else:
+
+                if words[1].lower() == 'autoclearchanbuffer':
+
+                    self.factory.playback = words[3].lower() != 'true'
+
+                self.reply(['{} = {}'.format(words[1], ' '.join(words[3:]))])
+
+        elif command == 'setnetwork' and len(words) >= 5:
+
+            self.reply(['{} = {}'.format(words[1], ' '.join(words[4:]))])
+
+        elif command == 'listusers':
+
+            # Like ZNC, with the settings every registration gives a user
+            border = '+----------+----------+------+---------+-------+'
+            self.reply([border,
+                        '| Username | Realname | Nick | AltNick | Ident |',
+                        border] +
+                       ['| {0} | {0} | {0} | {0} | {0} |'.format(name)
+                        for name in sorted(self.factory.users)] +
+                       [border])
+
+        elif command == 'listnetworks' and len(words) >= 2:
+
+            if words[1] in self.factory.users:
+
+                border = '+----------+-------+'
+                self.reply([border, '| Network  | OnIRC |', border,
+                            '| Freenode | No    |', border])
+
+            else:
+
+                self.reply(['Error: User [{}] not found'.format(words[1])])
+
+        elif command == 'get' and len(words) >= 3:
+
+            self.reply(['{} = {}'.format(words[1], words[2])])
+
+        else:
+
+            self.reply(['Error: Unknown command [{}]'.format(command)])
+
+    def block_user(self, message):
+        """ Answers a `*blockuser` command.
+
+        :param message: the command text
+
+        """
+
+        words = message.split()
+        command = words[0].lower() if words else ''
+
+        if command == 'block' and len(words) >= 2:
+
+            if words[1] in self.factory.users:
+
+                self.factory.blocked.add(words[1])
+
+                self.reply(['Blocked [{}]'.format(words[1])], BLOCK_USER)
+
+            else:
+
+                self.reply(['Could not block [{}] (misspelled?)'.format(
+                    words[1])], BLOCK_USER)
+
+        elif command == 'unblock' and len(words) >= 2:
+
+            if words[1] in self.factory.blocked:
+
+                self.factory.blocked.discard(words[1])
+
+                self.reply(['Unblocked [{}]'.format(words[1])], BLOCK_USER)
+
+            else:
+
+                self.reply(['This user is not blocked'], BLOCK_USER)
+
+        else:
+
+            self.reply(['Unknown command [{}]'.format(message)], BLOCK_USER)
+
+    def last_seen(self, message):
+        """ Answers a `*lastseen` command.  No fake user has ever logged in.
+
+        :param message: the command text
+
+        """
+
+        if message.strip().lower() == 'show':
+
+            border = '+----------+-----------+'
+            self.reply([border, '| User | Last Seen |', border] +
+                       ['| {} | never |'.format(name)
+                        for name in sorted(self.factory.users)] +
+                       [border], LAST_SEEN)
+
+        else:
+
+            self.reply(['Unknown command [{}]'.format(message)], LAST_SEEN)
+
+    def reply(self, lines, sender=CONTROL_PANEL):
+        """ Sends lines from a module after the configured latency, never
+        ahead of an earlier reply on this connection.
+
+        :param lines: the reply lines
+        :param sender: the module the lines come from
+
+        """
+
+        latency = self.factory.latency + \
+            random.random() * self.factory.jitter
+
+        send_at = max(reactor.seconds() + latency, self.last_reply)
+        self.last_reply = send_at
+
+        self.pending_replies.append((send_at, sender, lines))
+
+        if len(self.pending_replies) == 1:
+
+            reactor.callLater(send_at - reactor.seconds(), self.send_replies)
+
+    def send_replies(self):
+        """ Writes every reply that is due, in order, and waits for the next.
+
+        """
+
+        now = reactor.seconds()
+
+        while self.pending_replies and self.pending_replies[0][0] <= now:
+
+            self.send_reply(*self.pending_replies.popleft()[1:])
+
+        if self.pending_replies:
+
+            reactor.callLater(self.pending_replies[0][0] - now,
+                              self.send_replies)
+
+    def send_reply(self, sender, lines):
+        """ Writes reply lines, if the client is still connected.
+
+        :param sender: the module the lines come from
+        :param lines: the reply lines
+
+        """
+
+        if not self.transport.disconnecting:
+
+            for line in lines:
+
+                self.sendLine('{} PRIVMSG {} :{}'.format(sender,
+                                                         self.nickname,
+                                                         line))
+
+
+class FakeZNCFactory(Factory):
+    """ Holds the state shared by every connection: the set of existing
+    users and the configured behaviour.
+
+    """
+
+    protocol = FakeZNCProtocol
+
+    def __init__(self, latency=0.005, jitter=0.02, drop=0.0, existing=(),
+                 channels=0, chatter=10.0):
+        """ Creates the fake server.
+
+        :param latency: the base reply latency, in seconds
+        :param jitter: the most extra random latency, in seconds
+        :param drop: the fraction of cloneuser replies to drop
+        :param existing: usernames that already exist
+        :param channels: the channels each connection is attached to
+        :param chatter: the messages a second in each attached channel
+
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.users = set(existing)
+        self.blocked = set()
+        self.channels = channels
+        self.chatter = chatter
+
+        # Whether a backlog is played back on sign on
+        self.playback = True
+
+        self.counts = dict.fromkeys(['commands', 'added', 'exists',
+                                     'dropped', 'chatter'], 0)
+
+
+def report(factory):
+    """ Prints what the fake server has seen so far.
+
+    :param factory: the FakeZNCFactory
+
+    """
+
+    print 'fake ZNC - commands: {commands}, added: {added}, ' \
+          'exists: {exists}, dropped: {dropped}, ' \
+          'chatter: {chatter}'.format(**factory.counts)
+
+
+if __name__ == '__main__':
+
+    options = docopt(__doc__)
+
+    factory = FakeZNCFactory(
+        latency=float(options['--latency']) / 1000,
+        jitter=float(options['--jitter']) / 1000,
+        drop=float(options['--drop']),
+        existing=[name for name in options['--existing'].split(',') if name],
+        channels=int(options['--channels']),
+        chatter=float(options['--chatter']),
+    )
+
+    # A throwaway self-signed certificate is enough for the bot, which does
+    # not verify the server
+    certificate = ssl.KeyPair.generate().selfSignedCert(1, CN='localhost')
+
+    reactor.listenSSL(int(options['--port']), factory,
+                      certificate.options())
+
+    reactor.addSystemEventTrigger('before', 'shutdown', report, factory)
+
+    print 'fake ZNC listening on port ' + options['--port']
+
+    reactor.run()
@@ -0,0 +1,165 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the startup benchmark.  It times how long a fresh Python process
+takes to import the registration server (`main.py`) and the Flask app
+(`app.py`), and to load the settings both by parsing the config file and
+from its cache.  Every run starts a new process, so nothing is warm but the
+operating system's file cache.
+
+It fails if the median of any case is slower than the target, so a deploy
+script (or a reviewer) can catch an import that makes every restart slower.
+
+    Usage:
+        startup.py [options]
+
+    Options:
+        -h --help               Show this screen
+        --runs=<count>          Processes started for each case [default: 10]
+        --config=<file>         The config file to load
+                                [default: znc_settings.conf]
+        --target=<ms>           The slowest median allowed for any case, in
+                                milliseconds [default: 1000]
+
+"""
+
+import os
+import sys
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from docopt import docopt
+
+import shutil
+import subprocess
+import tempfile
+import time
+
+from bulk import percentile
+from load_settings import CACHE_SUFFIX
+
+# Loads the settings, and reads one, as a module that needs them would
+LOAD_SETTINGS = 'import load_settings; ' \
+                'load_settings.get_settings({!r}).znc_ip'
+
+
+def run_process(code):
+    """ This function times a new Python process running some code, from
+    the start of the process to its exit.
+
+    :param code: the Python code to run
+
+    :raises RuntimeError: if the process fails
+
+    :return: the time taken, in seconds
+
+    """
+
+    started = time.time()
+
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', code],
+                               cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, errors = process.communicate()
+
+    elapsed = time.time() - started
+
+    if process.returncode:
+
+        raise RuntimeError('{!r} failed:\n{}'.format(code, errors))
+
+    return elapsed
+
+
+def time_case(code, runs, before_run=None):
+    """ This function times a case over several processes.
+
+    :param code: the Python code to run
+    :param runs: the number of processes to start
+    :param before_run: an optional function called before each process
+
+    :return: a sorted list of times, in seconds
+
+    """
+
+    times = []
+
+    for _ in range(runs):
+
+        if before_run is not None:
+
+            before_run()
+
+        times.append(run_process(code))
+
+    return sorted(times)
+
+
+def run(config_file, runs):
+    """ This function times every case.  The config file is copied to a
+    temporary folder, so its cache can be removed and rebuilt freely.
+
+    :param config_file: the config file to load
+    :param runs: the number of processes to start for each case
+
+    :return: a list of (case, sorted times in seconds)
+
+    """
+
+    folder = tempfile.mkdtemp()
+
+    try:
+
+        config_copy = os.path.join(folder, os.path.basename(config_file))
+        shutil.copy(config_file, config_copy)
+
+        cache_file = config_copy + CACHE_SUFFIX
+
+        def remove_cache():
+
+            if os.path.exists(cache_file):
+
+                os.remove(cache_file)
+
+        load_settings = LOAD_SETTINGS.format(config_copy)
+
+        return [
+            ('import main', time_case('import main', runs)),
+            ('import app', time_case('import app', runs)),
+            ('settings (parsed)', time_case(load_settings, runs,
+                                            remove_cache)),
+            ('settings (cached)', time_case(load_settings, runs)),
+        ]
+
+    finally:
+
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+
+    options = docopt(__doc__)
+
+    target = float(options['--target']) / 1000
+
+    slow = []
+
+    for case, times in run(options['--config'], int(options['--runs'])):
+
+        median = percentile(times, 0.5)
+
+        print '{:<20} min: {:7.1f}ms, p50: {:7.1f}ms, max: {:7.1f}ms'.format(
+            case, times[0] * 1000, median * 1000, times[-1] * 1000)
+
+        if median > target:
+
+            slow.append(case)
+
+    if slow:
+
+        print 'SLOWER THAN {}ms: {}'.format(options['--target'],
+                                            ', '.join(slow))
+
+    # A non-zero exit lets a deploy script fail on a slow startup
+    sys.exit(1 if slow else 0)
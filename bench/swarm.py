@@ -0,0 +1,387 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the load generator.  It opens a number of SockJS sessions to the
+registration server (using the xhr transport, so no browser is needed) and
+has each one register users back to back, the way `register.js` would.
+Run it against a server that talks to `fake_znc.py`.
+
+When every client is done it reports the throughput, the latency
+percentiles, the outcome of each registration, and any replies that named a
+different user than the one the client asked for.  A crossed reply means
+the server mixed up two registrations, and is always a bug.
+
+    Usage:
+        swarm.py [options] <url>
+
+    Arguments:
+        <url>                   The SockJS base URL, such as
+                                http://localhost:4000
+
+    Options:
+        -h --help               Show this screen
+        --clients=<count>       Concurrent SockJS sessions [default: 10]
+        --users=<count>         Registrations per client [default: 20]
+        --prefix=<prefix>       Prefix for the generated usernames
+                                [default: load]
+        --password=<password>   Password for every generated user
+                                [default: loadtest1]
+        --timeout=<seconds>     Seconds to wait for each reply [default: 60]
+
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from twisted.internet import reactor, defer
+from twisted.internet.protocol import Protocol
+from twisted.web.client import Agent, HTTPConnectionPool, FileBodyProducer
+from twisted.web.http_headers import Headers
+
+from docopt import docopt
+
+from cStringIO import StringIO
+import json
+import random
+import string
+import time
+
+from bulk import percentile
+from wire import PROTOCOL_VERSION
+
+
+class BodyReader(Protocol):
+    """ Collects a whole response body.
+
+    """
+
+    def __init__(self, finished):
+        self.finished = finished
+        self.chunks = []
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+
+    def connectionLost(self, reason):
+        self.finished.callback(''.join(self.chunks))
+
+
+class SockJSClient():
+    """ A single SockJS session, using the xhr polling transport.
+
+    """
+
+    def __init__(self, agent, url):
+        """ Creates the session.  Nothing is sent until `open` is called.
+
+        :param agent: the twisted.web Agent to send requests with
+        :param url: the SockJS base URL
+
+        """
+
+        session_id = ''.join(random.choice(string.ascii_lowercase)
+                             for _ in range(16))
+
+        self.agent = agent
+        self.base = '{}/{:03d}/{}/'.format(url.rstrip('/'),
+                                           random.randint(0, 999),
+                                           session_id)
+        self.messages = []
+        self.closed = False
+
+    @defer.inlineCallbacks
+    def post(self, transport, body=None):
+        """ Sends a POST to one of the session's transport URLs.
+
+        :param transport: 'xhr' or 'xhr_send'
+        :param body: the request body, if any
+
+        :return: a Deferred that fires with the response body
+
+        """
+
+        producer = None if body is None else FileBodyProducer(StringIO(body))
+
+        response = yield self.agent.request(
+            'POST', self.base + transport,
+            Headers({'Content-Type': ['text/plain']}), producer)
+
+        finished = defer.Deferred()
+        response.deliverBody(BodyReader(finished))
+
+        content = yield finished
+
+        defer.returnValue(content)
+
+    @defer.inlineCallbacks
+    def open(self):
+        """ Opens the session.
+
+        """
+
+        content = yield self.post('xhr')
+
+        if not content.startswith('o'):
+
+            raise IOError('SockJS session refused: ' + repr(content))
+
+    def send(self, message):
+        """ Sends a message to the server.
+
+        :param message: the message, as a string
+
+        """
+
+        return self.post('xhr_send', json.dumps([message]))
+
+    @defer.inlineCallbacks
+    def receive(self):
+        """ Waits for the next message from the server.  Heartbeats are
+        skipped, and extra messages are kept for the next call.
+
+        :return: a Deferred that fires with the message
+
+        """
+
+        while not self.messages:
+
+            if self.closed:
+
+                raise IOError('SockJS session was given up')
+
+            content = yield self.post('xhr')
+
+            for frame in content.splitlines():
+
+                if frame.startswith('a'):
+
+                    self.messages.extend(json.loads(frame[1:]))
+
+                elif frame.startswith('c'):
+
+                    raise IOError('SockJS session closed: ' + frame)
+
+        defer.returnValue(self.messages.pop(0))
+
+
+class Swarm():
+    """ Runs the clients and collects their results.
+
+    """
+
+    def __init__(self, url, clients, users, prefix, password, timeout):
+        """ Creates the swarm.
+
+        :param url: the SockJS base URL
+        :param clients: the number of concurrent clients
+        :param users: the number of registrations each client makes
+        :param prefix: the prefix of every generated username
+        :param password: the password of every generated user
+        :param timeout: the seconds to wait for each reply
+
+        """
+
+        pool = HTTPConnectionPool(reactor)
+        pool.maxPersistentPerHost = clients * 2
+
+        self.agent = Agent(reactor, pool=pool)
+        self.url = url
+        self.clients = clients
+        self.users = users
+        self.prefix = prefix
+        self.password = password
+        self.timeout = timeout
+
+        # A run tag keeps usernames unique across runs against one server
+        self.tag = ''.join(random.choice(string.ascii_lowercase)
+                           for _ in range(3))
+
+        self.latencies = []
+        self.outcomes = {}
+        self.crossed = []
+        self.errors = []
+
+    def username(self, client_number, user_number):
+        """ The username a client registers for one of its users.
+
+        """
+
+        return '{}{}{:03d}{:04d}'.format(self.prefix, self.tag,
+                                         client_number, user_number)
+
+    @defer.inlineCallbacks
+    def run_client(self, client_number):
+        """ Opens a session and registers this client's users, one at a time.
+
+        :param client_number: the client's position in the swarm
+
+        """
+
+        client = SockJSClient(self.agent, self.url)
+
+        try:
+
+            yield client.open()
+
+        except Exception as error:
+
+            self.errors.append('client {}: {}'.format(client_number, error))
+
+            return
+
+        for user_number in range(self.users):
+
+            username = self.username(client_number, user_number)
+
+            frame = json.dumps({'v': PROTOCOL_VERSION,
+                                'ops': [{'op': 'register',
+                                         'username': username,
+                                         'password': self.password}]})
+
+            started = time.time()
+
+            try:
+
+                yield client.send(frame)
+
+                message = yield self.wait_for_reply(client)
+
+            except Exception as error:
+
+                self.errors.append('{}: {}'.format(username, error))
+
+                continue
+
+            if message is None:
+
+                # Any later reply would be matched to the wrong user, so the
+                # session is given up
+                self.record_outcome('timeout')
+                client.closed = True
+
+                return
+
+            self.latencies.append(time.time() - started)
+
+            reply = json.loads(message)
+
+            if reply.get('username') != username:
+
+                self.crossed.append((username, reply.get('username')))
+
+            # Messages name the user, so it is taken out before counting
+            self.record_outcome(reply.get('message', 'no message').replace(
+                username, '<user>'))
+
+    def wait_for_reply(self, client):
+        """ Waits for the next reply on a session, up to the timeout.
+
+        :param client: the SockJSClient
+
+        :return: a Deferred that fires with the reply, or with None if the
+                 timeout passes first
+
+        """
+
+        result = defer.Deferred()
+        timer = reactor.callLater(self.timeout, result.callback, None)
+
+        def arrived(outcome):
+
+            if not result.called:
+
+                timer.cancel()
+                result.callback(outcome)
+
+        client.receive().addBoth(arrived)
+
+        return result
+
+    def record_outcome(self, outcome):
+        """ Counts one registration's outcome.
+
+        """
+
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    @defer.inlineCallbacks
+    def run(self):
+        """ Runs every client, and then prints the report.
+
+        """
+
+        started = time.time()
+
+        yield defer.gatherResults([self.run_client(number)
+                                   for number in range(self.clients)])
+
+        self.print_report(time.time() - started)
+
+    def print_report(self, elapsed):
+        """ Prints the results of the run.
+
+        :param elapsed: the length of the run, in seconds
+
+        """
+
+        replies = len(self.latencies)
+
+        print 'clients: {}, registrations: {}, replies: {}'.format(
+            self.clients, self.clients * self.users, replies)
+
+        print 'elapsed: {:.2f}s, throughput: {:.1f}/s'.format(
+            elapsed, replies / elapsed if elapsed else 0.0)
+
+        if replies:
+
+            print 'latency - p50: {:.3f}s, p90: {:.3f}s, p99: {:.3f}s, ' \
+                  'max: {:.3f}s'.format(percentile(self.latencies, 0.5),
+                                        percentile(self.latencies, 0.9),
+                                        percentile(self.latencies, 0.99),
+                                        max(self.latencies))
+
+        for outcome, count in sorted(self.outcomes.items(),
+                                     key=lambda item: -item[1]):
+
+            print '  {:6d}  {}'.format(count, outcome)
+
+        for error in self.errors[:10]:
+
+            print 'error: ' + error
+
+        if self.crossed:
+
+            print 'CROSSED REPLIES: {}'.format(len(self.crossed))
+
+            for requested, answered in self.crossed[:10]:
+
+                print '  asked for {}, reply was for {}'.format(requested,
+                                                                answered)
+
+        else:
+
+            print 'crossed replies: 0'
+
+
+if __name__ == '__main__':
+
+    options = docopt(__doc__)
+
+    swarm = Swarm(options['<url>'],
+                  clients=int(options['--clients']),
+                  users=int(options['--users']),
+                  prefix=options['--prefix'],
+                  password=options['--password'],
+                  timeout=float(options['--timeout']),
+                  )
+
+    done = swarm.run()
+    done.addErrback(lambda failure: failure.printTraceback())
+    done.addBoth(lambda _: reactor.stop())
+
+    reactor.run()
+
+    # A non-zero exit lets a deploy script fail on a bad run
+    sys.exit(1 if swarm.crossed or swarm.errors else 0)
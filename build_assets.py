@@ -0,0 +1,316 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the static asset build step.  It copies every file in `static/`
+to `static/build/`, with a hash of its contents in the name
+(`styles.css` becomes `styles.3f2a9c0d1e.css`), so a browser can cache each
+one forever: a changed file always gets a new name.
+
+Along the way:
+
+    - images are recompressed (only if PIL is installed, and only when it
+      makes them smaller)
+    - references inside stylesheets (`url(...)`) are rewritten to the
+      hashed names
+    - text files get a gzip copy (`.gz`), and a brotli copy (`.br`) if the
+      brotli module is installed, so they are never compressed per request
+
+The hashed names are written to `static/build/manifest.json`, which the
+Flask app reads to point the templates at them (see `asset_url` in
+`app.py`).  Run this again whenever a static file changes.
+
+    Usage:
+        build_assets.py [options]
+
+    Options:
+        -h --help               Show this screen
+        --static=<folder>       The folder of static files [default: static]
+        --out=<folder>          The folder to build into, inside the static
+                                folder [default: static/build]
+
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from cStringIO import StringIO
+
+# Optional - recompresses images if installed
+try:
+
+    from PIL import Image
+
+except ImportError:
+
+    Image = None
+
+# Optional - adds brotli copies of text files if installed
+try:
+
+    import brotli
+
+except ImportError:
+
+    brotli = None
+
+# The name of the manifest of hashed names, in the build folder
+MANIFEST_NAME = 'manifest.json'
+
+# The number of hex digits of the content hash put in each name
+HASH_LENGTH = 10
+
+# Hashed assets never change, so browsers may keep them for a year
+ASSET_MAX_AGE = 31536000
+
+# The encodings of the compressed copies, and their suffixes, best first
+ASSET_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Files worth keeping compressed copies of
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+
+# Images that can be recompressed, and the options they are saved with
+IMAGE_FORMATS = {
+    '.png': ('PNG', {'optimize': True}),
+    '.jpg': ('JPEG', {'optimize': True, 'progressive': True,
+                      'quality': 85}),
+    '.jpeg': ('JPEG', {'optimize': True, 'progressive': True,
+                       'quality': 85}),
+}
+
+# A reference inside a stylesheet, such as url('background.jpg')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'"()]+)\1\s*\)''')
+
+
+def fingerprint(name, data):
+    """ This function puts a hash of a file's contents into its name.
+
+    :param name: the file name, such as 'css/styles.css'
+    :param data: the file's contents
+
+    :return: the hashed name, such as 'css/styles.3f2a9c0d1e.css'
+
+    """
+
+    base, extension = os.path.splitext(name)
+    digest = hashlib.md5(data).hexdigest()[:HASH_LENGTH]
+
+    return '{}.{}{}'.format(base, digest, extension)
+
+
+def recompress_image(name, data):
+    """ This function saves an image again with the best compression that
+    keeps it looking the same.
+
+    :param name: the file name, used to tell the format
+    :param data: the image's contents
+
+    :return: the smaller of the recompressed and the original contents
+
+    """
+
+    image_format = IMAGE_FORMATS.get(os.path.splitext(name)[1].lower())
+
+    if Image is None or image_format is None:
+
+        return data
+
+    try:
+
+        image = Image.open(StringIO(data))
+        output = StringIO()
+        image.save(output, image_format[0], **image_format[1])
+
+    except (IOError, ValueError):
+
+        return data
+
+    recompressed = output.getvalue()
+
+    return recompressed if len(recompressed) < len(data) else data
+
+
+def rewrite_css(name, data, manifest):
+    """ This function points the references in a stylesheet at the hashed
+    names of the files they refer to.  References to other sites, and to
+    files that were not built, are left alone.
+
+    :param name: the stylesheet's name, which references are relative to
+    :param data: the stylesheet's contents
+    :param manifest: a dict of {name: hashed name} for the files built so far
+
+    :return: the rewritten stylesheet
+
+    """
+
+    folder = os.path.dirname(name)
+
+    def replace(match):
+
+        reference = match.group(2).strip()
+        target = os.path.normpath(os.path.join(folder, reference))
+
+        if '://' in reference or target not in manifest:
+
+            return match.group(0)
+
+        hashed = os.path.relpath(manifest[target], folder or '.')
+
+        return 'url({0}{1}{0})'.format(match.group(1), hashed)
+
+    return CSS_URL.sub(replace, data)
+
+
+def compressed_copies(data):
+    """ This function compresses a text file in each format a browser can
+    accept.
+
+    :param data: the file's contents
+
+    :return: a dict of {suffix: compressed contents}, leaving out any that
+             are not smaller
+
+    """
+
+    copies = {}
+
+    output = StringIO()
+
+    # A fixed mtime keeps the output the same for the same input
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=9,
+                       mtime=0) as compressed:
+
+        compressed.write(data)
+
+    copies['.gz'] = output.getvalue()
+
+    if brotli is not None:
+
+        copies['.br'] = brotli.compress(data)
+
+    return dict((suffix, copy) for suffix, copy in copies.items()
+                if len(copy) < len(data))
+
+
+def write_file(path, data):
+    """ This function writes a file, creating its folder if needed.
+
+    :param path: the path of the file
+    :param data: the contents
+
+    """
+
+    folder = os.path.dirname(path)
+
+    if not os.path.isdir(folder):
+
+        os.makedirs(folder)
+
+    with open(path, 'wb') as output:
+
+        output.write(data)
+
+
+def find_assets(static_folder, out_folder):
+    """ This function lists the files to build, leaving out the build folder
+    itself.  Stylesheets come last, so the files they refer to are built
+    before them.
+
+    :param static_folder: the folder of static files
+    :param out_folder: the build folder
+
+    :return: a list of names, relative to the static folder
+
+    """
+
+    names = []
+    out_folder = os.path.abspath(out_folder)
+
+    for folder, subfolders, files in os.walk(static_folder):
+
+        subfolders[:] = [subfolder for subfolder in subfolders
+                         if os.path.abspath(os.path.join(folder, subfolder))
+                         != out_folder]
+
+        for file_name in files:
+
+            names.append(os.path.relpath(os.path.join(folder, file_name),
+                                         static_folder))
+
+    return sorted(names, key=lambda name: (name.endswith('.css'), name))
+
+
+def build(static_folder, out_folder):
+    """ This function builds every static file, and writes the manifest.
+    Files from earlier builds are left in place, so pages that are already
+    open can still load them.
+
+    :param static_folder: the folder of static files
+    :param out_folder: the folder to build into
+
+    :return: a list of (name, hashed name, original size, built sizes) for
+             each file, where built sizes is a dict of {suffix: size}
+
+    """
+
+    manifest = {}
+    built = []
+
+    for name in find_assets(static_folder, out_folder):
+
+        with open(os.path.join(static_folder, name), 'rb') as source:
+
+            original = source.read()
+
+        data = recompress_image(name, original)
+
+        if name.endswith('.css'):
+
+            data = rewrite_css(name, data, manifest)
+
+        hashed = fingerprint(name, data)
+        sizes = {'': len(data)}
+
+        write_file(os.path.join(out_folder, hashed), data)
+
+        if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+
+            for suffix, copy in compressed_copies(data).items():
+
+                write_file(os.path.join(out_folder, hashed + suffix), copy)
+
+                sizes[suffix] = len(copy)
+
+        manifest[name] = hashed
+        built.append((name, hashed, len(original), sizes))
+
+    write_file(os.path.join(out_folder, MANIFEST_NAME),
+               json.dumps(manifest, indent=4, sort_keys=True,
+                          separators=(',', ': ')))
+
+    return built
+
+
+if __name__ == '__main__':
+
+    from docopt import docopt
+
+    options = docopt(__doc__)
+
+    for name, hashed, size, sizes in build(options['--static'],
+                                           options['--out']):
+
+        print '{:<32} {:<40} {:>8} -> {}'.format(
+            name, hashed, size,
+            ', '.join('{}{}'.format(sizes[suffix], suffix)
+                      for suffix in sorted(sizes)))
+
+    if Image is None:
+
+        print 'PIL is not installed, so images were not recompressed'
+
+    if brotli is None:
+
+        print 'brotli is not installed, so only gzip copies were made'
@@ -0,0 +1,383 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the bulk provisioning module.  It reads a list of users from a CSV
+or JSON lines file and feeds them through the registration engine a window
+at a time, keeping a checkpoint so that an interrupted run can be resumed.
+
+"""
+
+from twisted.internet import defer
+
+import csv
+import json
+import os
+import time
+
+
+def parse_users(lines, file_format='csv'):
+    """ This function reads users from the lines of a CSV or JSONL file.  A
+    CSV file may have a `username,password` header row, or just two columns.
+    Each line of a JSONL file is an object with `username` and `password`.
+
+    :param lines: an iterable of lines from the file
+    :param file_format: either 'csv' or 'jsonl'
+
+    :raises ValueError: naming the first line that is not a user
+
+    :return users: a list of (username, password) tuples
+
+    """
+
+    users = []
+
+    if file_format == 'jsonl':
+
+        for number, line in enumerate(lines, 1):
+
+            line = line.strip()
+
+            if line:
+
+                try:
+
+                    user_info = json.loads(line)
+
+                    users.append((user_info['username'],
+                                  user_info['password']))
+
+                except (ValueError, KeyError, TypeError):
+
+                    raise ValueError('line {}: expected an object with a '
+                                     'username and password'.format(number))
+
+        return users
+
+    reader = csv.reader(lines)
+
+    for row in reader:
+
+        if not row or row[0].strip().lower() == 'username':
+
+            continue
+
+        if len(row) < 2:
+
+            raise ValueError('line {}: expected username,password'.format(
+                reader.line_num))
+
+        users.append((row[0].strip(), row[1].strip()))
+
+    return users
+
+
+def read_users(file_path):
+    """ This function reads users from a file, choosing the format from the
+    file extension ('.jsonl' or '.json' for JSON lines, anything else CSV).
+
+    :param file_path: the path of the file to read
+
+    :raises ValueError: naming the first line that is not a user
+
+    :return users: a list of (username, password) tuples
+
+    """
+
+    extension = os.path.splitext(file_path)[1].lower()
+
+    file_format = 'jsonl' if extension in ('.jsonl', '.json') else 'csv'
+
+    with open(file_path) as user_file:
+
+        return parse_users(user_file, file_format)
+
+
+def percentile(values, fraction):
+    """ Finds a percentile of a list of numbers, using the nearest rank.
+
+    :param values: a list of numbers
+    :param fraction: the percentile wanted, as a fraction (0.99 = p99)
+
+    :return: the value at that percentile, or 0 for an empty list
+
+    """
+
+    if not values:
+
+        return 0
+
+    ordered = sorted(values)
+
+    index = min(len(ordered) - 1, int(fraction * len(ordered)))
+
+    return ordered[index]
+
+
+class Checkpoint():
+    """ An append-only record of the users a bulk run has finished with.
+    Each line holds a username and its outcome, so a resumed run can skip
+    every user that already has a final answer.
+
+    """
+
+    def __init__(self, file_path=None):
+        """ Loads any users already recorded in the checkpoint file.
+
+        :param file_path: the checkpoint file, or None to keep no checkpoint
+
+        """
+
+        self.file_path = file_path
+        self.done = set()
+        self.checkpoint_file = None
+
+        if file_path is None:
+
+            return
+
+        if os.path.exists(file_path):
+
+            with open(file_path) as checkpoint_file:
+
+                for line in checkpoint_file:
+
+                    if line.strip():
+
+                        self.done.add(json.loads(line)['username'])
+
+        self.checkpoint_file = open(file_path, 'a')
+
+    def record(self, username, status_message):
+        """ Records that a user has a final answer.
+
+        :param username: the user that finished
+        :param status_message: the status message for that user
+
+        """
+
+        self.done.add(username)
+
+        if self.checkpoint_file is not None:
+
+            self.checkpoint_file.write(json.dumps({
+                'username': username,
+                'status': status_message,
+            }) + '\n')
+            self.checkpoint_file.flush()
+
+    def close(self):
+        """ Closes the checkpoint file.
+
+        """
+
+        if self.checkpoint_file is not None:
+
+            self.checkpoint_file.close()
+            self.checkpoint_file = None
+
+
+class BulkJob():
+    """ A single bulk provisioning run.  Users are submitted to the
+    registration engine at bulk priority, a window at a time, so that a
+    large file never crowds out interactive signups.
+
+    """
+
+    def __init__(self, users, submit, checkpoint=None, window=20,
+                 validate=None):
+        """ Creates the job.  Nothing is submitted until `start()`.
+
+        :param users: a list of (username, password) tuples
+        :param submit: a function taking (username, password, on_complete)
+                       which starts a registration and returns its record,
+                       or None if it could not be started
+        :param checkpoint: a Checkpoint of users to skip and record
+        :param window: the number of users allowed in flight at once
+        :param validate: an optional function taking (username, password)
+                         and returning a list of errors; users that fail it
+                         are never submitted
+
+        """
+
+        if checkpoint is None:
+
+            checkpoint = Checkpoint()
+
+        self.checkpoint = checkpoint
+        self.submit = submit
+        self.window = window
+        self.validate = validate
+
+        self.users = [user for user in users if user[0] not in checkpoint.done]
+        self.skipped = len(users) - len(self.users)
+
+        self.next_user = 0
+        self.outstanding = 0
+
+        # True while the window is being filled.  A user that is answered
+        # straight away must not start filling it again from inside.
+        self.filling = False
+
+        self.succeeded = 0
+        self.failed = []
+        self.latencies = []
+
+        self.started = None
+        self.finished = None
+        self.done = defer.Deferred()
+
+    def start(self):
+        """ Starts submitting users.
+
+        :return done: a Deferred that fires with the report once every user
+                      has an answer
+
+        """
+
+        self.started = time.time()
+
+        self.fill_window()
+
+        return self.done
+
+    def fill_window(self):
+        """ Submits users until the window is full or the list runs out.
+
+        """
+
+        if self.filling:
+
+            return
+
+        self.filling = True
+
+        while self.outstanding < self.window and \
+                self.next_user < len(self.users):
+
+            username, password = self.users[self.next_user]
+            self.next_user += 1
+
+            if self.validate is not None:
+
+                errors = self.validate(username, password)
+
+                if errors:
+
+                    status_message = '  '.join(errors)
+
+                    self.failed.append((username, status_message))
+                    self.checkpoint.record(username, status_message)
+
+                    continue
+
+            # Counted before it is submitted, as it may be answered (and
+            # counted off) before `submit` returns
+            self.outstanding += 1
+
+            record = self.submit(username, password, self.user_complete)
+
+            if record is None:
+
+                self.outstanding -= 1
+
+                self.failed.append((username, 'Registration already pending'))
+
+        self.filling = False
+
+        if self.outstanding == 0 and self.finished is None:
+
+            self.finished = time.time()
+
+            self.checkpoint.close()
+
+            self.done.callback(self.report())
+
+    def user_complete(self, record, status_message, valid_user, retryable):
+        """ Called by UserAdmin once a user has an answer.  Final answers are
+        written to the checkpoint, but retryable failures are not, so that a
+        resumed run will try them again.
+
+        :param record: the PendingRegistration that finished
+        :param status_message: the status message for that user
+        :param valid_user: True if the user was created
+        :param retryable: True if the failure was temporary
+
+        """
+
+        self.outstanding -= 1
+        self.latencies.append(time.time() - record.created)
+
+        if valid_user:
+
+            self.succeeded += 1
+
+        else:
+
+            self.failed.append((record.username, status_message))
+
+        if not retryable:
+
+            self.checkpoint.record(record.username, status_message)
+
+        self.fill_window()
+
+    def progress(self):
+        """ The current state of the job.
+
+        :return: a dict of counts, suitable for sending as JSON
+
+        """
+
+        return {
+            'total': len(self.users) + self.skipped,
+            'skipped': self.skipped,
+            'submitted': self.next_user,
+            'in_flight': self.outstanding,
+            'succeeded': self.succeeded,
+            'failed': len(self.failed),
+            'finished': self.finished is not None,
+        }
+
+    def report(self):
+        """ The throughput report for the job.
+
+        :return: a dict with the progress counts plus users/sec and p50/p99
+                 latency in seconds
+
+        """
+
+        end = self.finished if self.finished is not None \
+            else time.time()
+        elapsed = max(end - (self.started or end), 0.000001)
+
+        report = self.progress()
+        report.update({
+            'elapsed': elapsed,
+            'users_per_second': len(self.latencies) / elapsed,
+            'latency_p50': percentile(self.latencies, 0.50),
+            'latency_p99': percentile(self.latencies, 0.99),
+        })
+
+        return report
+
+
+def format_report(report):
+    """ Formats a throughput report for the terminal.
+
+    :param report: a report dict from `BulkJob.report()`
+
+    :return: the report as a multi-line string
+
+    """
+
+    return '\n'.join([
+        'Bulk provisioning finished',
+        '  users:        {total} ({skipped} skipped from checkpoint)',
+        '  succeeded:    {succeeded}',
+        '  failed:       {failed}',
+        '  elapsed:      {elapsed:.2f} sec',
+        '  throughput:   {users_per_second:.2f} users/sec',
+        '  latency p50:  {latency_p50:.3f} sec',
+        '  latency p99:  {latency_p99:.3f} sec',
+    ]).format(**report)
@@ -0,0 +1,472 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the `*controlpanel` client.  Every command sent to ZNC's
+controlpanel module goes through it, and each one gets a Deferred that
+fires with ZNC's reply:
+
+    d = control_panel.call('deluser someone')
+    d.addCallback(lambda reply: ...)    # 'User [someone] deleted!'
+
+ZNC answers each client's commands in the order it received them, so the
+commands sent on each admin session are kept in a FIFO, and each reply
+line from `*controlpanel` belongs to the command at the head of it.
+Commands that print a table (such as `ListUsers`) are answered with a list
+of rows instead of a single line.
+
+Commands for ZNC's other admin modules (`*blockuser` and `*lastseen`) go
+through the same FIFO, as ZNC answers every command in the order it
+arrived, whichever module it was for.
+
+A reply that names a user (`User [someone] added!`) is also checked
+against the FIFO, so a command that ZNC never answered cannot push every
+later reply onto the wrong command.
+
+"""
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from collections import deque, Counter
+import re
+
+from scheduler import INTERACTIVE
+
+# The ZNC modules that commands can be sent to
+CONTROL_PANEL = '*controlpanel'
+BLOCK_USER = '*blockuser'
+LAST_SEEN = '*lastseen'
+
+MODULES = (CONTROL_PANEL, BLOCK_USER, LAST_SEEN)
+
+# Commands that are answered with a table rather than a single line
+TABLE_COMMANDS = ('listusers', 'listnetworks', 'listmods', 'listnetmods',
+                  'listctcps', 'listchans', 'help', 'list', 'show')
+
+# Commands that name a user, and which word of the command it is
+USER_COMMANDS = {
+    'adduser': 1,
+    'cloneuser': 2,
+    'deluser': 1,
+    'block': 1,
+    'unblock': 1,
+}
+
+# Replies that name the user they are about
+NAMED_REPLY = re.compile(r'^User \[(?P<username>.+)\] (added|deleted)!$')
+
+
+class ControlPanelError(Exception):
+    """ The base class of every reason a command can fail to get a reply.
+
+    """
+
+
+class NoSession(ControlPanelError):
+    """ Raised when there is no admin session to send a command on.
+
+    """
+
+
+class SessionLost(ControlPanelError):
+    """ Raised when the session a command was sent on lost its connection
+    before the command was answered.
+
+    """
+
+
+class ReplyTimeout(ControlPanelError):
+    """ Raised when ZNC does not answer a command in time.
+
+    """
+
+
+class NoReply(ControlPanelError):
+    """ Raised when ZNC answered a later command first, so this command
+    will never be answered.
+
+    """
+
+
+class PendingCommand():
+    """ A single command that has been sent (or is about to be), and the
+    Deferred waiting on its reply.
+
+    """
+
+    def __init__(self, command, module=CONTROL_PANEL):
+        """ Creates the record.
+
+        :param command: the command, without the `*controlpanel` prefix
+        :param module: the module the command is sent to
+
+        """
+
+        words = command.split()
+        verb = words[0].lower() if words else ''
+
+        self.command = command
+        self.module = module
+        self.deferred = defer.Deferred()
+        self.is_table = verb in TABLE_COMMANDS
+
+        # The user the command is about, if any
+        self.username = None
+
+        if len(words) > USER_COMMANDS.get(verb, len(words)):
+
+            self.username = words[USER_COMMANDS[verb]]
+
+        # Lines of a table reply, and the number of borders seen so far
+        self.table = []
+        self.borders = 0
+
+        # The reply: a line, or a list of rows for a table
+        self.result = None
+
+        self.deadline = None
+        self.timed_out = False
+
+    def cancel_deadline(self):
+        """ Cancels the reply deadline, if one is still pending.
+
+        """
+
+        if self.deadline is not None and self.deadline.active():
+
+            self.deadline.cancel()
+
+        self.deadline = None
+
+    def finish(self, result):
+        """ Fires the Deferred, unless the command has already timed out.
+
+        :param result: the reply, or a Failure
+
+        """
+
+        self.cancel_deadline()
+
+        if not self.deferred.called:
+
+            self.deferred.callback(result)
+
+
+class ZNCControlPanel():
+    """ Sends commands to `*controlpanel`, and matches the replies to them.
+
+    There are three ways to send commands:
+
+        - `call` sends one command, and `batch` sends a group of commands
+          that must go together.  Both wait for a slot first, so that no
+          more than `max_concurrent` of them are waiting on ZNC at once.
+        - `execute` sends a group of commands straight away.  It is used by
+          the registration engine, which limits itself.
+
+    """
+
+    def __init__(self, pool, max_concurrent=20, reply_timeout=30.0,
+                 reactor=None):
+        """ Creates the client.
+
+        :param pool: the ConnectionPool whose sessions commands are sent on
+        :param max_concurrent: the most `call`s and `batch`es that may wait
+                               on ZNC at once
+        :param reply_timeout: the seconds ZNC has to answer a `call` or
+                              `batch`
+        :param reactor: the reactor used to schedule timeouts (default = the
+                        global reactor)
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.pool = pool
+        self.reply_timeout = reply_timeout
+        self.reactor = reactor
+        self.semaphore = defer.DeferredSemaphore(max_concurrent)
+
+        # {session: deque of PendingCommands}, in the order they were sent
+        self.awaiting_reply = {}
+
+        # How many replies were matched, late, unmatched, and so on
+        self.counts = Counter()
+
+    def call(self, command, priority=INTERACTIVE, session=None,
+             module=CONTROL_PANEL, backend=None):
+        """ Sends a single command, once a slot is free.
+
+        :param command: the command, without the `*controlpanel` prefix
+        :param priority: the scheduler priority (INTERACTIVE or BULK)
+        :param session: the admin session to send on (default = least busy)
+        :param module: the module to send to (default = `*controlpanel`)
+        :param backend: the ZNC backend to send to, when no session is given
+                        (default = any)
+
+        :return: a Deferred that fires with the reply (a line, or a list of
+                 rows for a table), or fails with a ControlPanelError
+
+        """
+
+        return self.batch([command], priority, session, module,
+                          backend).addCallback(lambda replies: replies[0])
+
+    def batch(self, commands, priority=INTERACTIVE, session=None,
+              module=CONTROL_PANEL, backend=None):
+        """ Sends a group of commands together, on one session, once a slot
+        is free.
+
+        :param commands: a list of commands, without the prefix
+        :param priority: the scheduler priority (INTERACTIVE or BULK)
+        :param session: the admin session to send on (default = least busy)
+        :param module: the module to send to (default = `*controlpanel`)
+        :param backend: the ZNC backend to send to, when no session is given
+                        (default = any)
+
+        :return: a Deferred that fires with the list of replies, or fails
+                 with the first ControlPanelError
+
+        """
+
+        return self.semaphore.run(self.send_batch, commands, priority,
+                                  session, module, backend)
+
+    def send_batch(self, commands, priority, session, module, backend=None):
+        """ Sends a group of commands, and gathers their replies.
+
+        :param commands: a list of commands, without the prefix
+        :param priority: the scheduler priority
+        :param session: the admin session to send on, or None
+        :param module: the module to send to
+        :param backend: the ZNC backend to send to, or None
+
+        :return: a Deferred that fires with the list of replies
+
+        """
+
+        replies = self.execute(commands, priority, session,
+                               timeout=self.reply_timeout, module=module,
+                               backend=backend)[1]
+
+        gathered = defer.gatherResults(replies, consumeErrors=True)
+
+        # Only the first failure is passed on, rather than a FirstError
+        gathered.addErrback(lambda error: error.value.subFailure)
+
+        return gathered
+
+    def execute(self, commands, priority=INTERACTIVE, session=None,
+                on_sent=None, timeout=None, module=CONTROL_PANEL,
+                backend=None):
+        """ Sends a group of commands straight away, as one scheduler batch.
+
+        :param commands: a list of commands, without the prefix
+        :param priority: the scheduler priority (INTERACTIVE or BULK)
+        :param session: the admin session to send on (default = least busy)
+        :param on_sent: an optional function called once the batch is
+                        written
+        :param timeout: the seconds ZNC has to answer each command once it
+                        is written, or None to wait as long as it takes
+        :param module: the module to send to (default = `*controlpanel`)
+        :param backend: the ZNC backend to send to, when no session is given
+                        (default = any)
+
+        :return: a tuple of (batch, replies), where batch is the scheduled
+                 Batch (or None if there was no session), and replies is a
+                 list of Deferreds, one for each command
+
+        """
+
+        if session is None:
+
+            session = self.pool.pick(backend)
+
+        if session is None:
+
+            return None, [defer.fail(NoSession('No ZNC session available'))
+                          for _ in commands]
+
+        pending = [PendingCommand(command, module) for command in commands]
+
+        # The lines of a batch may be written some time apart, and ZNC can
+        # answer the first before the last is written
+        unsent = deque(pending)
+
+        batch = session.scheduler.enqueue(
+            ['PRIVMSG {} {}'.format(module, command) for command in commands],
+            priority, on_sent,
+            lambda: self.sent(session, unsent.popleft(), timeout))
+
+        return batch, [command.deferred for command in pending]
+
+    def sent(self, session, command, timeout):
+        """ Starts waiting for the reply to a command that has been written.
+
+        :param session: the session the command was written on
+        :param command: the PendingCommand
+        :param timeout: the seconds ZNC has to answer, or None
+
+        """
+
+        self.awaiting_reply.setdefault(session, deque()).append(command)
+
+        if timeout is not None:
+
+            command.deadline = self.reactor.callLater(
+                timeout, self.timed_out, command)
+
+    def timed_out(self, command):
+        """ Fails a command that ZNC has not answered in time.  It keeps its
+        place in the FIFO, so a late reply is not given to the next command.
+
+        :param command: the PendingCommand that timed out
+
+        """
+
+        command.deadline = None
+        command.timed_out = True
+
+        self.counts['timeout'] += 1
+
+        command.deferred.errback(ReplyTimeout(
+            'ZNC did not answer: ' + command.command.split(' ', 1)[0]))
+
+    def feed(self, session, line, module=CONTROL_PANEL):
+        """ Reads one line from a module, and hands it to the command it
+        answers.
+
+        :param session: the session the line arrived on
+        :param line: the line of feedback
+        :param module: the module the line came from
+
+        :return: True if the line answered a command
+
+        """
+
+        queue = self.awaiting_reply.get(session)
+
+        if not queue or queue[0].module != module:
+
+            self.counts['unmatched'] += 1
+
+            return False
+
+        named = NAMED_REPLY.match(line)
+
+        if named and queue[0].username != named.group('username'):
+
+            self.skip_to(queue, named.group('username'))
+
+        command = queue[0]
+
+        if command.is_table:
+
+            if not self.read_table_line(command, line):
+
+                return True
+
+        else:
+
+            command.result = line
+
+        queue.popleft()
+
+        if command.timed_out:
+
+            self.counts['late'] += 1
+
+        else:
+
+            self.counts['answered'] += 1
+
+        command.finish(command.result)
+
+        return True
+
+    def read_table_line(self, command, line):
+        """ Adds a line to a table reply.  A table has a border above the
+        header, below the header, and at the bottom.  A command that prints
+        a table may answer with a single line instead (such as
+        `No networks`), which counts as an empty table.
+
+        :param command: the PendingCommand the table belongs to
+        :param line: the line of feedback
+
+        :return: True if the reply is complete, with the rows in
+                 `command.result`
+
+        """
+
+        if line.startswith('+'):
+
+            command.borders += 1
+
+            if command.borders < 3:
+
+                return False
+
+            header = [cell.lower() for cell in command.table[0]]
+
+            command.result = [dict(zip(header, row))
+                              for row in command.table[1:]]
+
+            return True
+
+        if line.startswith('|'):
+
+            command.table.append([cell.strip()
+                                  for cell in line.strip('|').split('|')])
+
+            return False
+
+        command.result = []
+
+        return True
+
+    def skip_to(self, queue, username):
+        """ Takes every command ahead of the one a named reply belongs to out
+        of a FIFO.  ZNC has answered a later command, so they will never be
+        answered.  If no command is about that user, nothing is skipped.
+
+        :param queue: the session's FIFO
+        :param username: the user named in the reply
+
+        """
+
+        if not any(command.username == username for command in queue):
+
+            return
+
+        while queue[0].username != username:
+
+            self.counts['skipped'] += 1
+
+            queue.popleft().finish(failure.Failure(NoReply(
+                'ZNC skipped the reply')))
+
+    def session_lost(self, session):
+        """ Fails every command waiting on a session that has lost its
+        connection.  Commands that have not been written yet stay queued on
+        the session, and are sent when it reconnects.
+
+        :param session: the admin session that was lost
+
+        """
+
+        queue = self.awaiting_reply.pop(session, ())
+
+        for command in queue:
+
+            command.finish(failure.Failure(SessionLost(
+                'Lost connection to ZNC')))
+
+    @property
+    def waiting(self):
+        """ The number of commands waiting on a reply, across all sessions.
+
+        """
+
+        return sum(len(queue) for queue in self.awaiting_reply.values())
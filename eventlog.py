@@ -0,0 +1,368 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the event log.  Log messages are recorded as structured events,
+one JSON object per line:
+
+    {"event": "sockjs_opened", "level": "info", "msg": "...", "t": ...}
+
+Recording an event only appends a dict to a buffer.  The buffer is encoded
+and written every `flush_interval` seconds on a thread, so a slow consumer
+of the output (such as a pipe) never blocks the reactor.  If the output
+falls so far behind that the buffer fills, new events are dropped (and
+counted) rather than held in memory.
+
+Events that happen on every registration or connection can be sampled, so
+only one in every N of them is kept.  Every event is checked for secrets
+before it is buffered: fields named like passwords are masked, and so are
+the passwords in ZNC commands, so the lines sent to ZNC can be traced
+safely at the debug level.
+
+The level can be changed at any time with `set_level`.
+
+"""
+
+from twisted.internet import threads
+from twisted.python import log, failure, threadable
+
+import json
+import re
+import sys
+import time
+
+# The levels an event can have, lowest first
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+
+LEVEL_NAMES = dict((number, name) for name, number in LEVELS.items())
+
+# What a secret is replaced with
+REDACTED = '***'
+
+# Fields whose values are always masked
+SECRET_FIELDS = ('password', 'pass', 'secret', 'token')
+
+# Passwords inside lines sent to ZNC: `Set Password <user> <password>`,
+# `AddUser <user> <password>`, and the IRC `PASS` line
+SECRET_PATTERNS = (
+    re.compile(r'(?i)(\bset\s+password\s+\S+\s+)\S+'),
+    re.compile(r'(?i)(\badduser\s+\S+\s+)\S+'),
+    re.compile(r'(?i)(^PASS\s+)\S+'),
+)
+
+
+def parse_level(name):
+    """ This function turns the name of a level into its number.
+
+    :param name: the name of a level, in any case (such as 'info')
+
+    :raises ValueError: if there is no level with that name
+
+    :return: the level number
+
+    """
+
+    try:
+
+        return LEVELS[name.strip().lower()]
+
+    except KeyError:
+
+        raise ValueError('Unknown log level: ' + name)
+
+
+def parse_sampling(text):
+    """ This function reads a list of sampled events, such as
+    `sockjs_opened:10, irc_line:100`, meaning that one in every 10
+    `sockjs_opened` events (and one in every 100 `irc_line` events) is kept.
+
+    :param text: the comma separated list of event:N pairs
+
+    :raises ValueError: if a pair is not an event and a positive number
+
+    :return: a dict of {event: N}
+
+    """
+
+    sampling = {}
+
+    for pair in text.split(','):
+
+        if not pair.strip():
+
+            continue
+
+        event, separator, every = pair.partition(':')
+
+        if not separator or not event.strip() or not every.strip().isdigit() \
+                or int(every) < 1:
+
+            raise ValueError('Invalid log sampling: ' + pair.strip())
+
+        sampling[event.strip()] = int(every)
+
+    return sampling
+
+
+def redact(value):
+    """ This function masks any passwords in a line of text.
+
+    :param value: the text
+
+    :return: the text, with each password replaced by REDACTED
+
+    """
+
+    for pattern in SECRET_PATTERNS:
+
+        value = pattern.sub(r'\g<1>' + REDACTED, value)
+
+    return value
+
+
+class EventLog():
+    """ A buffered log of structured events, written off the reactor
+    thread.
+
+    """
+
+    def __init__(self, stream=sys.stdout, level=INFO, sampling=None,
+                 flush_interval=0.5, max_buffered=10000, reactor=None):
+        """ Creates the log.  Nothing is written until the first event.
+
+        :param stream: the file events are written to
+        :param level: the lowest level that is recorded
+        :param sampling: a dict of {event: N}, where only one in every N of
+                         that event is kept
+        :param flush_interval: the longest an event waits before it is
+                               written, in seconds
+        :param max_buffered: the most events that may wait to be written
+        :param reactor: the reactor used to schedule flushes (default = the
+                        global reactor)
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.stream = stream
+        self.level = level
+        self.sampling = sampling or {}
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.reactor = reactor
+
+        self.buffer = []
+        self.flush_call = None
+        self.writing = False
+
+        # {event: number seen}, for sampled events
+        self.seen = {}
+
+        self.written = 0
+        self.dropped = 0
+
+    def set_level(self, level):
+        """ Changes the lowest level that is recorded.
+
+        :param level: a level number, or the name of one
+
+        """
+
+        if isinstance(level, basestring):
+
+            level = parse_level(level)
+
+        self.level = level
+
+    def enabled(self, level):
+        """ Whether events at a level are recorded.  This is cheap, so it
+        can be checked before building an expensive message.
+
+        :param level: the level number
+
+        """
+
+        return level >= self.level
+
+    def log(self, level, event, message=None, **fields):
+        """ Records an event, if its level is enabled and it is not sampled
+        out.
+
+        :param level: the level number
+        :param event: the name of the event (such as 'sockjs_opened')
+        :param message: an optional human readable message
+        :param fields: any other details of the event
+
+        """
+
+        if level < self.level:
+
+            return
+
+        every = self.sampling.get(event)
+
+        if every is not None:
+
+            count = self.seen.get(event, 0)
+            self.seen[event] = count + 1
+
+            if count % every:
+
+                return
+
+            fields['sampled'] = every
+
+        if len(self.buffer) >= self.max_buffered:
+
+            self.dropped += 1
+
+            return
+
+        entry = {'t': round(time.time(), 3),
+                 'level': LEVEL_NAMES.get(level, level),
+                 'event': event}
+
+        if message is not None:
+
+            entry['msg'] = redact(message)
+
+        for name, value in fields.iteritems():
+
+            if name.lower() in SECRET_FIELDS:
+
+                value = REDACTED
+
+            elif isinstance(value, basestring):
+
+                value = redact(value)
+
+            entry[name] = value
+
+        self.buffer.append(entry)
+
+        if self.flush_call is None:
+
+            self.flush_call = self.reactor.callLater(self.flush_interval,
+                                                     self.flush)
+
+    def observe(self, event_dict):
+        """ Records a message from Twisted's own log.  Pass this to
+        `twisted.python.log.startLoggingWithObserver`, so Twisted's messages
+        are buffered like any other.
+
+        Twisted calls its observers on whichever thread logged the message
+        (such as a Flask request in the WSGI thread pool), so a message from
+        another thread is handed to the reactor thread first.  Until the
+        reactor starts, there are no other threads.
+
+        :param event_dict: the Twisted log event
+
+        """
+
+        if threadable.ioThread is not None and \
+                not threadable.isInIOThread():
+
+            self.reactor.callFromThread(self.observe, event_dict)
+
+            return
+
+        text = log.textFromEventDict(event_dict)
+
+        if text is not None:
+
+            self.log(ERROR if event_dict.get('isError') else INFO,
+                     'twisted', text, system=event_dict.get('system', '-'))
+
+    def flush(self):
+        """ Hands every buffered event to a thread to be written.  Only one
+        write runs at a time; events that arrive meanwhile wait for the
+        next flush.
+
+        """
+
+        if self.flush_call is not None and self.flush_call.active():
+
+            self.flush_call.cancel()
+
+        self.flush_call = None
+
+        if not self.buffer or self.writing:
+
+            if self.buffer:
+
+                self.flush_call = self.reactor.callLater(self.flush_interval,
+                                                         self.flush)
+
+            return
+
+        entries, self.buffer = self.buffer, []
+
+        self.writing = True
+
+        written = threads.deferToThreadPool(self.reactor,
+                                            self.reactor.getThreadPool(),
+                                            self.write, entries)
+        written.addBoth(self.write_finished, len(entries))
+
+    def write(self, entries):
+        """ Encodes and writes a list of events.  This blocks, so it is run
+        on a thread (or at shutdown).
+
+        :param entries: a list of event dicts
+
+        """
+
+        self.stream.write(''.join(json.dumps(entry, sort_keys=True,
+                                             default=str) + '\n'
+                                  for entry in entries))
+        self.stream.flush()
+
+    def write_finished(self, result, count):
+        """ Called once a thread has written a list of events.
+
+        :param result: the result of the write, or a Failure if it could
+                       not be written
+        :param count: the number of events in the write
+
+        """
+
+        self.writing = False
+
+        if isinstance(result, failure.Failure):
+
+            self.dropped += count
+
+        else:
+
+            self.written += count
+
+    def close(self):
+        """ Writes anything still buffered, straight away.  Called at
+        shutdown, when the thread pool may already be stopping.
+
+        """
+
+        if self.flush_call is not None and self.flush_call.active():
+
+            self.flush_call.cancel()
+
+        self.flush_call = None
+
+        if self.buffer:
+
+            entries, self.buffer = self.buffer, []
+
+            self.write(entries)
+            self.written += len(entries)
@@ -0,0 +1,353 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the registration journal.  Every step of every registration is
+appended to a JSON-lines file, one object per line:
+
+    {"t": 1419000000.0, "user": "someone", "step": "cloned"}
+
+Entries are buffered and written (and fsync'd) together every
+`flush_interval` seconds, so a rush of signups costs one disk write per
+interval rather than one per IRC line.  Passwords are never written.
+
+When the registration server starts, the journal is replayed.  A user who
+was cloned but never finished being configured still has the template
+user's password, so they are rolled back (deleted) once ZNC is reachable.
+
+The journal also serves as an audit log, and can be queried from the
+command line.
+
+    Usage:
+        journal.py [options] <journal>
+
+    Arguments:
+        <journal>               The journal file to read
+
+    Options:
+        -h --help               Show this screen
+        --user=<name>           Only show entries for this user
+        --step=<step>           Only show entries for this step
+        --since=<seconds>       Only show entries from the last <seconds>
+        --partial               Only show users whose last step left them
+                                half-registered
+
+"""
+
+import json
+import os
+import time
+
+# The steps of a registration, in order.  A user whose last step is CLONED
+# exists on ZNC, but may still have the template user's settings.
+CLONE_SENT = 'clone_sent'
+CLONED = 'cloned'
+COMPLETE = 'complete'
+FAILED = 'failed'
+ROLLED_BACK = 'rolled_back'
+
+# A registration accepted while ZNC was unreachable.  The offline queue
+# looks after it from then on, so it needs no attention here.
+QUEUED = 'queued'
+
+# The steps an account can go through after it is registered
+DELETED = 'deleted'
+DISABLED = 'disabled'
+ENABLED = 'enabled'
+PASSWORD_RESET = 'password_reset'
+
+# The steps after which a user needs no more attention
+FINAL_STEPS = (COMPLETE, FAILED, ROLLED_BACK, QUEUED, DELETED, DISABLED,
+               ENABLED, PASSWORD_RESET)
+
+# Fields that must never reach the disk
+SECRET_FIELDS = ('password',)
+
+
+class Journal():
+    """ An append-only journal of registration steps.
+
+    """
+
+    def __init__(self, path, flush_interval=1.0, reactor=None):
+        """ Opens (or creates) the journal.
+
+        :param path: the path of the journal file
+        :param flush_interval: the longest an entry waits before it is
+                               written, in seconds
+        :param reactor: the reactor used to schedule flushes (default = the
+                        global reactor)
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.path = path
+        self.flush_interval = flush_interval
+        self.reactor = reactor
+
+        self.buffer = []
+        self.flush_call = None
+        self.entries_written = 0
+
+        self.journal_file = open(path, 'a+')
+
+        # A crash can leave a torn last line; new entries start on their own
+        self.journal_file.seek(0, os.SEEK_END)
+
+        if self.journal_file.tell() > 0:
+
+            self.journal_file.seek(-1, os.SEEK_END)
+
+            if self.journal_file.read(1) != '\n':
+
+                self.journal_file.write('\n')
+
+    def record(self, username, step, **fields):
+        """ Adds an entry to the journal.  It is written with the next flush.
+
+        :param username: the user the step belongs to
+        :param step: the step that was reached
+        :param fields: any other details worth keeping (never a password)
+
+        """
+
+        entry = {'t': round(time.time(), 3), 'user': username, 'step': step}
+
+        for name, value in fields.iteritems():
+
+            if name not in SECRET_FIELDS:
+
+                entry[name] = value
+
+        self.buffer.append(json.dumps(entry, sort_keys=True) + '\n')
+
+        if self.flush_call is None:
+
+            self.flush_call = self.reactor.callLater(self.flush_interval,
+                                                     self.flush)
+
+    def flush(self):
+        """ Writes every buffered entry, and waits for them to reach the
+        disk.
+
+        """
+
+        if self.flush_call is not None and self.flush_call.active():
+
+            self.flush_call.cancel()
+
+        self.flush_call = None
+
+        if not self.buffer:
+
+            return
+
+        self.journal_file.write(''.join(self.buffer))
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+        self.entries_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """ Writes anything still buffered, and closes the file.
+
+        """
+
+        self.flush()
+        self.journal_file.close()
+
+
+def read_entries(path, username=None):
+    """ This function reads the entries of a journal, in order.  A torn last
+    line (from a crash in the middle of a write) is skipped.
+
+    :param path: the path of the journal file
+    :param username: if given, only this user's entries are returned
+
+    :return: a generator of entry dicts
+
+    """
+
+    if not os.path.exists(path):
+
+        return
+
+    # A cheap substring test skips most lines without decoding them
+    needle = None if username is None else json.dumps(username)
+
+    with open(path) as journal_file:
+
+        for line in journal_file:
+
+            if needle is not None and needle not in line:
+
+                continue
+
+            try:
+
+                entry = json.loads(line)
+
+            except ValueError:
+
+                continue
+
+            if username is None or entry.get('user') == username:
+
+                yield entry
+
+
+def last_steps(path):
+    """ This function replays a journal, and finds where each user got to.
+
+    :param path: the path of the journal file
+
+    :return: a dict of {username: the user's last entry}
+
+    """
+
+    latest = {}
+
+    for entry in read_entries(path):
+
+        latest[entry['user']] = entry
+
+    return latest
+
+
+def partial_users(path):
+    """ This function finds every user that was left half-registered: cloned
+    on ZNC, but never finished (or sent, but never answered).
+
+    :param path: the path of the journal file
+
+    :return: a dict of {username: the user's last entry}, for users whose
+             last step is not final
+
+    """
+
+    return dict((username, entry)
+                for username, entry in last_steps(path).iteritems()
+                if entry['step'] not in FINAL_STEPS)
+
+
+def registration_times(path):
+    """ This function finds when each user that still exists was registered.
+    Users that were deleted (or rolled back) since are left out.
+
+    :param path: the path of the journal file
+
+    :return: a dict of {username: the time their registration completed}
+
+    """
+
+    registered = {}
+
+    for entry in read_entries(path):
+
+        if entry['step'] == COMPLETE:
+
+            registered[entry['user']] = entry['t']
+
+        elif entry['step'] in (DELETED, ROLLED_BACK):
+
+            registered.pop(entry['user'], None)
+
+    return registered
+
+
+def apply_placement(placements, entry):
+    """ This function updates a dict of placements with one journal entry.
+    A user is placed on a backend once they are cloned there, and forgotten
+    once they are deleted (or rolled back).
+
+    :param placements: a dict of {username: backend name}, which is updated
+    :param entry: an entry dict
+
+    """
+
+    if entry.get('step') == CLONED and 'backend' in entry:
+
+        placements[entry['user']] = entry['backend']
+
+    elif entry.get('step') in (DELETED, ROLLED_BACK):
+
+        placements.pop(entry.get('user'), None)
+
+
+def placements(path):
+    """ This function finds the backend that holds each user, for users
+    registered since there could be several backends.
+
+    :param path: the path of the journal file
+
+    :return: a dict of {username: backend name}
+
+    """
+
+    placed = {}
+
+    for entry in read_entries(path):
+
+        apply_placement(placed, entry)
+
+    return placed
+
+
+def format_entry(entry):
+    """ This function formats an entry for the command line.
+
+    :param entry: an entry dict
+
+    :return: a single line of text
+
+    """
+
+    extra = ' '.join('{}={}'.format(name, json.dumps(value))
+                     for name, value in sorted(entry.items())
+                     if name not in ('t', 'user', 'step'))
+
+    return '{} {:<16} {:<12} {}'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['t'])),
+        entry['user'], entry['step'], extra).rstrip()
+
+
+if __name__ == '__main__':
+
+    from docopt import docopt
+
+    options = docopt(__doc__)
+
+    if options['--partial']:
+
+        entries = sorted(partial_users(options['<journal>']).values(),
+                         key=lambda entry: entry['t'])
+
+    else:
+
+        entries = read_entries(options['<journal>'], options['--user'])
+
+    since = None
+
+    if options['--since']:
+
+        since = time.time() - float(options['--since'])
+
+    for entry in entries:
+
+        if options['--user'] and entry['user'] != options['--user']:
+
+            continue
+
+        if options['--step'] and entry['step'] != options['--step']:
+
+            continue
+
+        if since is not None and entry['t'] < since:
+
+            continue
+
+        print format_entry(entry)
@@ -0,0 +1,291 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the account lifecycle module.  It runs one action (delete, disable,
+enable or password reset) over a list of existing accounts, a window at a
+time and at bulk priority, so that pruning thousands of accounts never
+floods ZNC or holds up signups.
+
+A job also has a time limit.  Once it passes, no more accounts are started,
+and the rest are reported as not attempted, so a job always finishes in
+bounded time even if ZNC is slow.
+
+"""
+
+from twisted.internet import defer
+
+import csv
+import json
+import random
+import time
+
+from bulk import percentile
+
+# The actions a job can run
+DELETE = 'delete'
+DISABLE = 'disable'
+ENABLE = 'enable'
+RESET_PASSWORD = 'reset_password'
+
+ACTIONS = (DELETE, DISABLE, ENABLE, RESET_PASSWORD)
+
+# The value `*lastseen` shows for a user that has never logged in
+NEVER_SEEN = 'never'
+
+
+def parse_usernames(lines, file_format='csv'):
+    """ This function reads usernames from the lines of a CSV or JSONL file.
+    A CSV file may have a `username` header row, and only its first column
+    is read.  Each line of a JSONL file is an object with a `username`.
+
+    :param lines: an iterable of lines from the file
+    :param file_format: either 'csv' or 'jsonl'
+
+    :return usernames: a list of usernames, without duplicates
+
+    """
+
+    usernames = []
+
+    if file_format == 'jsonl':
+
+        for line in lines:
+
+            line = line.strip()
+
+            if line:
+
+                usernames.append(json.loads(line)['username'])
+
+    else:
+
+        for row in csv.reader(lines):
+
+            if row and row[0].strip() and \
+                    row[0].strip().lower() != 'username':
+
+                usernames.append(row[0].strip())
+
+    seen = set()
+
+    return [username for username in usernames
+            if not (username in seen or seen.add(username))]
+
+
+def generate_password(characters, length=16):
+    """ This function makes a random password for a password reset.
+
+    :param characters: a string of the characters passwords may use
+    :param length: the length of the password
+
+    :return: the new password
+
+    """
+
+    chooser = random.SystemRandom()
+
+    return ''.join(chooser.choice(characters) for _ in range(length))
+
+
+def select_unused(last_seen, registered, cutoff, protected=()):
+    """ This function picks the accounts a prune should delete: ones that
+    were registered here before the cutoff, and have never logged in.
+    Accounts that were not registered here are never picked.
+
+    :param last_seen: the rows of the `*lastseen` table, as dicts with
+                      'user' and 'last seen'
+    :param registered: a dict of {username: registration time}, from the
+                       journal
+    :param cutoff: only accounts registered before this time are picked
+    :param protected: lower case usernames that are never picked
+
+    :return: a sorted list of usernames
+
+    """
+
+    return sorted(row['user'] for row in last_seen
+                  if row.get('last seen', '').lower() == NEVER_SEEN and
+                  registered.get(row.get('user'), cutoff) < cutoff and
+                  row['user'].lower() not in protected)
+
+
+class AccountJob():
+    """ A single lifecycle action, run over a list of accounts.  Accounts
+    are started a window at a time, like a BulkJob.
+
+    """
+
+    def __init__(self, action, usernames, run, window=20, time_limit=None):
+        """ Creates the job.  Nothing is sent until `start()`.
+
+        :param action: the name of the action (one of ACTIONS)
+        :param usernames: the accounts to run it on
+        :param run: a function taking a username and returning a Deferred
+                    that fires with (succeeded, message)
+        :param window: the number of accounts allowed in flight at once
+        :param time_limit: the seconds after which no more accounts are
+                           started, or None for no limit
+
+        """
+
+        self.action = action
+        self.usernames = usernames
+        self.run = run
+        self.window = window
+        self.time_limit = time_limit
+
+        self.next_user = 0
+        self.outstanding = 0
+
+        # True while the window is being filled.  An action that answers
+        # straight away must not start filling it again from inside.
+        self.filling = False
+
+        self.succeeded = []
+        self.failed = []
+        self.latencies = []
+
+        # Details worth reporting for each account (such as a new password)
+        self.details = {}
+
+        self.started = None
+        self.finished = None
+        self.done = defer.Deferred()
+
+    def start(self):
+        """ Starts running the action.
+
+        :return done: a Deferred that fires with the report once every
+                      account has an answer
+
+        """
+
+        self.started = time.time()
+
+        self.fill_window()
+
+        return self.done
+
+    @property
+    def expired(self):
+        """ Whether the job has passed its time limit.
+
+        """
+
+        return self.time_limit is not None and \
+            time.time() - self.started > self.time_limit
+
+    def fill_window(self):
+        """ Starts accounts until the window is full, the list runs out, or
+        the time limit has passed.
+
+        """
+
+        if self.filling:
+
+            return
+
+        self.filling = True
+
+        while self.outstanding < self.window and \
+                self.next_user < len(self.usernames) and not self.expired:
+
+            username = self.usernames[self.next_user]
+            self.next_user += 1
+            self.outstanding += 1
+
+            started = time.time()
+
+            answered = self.run(username)
+            answered.addErrback(lambda reason: (False,
+                                                reason.getErrorMessage()))
+            answered.addCallback(self.account_complete, username, started)
+
+        self.filling = False
+
+        if self.outstanding == 0 and self.finished is None:
+
+            self.finished = time.time()
+
+            self.done.callback(self.report())
+
+    def account_complete(self, outcome, username, started):
+        """ Called once an account has an answer.
+
+        :param outcome: a tuple of (succeeded, message), where message may
+                        also be a dict of details to report
+        :param username: the account
+        :param started: when the account was started
+
+        """
+
+        succeeded, message = outcome
+
+        self.outstanding -= 1
+        self.latencies.append(time.time() - started)
+
+        if isinstance(message, dict):
+
+            self.details[username] = message
+
+        if succeeded:
+
+            self.succeeded.append(username)
+
+        else:
+
+            self.failed.append((username, message))
+
+        self.fill_window()
+
+    def forget_details(self):
+        """ Forgets the details gathered so far, once they have been
+        reported, so a new password is never handed out twice.
+
+        """
+
+        self.details = {}
+
+    def progress(self):
+        """ The current state of the job.
+
+        :return: a dict of counts, suitable for sending as JSON
+
+        """
+
+        return {
+            'action': self.action,
+            'total': len(self.usernames),
+            'started': self.next_user,
+            'in_flight': self.outstanding,
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+            'not_attempted': len(self.usernames) - self.next_user,
+            'finished': self.finished is not None,
+        }
+
+    def report(self):
+        """ The report for the job, including every failure and any
+        details (such as new passwords).
+
+        :return: a dict with the progress counts, accounts/sec, p50/p99
+                 latency in seconds, the failures and the details
+
+        """
+
+        end = self.finished if self.finished is not None \
+            else time.time()
+        elapsed = max(end - (self.started or end), 0.000001)
+
+        report = self.progress()
+        report.update({
+            'elapsed': elapsed,
+            'accounts_per_second': len(self.latencies) / elapsed,
+            'latency_p50': percentile(self.latencies, 0.50),
+            'latency_p99': percentile(self.latencies, 0.99),
+            'failures': dict(self.failed),
+            'details': self.details,
+        })
+
+        return report
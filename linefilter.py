@@ -0,0 +1,116 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the inbound line filter.  An admin session only needs three kinds
+of line from ZNC: replies from the admin modules, private messages to the
+bot, and the lines IRCClient needs to stay signed on (the welcome, PING and
+so on).  If the admin user sits in busy channels, or ZNC plays back its
+buffers when the session connects, everything else is chatter.
+
+Each raw line is matched against a few precompiled patterns before Twisted
+parses it:
+
+    - a reply from an admin module (`:*controlpanel!znc@znc.in PRIVMSG ...`)
+      is split out directly and handed to a callback, skipping IRCClient's
+      parsing and CTCP handling
+    - channel messages, other users' joins, parts and quits, and channel
+      information (topics, names and modes) are dropped, and counted by
+      reason
+    - anything else is left for IRCClient, as before
+
+Only the start of a line (and, for replies, the first character of the
+message) is looked at, so checking a line costs far less than parsing it.
+
+"""
+
+from collections import Counter
+import re
+
+# The first character of every channel name
+CHANNEL_PREFIXES = '#&!+'
+
+# Numerics that only describe a channel: its modes (324), creation time
+# (329), topic (332, 333) and names (353, 366)
+CHANNEL_NUMERICS = ('324', '329', '332', '333', '353', '366')
+
+# Commands that only report on other users in a channel
+MEMBERSHIP_COMMANDS = ('JOIN', 'PART', 'KICK', 'QUIT', 'NICK', 'TOPIC')
+
+# The reasons a line can be dropped for
+CHANNEL_MESSAGE = 'channel_message'
+MEMBERSHIP = 'membership'
+CHANNEL_INFO = 'channel_info'
+
+
+class LineFilter():
+    """ Sorts the raw lines of one IRC connection before IRCClient sees
+    them.  The patterns are compiled once, when the connection is made.
+
+    """
+
+    def __init__(self, nickname, admin_modules, on_admin_reply,
+                 dropped=None):
+        """ Compiles the patterns.
+
+        :param nickname: the session's own nickname.  Its own joins, parts
+                         and nick changes are never dropped, as IRCClient
+                         acts on them.
+        :param admin_modules: the names of the ZNC modules whose replies
+                              are handed straight to `on_admin_reply`
+        :param on_admin_reply: a function taking (module, message)
+        :param dropped: a Counter of dropped lines by reason, to add to
+                        (default = a new one)
+
+        """
+
+        channel = '[' + re.escape(CHANNEL_PREFIXES) + ']'
+
+        # A non-empty message that is not CTCP, and has no low-level
+        # quoting, reaches `privmsg` unchanged, so it can skip IRCClient
+        self.admin_reply = re.compile(
+            r':(?P<module>{})!\S* PRIVMSG \S+ :'
+            r'(?P<message>[^\x01\x10][^\x10]*)$'.format(
+                '|'.join(re.escape(module) for module in admin_modules)))
+
+        self.chatter = re.compile(
+            r':(?:\S+ (?P<{}>(?:PRIVMSG|NOTICE) {channel})'
+            r'|\S+ (?P<{}>(?:{}) )'
+            r'|(?!{}[! ])\S+ (?P<{}>(?:{}) |MODE {channel}))'.format(
+                CHANNEL_MESSAGE,
+                CHANNEL_INFO, '|'.join(CHANNEL_NUMERICS),
+                re.escape(nickname),
+                MEMBERSHIP, '|'.join(MEMBERSHIP_COMMANDS),
+                channel=channel))
+
+        self.on_admin_reply = on_admin_reply
+        self.dropped = dropped if dropped is not None else Counter()
+
+    def handle(self, line):
+        """ Deals with a raw line, if it can be dealt with without parsing
+        it.
+
+        :param line: the raw line, without its line ending
+
+        :return: True if the line was handed on or dropped, or False if
+                 IRCClient should parse it
+
+        """
+
+        reply = self.admin_reply.match(line)
+
+        if reply is not None:
+
+            self.on_admin_reply(reply.group('module'), reply.group('message'))
+
+            return True
+
+        chatter = self.chatter.match(line)
+
+        if chatter is not None:
+
+            self.dropped[chatter.lastgroup] += 1
+
+            return True
+
+        return False
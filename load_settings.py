@@ -6,9 +6,44 @@ This is the settings module for the application.  After an instance of this
 class is created, it can be used to access any settings that may be in the
 included config file.
 
+`ReloadableSettings` wraps `LocalSettings` so the config file can be changed
+while the app is running.  The file is only read again when its modification
+time changes, so looking up a setting never touches the disk.
+
+Once a config file has been parsed and checked, the result is saved next to
+it as JSON (`znc_settings.conf.cache`), keyed by the file's modification time
+and size.  Until the file changes, later startups load the cache instead of
+parsing the file again.
+
+Modules that need the settings hold a `LazySettings`, so that importing them
+never reads the config file: it is loaded the first time a setting is read,
+and every module asking for the same file shares one `ReloadableSettings`.
+
 """
 
-from ConfigParser import RawConfigParser
+from ConfigParser import RawConfigParser, Error as ConfigError
+
+import json
+import os
+import stat
+import threading
+
+from backends import Backend, parse_backends, STRATEGIES
+
+# Bumped whenever the cached settings would no longer match what
+# LocalSettings builds
+CACHE_VERSION = 2
+
+# The suffix added to the path of a config file for its cache
+CACHE_SUFFIX = '.cache'
+
+# The source of this module (rather than `__file__`, which is the .py on the
+# first import and the .pyc after that)
+MODULE_SOURCE = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+# The ReloadableSettings loaded so far, by config file path
+loaded_settings = {}
+loading_lock = threading.Lock()
 
 
 class LocalSettings():
@@ -19,15 +54,29 @@ class LocalSettings():
 
     """
 
-    def __init__(self, config_file='znc_settings.conf'):
+    def __init__(self, config_file='znc_settings.conf', cached=None):
         """ After declaring an instance of this class, settings from the
         config file can easily be accessed as attribute of that instance.
 
 
         :param config_file: the path for the config file the user wishes to use
+        :param cached: the values of settings that were already checked (see
+                       `to_cache`), which are used instead of parsing the
+                       config file
 
         """
 
+        if cached is not None:
+
+            vars(self).update(cached)
+            self.backends = [Backend(**backend) for backend in self.backends]
+
+            return
+
+        # Only needed when the file is actually parsed, and the event log
+        # pulls in Twisted, which the Flask app doesn't otherwise need
+        from eventlog import parse_level, parse_sampling
+
         settings = self.load_settings(config_file)
 
         self.znc_ip = settings['znc_ip_address']
@@ -42,15 +91,98 @@ class LocalSettings():
         self.username_chars = settings['username_characters']
         self.password_chars = settings['password_characters']
 
+        # Optional - extra usernames that may never be registered
+        self.reserved_usernames = [
+            name.strip()
+            for name in settings.get('reserved_usernames', '').split(',')
+            if name.strip()
+        ]
+
         self.register_ip = settings['registration_ip_address']
         self.register_port = int(settings['registration_port_number'])
 
+        # Optional - the URL the registration page opens SockJS connections
+        # to, when it is not simply REGISTER_IP:REGISTER_PORT
+        self.sockjs_url = settings.get('sockjs_url', '')
+
         self.contact_email = settings['contact_email']
 
         self.client_enabled = bool(settings['custom_irc_client_enabled'])
         self.client_ip = settings['client_ip_address']
         self.client_port = int(settings['client_port'])
 
+        # Optional - the ZNC servers new users are spread over.  Without a
+        # [ZNC BACKENDS] section, there is just the one above.
+        self.backends = parse_backends(self.load_backends(config_file),
+                                       self.znc_ip, self.znc_port,
+                                       self.user_to_clone)
+        self.backend_placement = settings.get('backend_placement', 'hash')
+
+        # Optional performance tuning - these fall back to sane defaults
+        # when the section is missing from older config files
+        self.max_in_flight = int(settings.get('max_in_flight_registrations',
+                                              50))
+        self.irc_send_rate = float(settings.get('irc_send_rate', 5.0))
+        self.irc_send_burst = int(settings.get('irc_send_burst', 10))
+        self.znc_connections = int(settings.get('znc_connections', 2))
+        self.health_timeout = float(settings.get('health_timeout', 300))
+        self.reply_timeout = float(settings.get('reply_timeout', 30))
+        self.max_concurrent_commands = int(settings.get(
+            'max_concurrent_commands', 20))
+        self.reconnect_max_delay = float(settings.get('reconnect_max_delay',
+                                                      60))
+        self.bulk_window = int(settings.get('bulk_window', 20))
+        self.account_job_time_limit = float(settings.get(
+            'account_job_time_limit', 3600))
+        self.admin_port = int(settings.get('admin_port_number', 4001))
+        self.web_threads = int(settings.get('web_threads', 10))
+        self.admission_rate = float(settings.get(
+            'registrations_per_minute_per_ip', 6)) / 60
+        self.admission_burst = int(settings.get('registration_burst_per_ip',
+                                                5))
+        self.max_queued_registrations = int(settings.get(
+            'max_queued_registrations', 200))
+        self.proxy_header = settings.get('proxy_header', '')
+        self.snapshot_file = settings.get('snapshot_file',
+                                          'znc_snapshot.json')
+        self.snapshot_interval = float(settings.get('snapshot_interval',
+                                                    3600))
+        self.snapshot_command_rate = float(settings.get(
+            'snapshot_command_rate', 1))
+        self.journal_file = settings.get('journal_file',
+                                         'registration_journal.jsonl')
+        self.journal_flush_interval = float(settings.get(
+            'journal_flush_interval', 1.0))
+        self.offline_queue_file = settings.get('offline_queue_file',
+                                               'offline_queue.jsonl')
+        self.offline_queue_size = int(settings.get('offline_queue_size',
+                                                   1000))
+        self.offline_queue_max_age = float(settings.get(
+            'offline_queue_max_age', 86400))
+        self.offline_drain_rate = float(settings.get('offline_drain_rate',
+                                                     1.0))
+        self.reload_interval = float(settings.get('config_reload_interval',
+                                                  5))
+        self.log_level = parse_level(settings.get('log_level', 'warning'))
+        self.log_sampling = parse_sampling(settings.get('log_sampling', ''))
+        self.inline_client_config = settings.get(
+            'inline_client_config', 'true').lower() in ('true', 'yes', '1')
+        self.quiet_admin_sessions = settings.get(
+            'quiet_admin_sessions', 'true').lower() in ('true', 'yes', '1')
+
+    def to_cache(self):
+        """ This function gets the settings ready to be saved in a cache.
+
+        :return: a dict of every setting, which can be encoded as JSON and
+                 passed back to `LocalSettings` as `cached`
+
+        """
+
+        cached = dict(vars(self))
+        cached['backends'] = [vars(backend) for backend in self.backends]
+
+        return cached
+
     @staticmethod
     def load_settings(config_file_path):
         """ This function creates the RawConfigParser object that parses
@@ -73,6 +205,15 @@ class LocalSettings():
                         'IRC CLIENT OPTIONS',
                         ]
 
+        optional_section_list = ['PERFORMANCE OPTIONS',
+                                 ]
+
+        for section in optional_section_list:
+
+            if config.has_section(section):
+
+                section_list.append(section)
+
         for section in section_list:
 
             options_list = config.options(section)
@@ -81,4 +222,410 @@ class LocalSettings():
 
                 config_settings[option] = config.get(section, option)
 
-        return config_settings
\ No newline at end of file
+        return config_settings
+
+    @staticmethod
+    def load_backends(config_file_path):
+        """ This function reads the `[ZNC BACKENDS]` section of the config
+        file, which is kept apart from the other settings because its option
+        names are the names of the backends.
+
+        :param config_file_path: the file path of the config file
+
+        :return: a list of (name, value) pairs, in the order they are listed
+                 (empty if there is no such section)
+
+        """
+
+        config = RawConfigParser()
+        config.read(config_file_path)
+
+        if not config.has_section('ZNC BACKENDS'):
+
+            return []
+
+        return config.items('ZNC BACKENDS')
+
+    def check(self):
+        """ This function checks that the loaded values make sense together,
+        beyond simply being present and parsing.
+
+        :raises ValueError: if a setting is invalid
+
+        """
+
+        if not self.username_chars or not self.password_chars:
+
+            raise ValueError('The allowed character lists may not be empty')
+
+        for name in ('znc_port', 'register_port', 'admin_port', 'client_port'):
+
+            if not 0 < getattr(self, name) < 65536:
+
+                raise ValueError('Invalid port number for ' + name)
+
+        if self.irc_send_rate <= 0 or self.irc_send_burst < 1 or \
+                self.max_in_flight < 1 or self.max_concurrent_commands < 1:
+
+            raise ValueError('The send rate, burst and in-flight limits '
+                             'must be positive')
+
+        if self.snapshot_interval <= 0 or self.snapshot_command_rate <= 0:
+
+            raise ValueError('The snapshot interval and command rate must be '
+                             'positive')
+
+        if self.backend_placement not in STRATEGIES:
+
+            raise ValueError('BACKEND_PLACEMENT must be one of: ' +
+                             ', '.join(STRATEGIES))
+
+        for backend in self.backends:
+
+            if not 0 < backend.port < 65536 or backend.weight <= 0 or \
+                    (backend.capacity is not None and backend.capacity < 1):
+
+                raise ValueError('Invalid port, weight or capacity for '
+                                 'backend ' + backend.name)
+
+        if self.admission_rate <= 0 or self.admission_burst < 1:
+
+            raise ValueError('The per-IP registration limits must be '
+                             'positive')
+
+        if self.offline_queue_size < 0 or self.offline_queue_max_age <= 0 \
+                or self.offline_drain_rate <= 0:
+
+            raise ValueError('The offline queue size may not be negative, '
+                             'and its age limit and drain rate must be '
+                             'positive')
+
+
+def cache_key(config_file):
+    """ This function identifies the version of a config file that a cache
+    was made from.  A change to this module also changes the key, as
+    LocalSettings may then build different settings from the same file.
+
+    :param config_file: the path of the config file
+
+    :return: a tuple, or None if the file can't be read
+
+    """
+
+    try:
+
+        config_stat = os.stat(config_file)
+        module_mtime = os.stat(MODULE_SOURCE).st_mtime
+
+    except OSError:
+
+        return None
+
+    return (CACHE_VERSION, os.path.abspath(config_file),
+            config_stat.st_mtime, config_stat.st_size, module_mtime)
+
+
+def encode_strings(value):
+    """ This function turns the unicode strings that JSON decodes to back
+    into the UTF-8 byte strings the config file parser gives.
+
+    :param value: a value decoded from JSON
+
+    :return: the same value, with byte strings
+
+    """
+
+    if isinstance(value, unicode):
+
+        return value.encode('utf-8')
+
+    if isinstance(value, list):
+
+        return [encode_strings(item) for item in value]
+
+    if isinstance(value, dict):
+
+        return dict((encode_strings(name), encode_strings(item))
+                    for name, item in value.iteritems())
+
+    return value
+
+
+def read_settings_cache(cache_file, key):
+    """ This function loads the settings saved in a cache.  Whoever can
+    write the cache can change the settings, so one that belongs to another
+    user, or that anyone else can write to, is ignored.
+
+    :param cache_file: the path of the cache
+    :param key: the key of the config file as it is now (see `cache_key`)
+
+    :return: a LocalSettings instance, or None if there is no usable cache
+             for that key
+
+    """
+
+    try:
+
+        with open(cache_file, 'rb') as cache:
+
+            cache_stat = os.fstat(cache.fileno())
+
+            if cache_stat.st_uid != os.getuid() or \
+                    cache_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+
+                return None
+
+            cached = encode_strings(json.load(cache))
+
+        if cached['key'] != list(key):
+
+            return None
+
+        return LocalSettings(cached=cached['settings'])
+
+    # A missing, truncated or outdated cache is simply rebuilt
+    except (EnvironmentError, ValueError, KeyError, TypeError):
+
+        return None
+
+
+def write_settings_cache(cache_file, key, settings):
+    """ This function saves checked settings to a cache.  It holds the ZNC
+    password, so only its owner may read it.  It is written to a temporary
+    file first and then renamed, so a crash never leaves half a cache.  If
+    it can't be written (say, the folder is read only), the next startup
+    parses the config file again.
+
+    :param cache_file: the path of the cache
+    :param key: the key of the config file the settings came from
+    :param settings: a LocalSettings instance
+
+    """
+
+    temporary_path = cache_file + '.tmp'
+
+    try:
+
+        descriptor = os.open(temporary_path,
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        os.fchmod(descriptor, 0600)
+
+        with os.fdopen(descriptor, 'wb') as cache:
+
+            json.dump({'key': key, 'settings': settings.to_cache()}, cache)
+
+        os.rename(temporary_path, cache_file)
+
+    # A setting that isn't UTF-8 can't be encoded as JSON
+    except (EnvironmentError, ValueError):
+
+        return
+
+
+def load_local_settings(config_file):
+    """ This function loads and checks the settings in a config file.  They
+    come from its cache if the file hasn't changed since the cache was
+    saved.  Otherwise the file is parsed, and the cache saved for next time.
+
+    :param config_file: the path of the config file
+
+    :raises ConfigError, KeyError, ValueError: if the config file is invalid
+
+    :return: a checked LocalSettings instance
+
+    """
+
+    key = cache_key(config_file)
+    cache_file = config_file + CACHE_SUFFIX
+
+    if key is not None:
+
+        settings = read_settings_cache(cache_file, key)
+
+        if settings is not None:
+
+            return settings
+
+    settings = LocalSettings(config_file)
+    settings.check()
+
+    if key is not None:
+
+        write_settings_cache(cache_file, key, settings)
+
+    return settings
+
+
+def get_settings(config_file='znc_settings.conf'):
+    """ This function returns the settings for a config file, loading them
+    the first time they are asked for.  Every later call for the same file
+    returns the same ReloadableSettings.
+
+    :param config_file: the path of the config file
+
+    :return: a ReloadableSettings instance
+
+    """
+
+    with loading_lock:
+
+        settings = loaded_settings.get(config_file)
+
+        if settings is None:
+
+            settings = ReloadableSettings(config_file)
+            loaded_settings[config_file] = settings
+
+    return settings
+
+
+class LazySettings():
+    """ This class stands in for the ReloadableSettings of a config file,
+    which are only loaded the first time a setting is read from it (see
+    `get_settings`).  Any setting can be read from it, and listeners added,
+    as though it were a ReloadableSettings instance.
+
+    """
+
+    def __init__(self, config_file='znc_settings.conf'):
+        """ Nothing is loaded until a setting is read.
+
+        :param config_file: the path for the config file the user wishes to use
+
+        """
+
+        self.config_file = config_file
+
+    def __getattr__(self, name):
+        """ Reads a setting from the ReloadableSettings, loading them first
+        if need be.  Special methods (which bool(), copy and pickle look
+        for) are not settings, and never cause a load.
+
+        """
+
+        if name.startswith('__'):
+
+            raise AttributeError(name)
+
+        return getattr(get_settings(self.config_file), name)
+
+
+class ReloadableSettings():
+    """ This class holds the current LocalSettings, and swaps in a new one
+    when the config file changes.  Any setting can be read from it as though
+    it were a LocalSettings instance.
+
+    A new config file is loaded and checked in full before it replaces the
+    old one, so a bad edit leaves the running settings untouched.  Anything
+    that keeps its own copy of a setting (such as a compiled validator) can
+    register a listener to be told about the new settings.
+
+    """
+
+    # Settings that are only read at startup, so a change needs a restart
+    RESTART_REQUIRED = [
+        'znc_ip',
+        'znc_port',
+        'register_ip',
+        'register_port',
+        'admin_port',
+        'znc_connections',
+        'web_threads',
+        'max_concurrent_commands',
+        'snapshot_file',
+        'snapshot_interval',
+        'offline_queue_file',
+        'backends',
+    ]
+
+    def __init__(self, config_file='znc_settings.conf'):
+        """ Loads the settings for the first time.
+
+        :param config_file: the path for the config file the user wishes to use
+
+        """
+
+        self.config_file = config_file
+        self.listeners = []
+        self.mtime = self.modified_time()
+
+        self.current = load_local_settings(config_file)
+
+    def __getattr__(self, name):
+        """ Reads a setting from the current LocalSettings.
+
+        """
+
+        return getattr(self.current, name)
+
+    def modified_time(self):
+        """ The modification time of the config file, or None if it can't be
+        read.
+
+        """
+
+        try:
+
+            return os.stat(self.config_file).st_mtime
+
+        except OSError:
+
+            return None
+
+    def add_listener(self, listener):
+        """ Registers a function to be called with the new LocalSettings
+        after every successful reload.
+
+        :param listener: a function that takes a LocalSettings instance
+
+        """
+
+        self.listeners.append(listener)
+
+    def check_for_changes(self):
+        """ Reloads the settings if the config file has been modified since
+        it was last read.  This is cheap enough to call every few seconds.
+
+        :return: the list of settings that changed (see `reload`)
+
+        """
+
+        mtime = self.modified_time()
+
+        if mtime is None or mtime == self.mtime:
+
+            return []
+
+        self.mtime = mtime
+
+        return self.reload()
+
+    def reload(self):
+        """ Loads and checks the config file, and then swaps the new settings
+        in and tells every listener.  If the file can't be loaded, or a
+        setting is invalid, the current settings are kept.
+
+        :return changed: the names of the settings that changed
+
+        :raises ValueError: if the new config file is invalid
+
+        """
+
+        try:
+
+            new_settings = load_local_settings(self.config_file)
+
+        except (ConfigError, KeyError, ValueError) as error:
+
+            raise ValueError('Config file not reloaded: {!r}'.format(error))
+
+        changed = sorted(name for name, value in vars(new_settings).items()
+                         if getattr(self.current, name, None) != value)
+
+        self.current = new_settings
+
+        for listener in self.listeners:
+
+            listener(new_settings)
+
+        return changed
@@ -9,52 +9,301 @@ This file houses the registration server, which takes information
 from the client registration Flask app and processes it accordingly.
 
     Usage:
-        main.py [-v]
+        main.py [-v] [--web]
+        main.py [-v] --bulk=<file> [--checkpoint=<file>]
 
     Options:
-        -h --help       Show this screen
-        -v --verbose    Show verbose output in the server terminal
+        -h --help               Show this screen
+        -v --verbose            Show verbose output in the server terminal
+        --web                   Also serve the registration pages (the Flask
+                                app) on the registration port, with SockJS
+                                at /sockjs, so no separate `app.py` is needed
+        --bulk=<file>           Register every user in a CSV or JSONL file,
+                                print a throughput report, and exit
+        --checkpoint=<file>     Record finished users here, and skip users
+                                already recorded (to resume a bulk run)
 
 """
 
 # Twisted Imports
 from twisted.internet.protocol import Factory, Protocol
-from twisted.internet import reactor, protocol, ssl
+from twisted.internet import reactor, protocol, ssl, task, threads, defer
 from twisted.words.protocols import irc
 from twisted.python import log
 
-#Twisted SockJS Imports
-from txsockjs.factory import SockJSFactory as TXSockJSFactory
-from txsockjs.utils import broadcast
-
 # System Imports
 import sys
-import ast
+import re
+import time
+from collections import Counter
+from functools import partial
 
 # Import Settings
-from load_settings import LocalSettings
+from load_settings import LazySettings
+
+# Import the Registration Engine
+from registration import RegistrationEngine
+
+# Import the SockJS Wire Format
+from wire import parse_frame, encode_reply, ProtocolError
+
+# Import Server-Side Validation
+from validation import UserValidator
+
+# Import the Outbound Command Scheduler
+from scheduler import CommandScheduler, INTERACTIVE, BULK
+
+# Import the Admin Connection Pool
+from pool import ConnectionPool
+
+# Import the *controlpanel Client
+from controlpanel import ZNCControlPanel, ControlPanelError, \
+    CONTROL_PANEL, BLOCK_USER, LAST_SEEN, MODULES
+
+# Import Metrics
+from metrics import REGISTRY
+
+# Import Bulk Provisioning
+from bulk import BulkJob, Checkpoint, read_users, format_report
+
+# Import Admission Control
+from admission import AdmissionController, BUSY
+
+# Import the Registration Journal
+from journal import Journal, partial_users, registration_times, \
+    placements, CLONE_SENT, CLONED, COMPLETE, FAILED, ROLLED_BACK, QUEUED, \
+    DELETED, DISABLED, ENABLED, PASSWORD_RESET
+
+# Import the Offline Queue
+from offline_queue import OfflineQueue
+
+# Import ZNC State Snapshots
+from snapshot import SnapshotCollector
 
-# Import Docopt
-from docopt import docopt
+# Import ZNC Backends
+from backends import BackendCluster
 
-# CONFIG_FILE is the file pointer of our configuration file
+# Import the Inbound Line Filter
+from linefilter import LineFilter
+
+# Import Event Log
+from eventlog import EventLog, DEBUG, INFO, WARNING, ERROR
+
+# Import Account Lifecycle Actions
+from lifecycle import generate_password, select_unused, DELETE, DISABLE, \
+    ENABLE, RESET_PASSWORD
+
+# CONFIG_FILE is the file pointer of our configuration file.  It is only read
+# when a setting is first needed, so importing this module never touches it.
 CONFIG_FILE = 'znc_settings.conf'
-settings = LocalSettings(CONFIG_FILE)
+settings = LazySettings(CONFIG_FILE)
+
+# Each registration sends a `cloneuser`, and then six lines of settings
+LINES_PER_REGISTRATION = 7
+
+
+def registration_drain_rate(current_settings):
+    """ This function estimates how many registrations per second ZNC can
+    take, from the send rate and the number of admin sessions (on every
+    backend).
+
+    :param current_settings: the settings to estimate from
+
+    :return: registrations per second
+
+    """
+
+    return current_settings.irc_send_rate * \
+        current_settings.znc_connections * len(current_settings.backends) / \
+        LINES_PER_REGISTRATION
+
+
+class UsernameIndex():
+    """ UsernameIndex is an in-memory set of every username known to exist
+    on ZNC.  It is warmed at startup from the table `*controlpanel` prints
+    for `ListUsers`, and kept up to date as users are added, so that a
+    request for a taken username can be refused without asking ZNC.
+
+    Until the index has been warmed it does not refuse anything, and ZNC
+    remains the final word on whether a username is taken.
+
+    """
+
+    def __init__(self):
+        self.usernames = set()
+        self.warmed = False
+
+        # While a refresh is running, the usernames added (True) or
+        # deleted (False) since it started
+        self.changes = None
+
+    def is_taken(self, username):
+        """ Checks whether a username is known to exist.
+
+        :param username: the username to check
+
+        :return: True if the username is taken
+
+        """
+
+        return username in self.usernames
+
+    def add(self, username):
+        """ Records that a username now exists.
+
+        :param username: the username that was added
+
+        """
+
+        self.usernames.add(username)
+
+        if self.changes is not None:
+
+            self.changes[username] = True
+
+    def discard(self, username):
+        """ Records that a username no longer exists.
+
+        :param username: the username that was deleted
+
+        """
+
+        self.usernames.discard(username)
+
+        if self.changes is not None:
+
+            self.changes[username] = False
+
+    def begin_refresh(self):
+        """ Starts recording changes, just before a `ListUsers` table is
+        asked for.  Changes made while the table is on its way are applied
+        on top of it.
+
+        """
+
+        self.changes = {}
+
+    def finish_refresh(self, usernames):
+        """ Replaces the index with the usernames from a `ListUsers` table.
+
+        :param usernames: the usernames that exist on ZNC
+
+        """
+
+        usernames = set(usernames)
+
+        for username, added in (self.changes or {}).iteritems():
+
+            if added:
+
+                usernames.add(username)
+
+            else:
+
+                usernames.discard(username)
+
+        self.usernames = usernames
+        self.changes = None
+        self.warmed = True
+
+        log_message('Username index refreshed with {} users'.format(
+            len(self.usernames)), INFO, 'username_index')
+
+    def cancel_refresh(self):
+        """ Stops recording changes, when a refresh failed.
+
+        """
+
+        self.changes = None
+
+
+# The index of existing usernames, shared by the SockJS and IRC sides
+username_index = UsernameIndex()
+
+# Metrics that are recorded as registrations happen
+REGISTRATION_STAGE_SECONDS = REGISTRY.histogram(
+    'znc_registration_stage_seconds',
+    'Time spent in each stage of a registration (receive, queue, znc_reply, '
+    'total, offline)',
+    ('stage',))
+REGISTRATION_OUTCOMES = REGISTRY.counter(
+    'znc_registration_outcomes_total',
+    'Registrations by outcome',
+    ('outcome',))
+SOCKJS_FRAMES = REGISTRY.counter(
+    'znc_sockjs_frames_total',
+    'SockJS frames received, by whether they were accepted',
+    ('result',))
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    'znc_admission_rejections_total',
+    'Registrations refused by admission control, by reason',
+    ('reason',))
 
 
 class UserAdmin():
     """ UserAdmin is an object that can be used by both the SockJS
     and IRC protocols to pass user information and perform actions between
     the two.  A single instance of this is used and can handle all user
-    actions.
+    actions.  Each registration is tracked separately by the registration
+    engine, so many users can be added at the same time.
 
     """
 
     def __init__(self):
-        self.username = ''
-        self.password = ''
         self.success_message = 'User [{}] added!'
         self.failure_message = 'Error: User not added! [User already exists]'
+        self.pending_message = \
+            'Error: User not added! [Registration already in progress]'
+        self.lost_message = \
+            'Error: User not added! [Lost connection to ZNC, please try again]'
+        self.timeout_message = \
+            'Error: User not added! [ZNC did not reply in time, please try ' \
+            'again]'
+        self.busy_message = \
+            'Error: User not added! [The server is busy, please try again ' \
+            'in {} seconds]'
+        self.rate_limited_message = \
+            'Error: User not added! [Too many attempts, please try again ' \
+            'in {} seconds]'
+        self.full_message = \
+            'Error: User not added! [There is no room for new users, ' \
+            'please try again later]'
+        self.queued_message = \
+            'User [{}] queued! [ZNC is unreachable, so your account will be ' \
+            'created as soon as it is back]'
+        self.offline_full_message = \
+            'Error: User not added! [ZNC is unreachable, please try again ' \
+            'later]'
+        self.available_message = 'Username is available'
+        self.taken_message = 'Username is already taken'
+
+        self.success_pattern = \
+            re.compile(r'^User \[(?P<username>.+)\] added!$')
+
+        # Replies to `cloneuser` that mean the user was not created
+        self.clone_failure_prefixes = (
+            'Error: User not added!',
+            'Error: Cloning failed',
+        )
+
+        # Replies to `set`, `setnetwork` and `deluser`, which need no action
+        self.acknowledgement_pattern = \
+            re.compile(r'^(\w+ = |Password has been changed|User \[.+\] '
+                       r'deleted!$)')
+
+        # How many of each kind of feedback has been received from ZNC
+        self.feedback_counts = Counter()
+
+        # Users a previous run left half-registered, from the journal
+        self.partial_users = {}
+
+        # True while registrations are being started
+        self.starting = False
+
+        self.engine = RegistrationEngine(settings.max_in_flight)
+
+        # Creates users from the offline queue, once a session signs on
+        self.offline_drain = task.LoopingCall(self.drain_offline_user)
 
         self.command_dict = {
             'add_user': 'adduser <username> <password>',
@@ -63,113 +312,916 @@ class UserAdmin():
             'change_password': 'set password <username> <password>',
             'set_network_value':
                         'setnetwork <variable> <username> <network> <value>',
+            'list_users': 'listusers',
+            'del_user': 'deluser <username>',
+            'block_user': 'block <username>',
+            'unblock_user': 'unblock <username>',
+            'last_seen': 'show',
+        }
+
+        # For each lifecycle action: the command, the module it is sent to,
+        # the journal step it records, and the reply that means it worked
+        self.lifecycle_commands = {
+            DELETE: ('del_user', CONTROL_PANEL, DELETED,
+                     re.compile(r'^User \[.+\] deleted!$')),
+            DISABLE: ('block_user', BLOCK_USER, DISABLED,
+                      re.compile(r'^Blocked \[')),
+            ENABLE: ('unblock_user', BLOCK_USER, ENABLED,
+                     re.compile(r'^Unblocked \[')),
+            RESET_PASSWORD: ('change_password', CONTROL_PANEL,
+                             PASSWORD_RESET,
+                             re.compile(r'^Password has been changed')),
         }
 
-        self.variable_list = [
-            'nick',
-            'altnick',
-            'ident',
-            'realname',
-        ]
+        self.variable_list = [
+            'nick',
+            'altnick',
+            'ident',
+            'realname',
+        ]
+
+    def handle_operation(self, operation, transport=None):
+        """ This function will start the work for a single operation sent
+        from the registration page.  The operation has already been checked
+        by `wire.parse_frame()`.  For a 'register' operation it will add the
+        user to ZNC, and then relay the success/failure status and message
+        back to the client.
+
+        :param operation: a dict holding 'op' and the operation's fields
+        :param transport: the SockJS transport the operation arrived on,
+                          which is where the status message will be sent
+
+        """
+
+        if operation['op'] == 'register':
+
+            if username_index.is_taken(operation['username']):
+
+                REGISTRATION_OUTCOMES.inc('duplicate')
+
+                send_client_response(encode_reply('register', False,
+                                                  self.failure_message,
+                                                  username=operation[
+                                                      'username'],
+                                                  retry=False,
+                                                  ), transport)
+
+                return
+
+            if operation['username'] in offline_queue:
+
+                REGISTRATION_OUTCOMES.inc('pending')
+
+                send_client_response(encode_reply('register', False,
+                                                  self.pending_message,
+                                                  username=operation[
+                                                      'username'],
+                                                  retry=False,
+                                                  ), transport)
+
+                return
+
+            self.new_user(operation['username'], operation['password'],
+                          transport)
+
+        elif operation['op'] == 'check':
+
+            available, message = self.check_username(operation['username'])
+
+            send_client_response(encode_reply('check', True, message,
+                                              username=operation['username'],
+                                              available=available,
+                                              ), transport)
+
+    def check_username(self, username):
+        """ This function answers whether a username can be registered,
+        without sending anything to ZNC.
+
+        :param username: the username to check
+
+        :return: a tuple of (available, message)
+
+        """
+
+        errors = user_validator.validate_username(username)
+
+        if errors:
+
+            return False, '  '.join(errors)
+
+        if username_index.is_taken(username):
+
+            return False, self.taken_message
+
+        if username in self.engine.pending or username in offline_queue:
+
+            return False, self.pending_message
+
+        return True, self.available_message
+
+    def validate_new_user(self, username, password):
+        """ This function checks a user for a bulk run.  It applies the
+        server-side validation, and refuses usernames that are known to be
+        taken.
+
+        :param username: the requested username
+        :param password: the requested password
+
+        :return errors: a list of error messages, empty if the user can be
+                        submitted
+
+        """
+
+        errors = user_validator.validate(username, password)
+
+        if not errors and username_index.is_taken(username):
+
+            errors.append(self.failure_message)
+
+        elif not errors and username in offline_queue:
+
+            errors.append(self.pending_message)
+
+        return errors
+
+    def new_user(self, username, password, transport=None,
+                 priority=INTERACTIVE, on_complete=None):
+        """ This function is called every time we need to create a new user.
+        It hands the user to the registration engine, and then starts as
+        many queued registrations as the engine has room for.  A signup that
+        arrives while no session is signed on is saved to the offline queue
+        instead (see `queue_offline_user`).
+
+        :param username: the username to be registered
+        :param password: the password for the new user
+        :param transport: the SockJS transport that asked for this user
+        :param priority: INTERACTIVE for signups, BULK for batch jobs
+        :param on_complete: an optional function called with the outcome
+                            (see `finish_creating_user`)
+
+        :return record: the PendingRegistration, or None if that username
+                        already has a registration in progress, or it was
+                        put in the offline queue
+
+        """
+
+        if priority == INTERACTIVE and settings.offline_queue_size and \
+                connection_pool.pick() is None:
+
+            self.queue_offline_user(username, password, transport)
+
+            return None
+
+        record = self.engine.submit(username, password, transport, priority,
+                                    on_complete)
+
+        if record is None:
+
+            REGISTRATION_OUTCOMES.inc('pending')
+
+            send_client_response(encode_reply('register', False,
+                                              self.pending_message,
+                                              username=username,
+                                              retry=False,
+                                              ), transport)
+
+            return None
+
+        self.start_pending_users()
+
+        return record
+
+    def queue_offline_user(self, username, password, transport):
+        """ This function saves a signup to the offline queue, while no
+        session is signed on to ZNC.  The client is only told it is queued
+        once it has reached the disk.  If the queue is full, the client is
+        asked to try again later.
+
+        :param username: the username to be registered
+        :param password: the password for the new user
+        :param transport: the SockJS transport that asked for this user
+
+        """
+
+        self.expire_offline_users()
+
+        if not offline_queue.add(username, password):
+
+            REGISTRATION_OUTCOMES.inc('offline_full')
+
+            send_client_response(encode_reply('register', False,
+                                              self.offline_full_message,
+                                              username=username,
+                                              retry=True,
+                                              ), transport)
+
+            return
+
+        journal.record(username, QUEUED)
+
+        REGISTRATION_OUTCOMES.inc('queued')
+
+        message = self.queued_message.format(username)
+
+        send_client_response(encode_reply('register', True, message,
+                                          username=username,
+                                          queued=True,
+                                          ), transport)
+
+        log_message(message, INFO, 'registration', user=username,
+                    queued=len(offline_queue))
+
+    def drain_offline_queue(self):
+        """ This function starts creating the users in the offline queue, at
+        `settings.offline_drain_rate` users per second.  It is called when a
+        session signs on, and does nothing if the queue is already being
+        drained.
+
+        """
+
+        if not self.offline_drain.running and len(offline_queue):
+
+            self.offline_drain.start(1.0 / settings.offline_drain_rate)
+
+    def drain_offline_user(self):
+        """ This function starts one registration from the offline queue.
+        It is called by a LoopingCall, which stops once the queue is empty,
+        or when no session is signed on (to be started again by the next
+        one that signs on).  At most `settings.bulk_window` of them are in
+        progress at once, and they are sent at bulk priority, so signups
+        that arrive in the meantime go first.
+
+        """
+
+        self.expire_offline_users()
+
+        if not len(offline_queue) or connection_pool.pick() is None:
+
+            self.offline_drain.stop()
+
+            return
+
+        if len(offline_queue.taken) >= settings.bulk_window:
+
+            return
+
+        item = offline_queue.take()
+
+        if item is None:
+
+            return
+
+        username, password, queued_at = item
+
+        # Registered some other way in the meantime
+        if username_index.is_taken(username):
+
+            offline_queue.remove(username, 'failed')
+
+            journal.record(username, FAILED, message=self.failure_message)
+
+            return
+
+        record = self.new_user(username, password, priority=BULK,
+                               on_complete=partial(self.offline_user_finished,
+                                                   queued_at))
+
+        # Another registration for that username is in progress, so it is
+        # tried again once that one is over
+        if record is None:
+
+            offline_queue.release(username)
+
+    def offline_user_finished(self, queued_at, record, status_message,
+                              valid_user, retryable):
+        """ This function is called with the outcome of a registration from
+        the offline queue (see `finish_creating_user`).  Unless it failed for
+        a reason that may pass, it is taken out of the queue.
+
+        :param queued_at: when the user was put in the offline queue
+        :param record: the PendingRegistration that finished
+        :param status_message: the message returned to the client
+        :param valid_user: True if the user was created
+        :param retryable: True if the failure was temporary
+
+        """
+
+        if retryable:
+
+            offline_queue.release(record.username)
+
+            return
+
+        offline_queue.remove(record.username,
+                             'created' if valid_user else 'failed')
+
+        REGISTRATION_STAGE_SECONDS.observe(time.time() - queued_at,
+                                           'offline')
+
+    def expire_offline_users(self):
+        """ This function drops the users that have waited in the offline
+        queue for longer than `settings.offline_queue_max_age`.
+
+        """
+
+        for username in offline_queue.expire():
+
+            REGISTRATION_OUTCOMES.inc('offline_expired')
+
+            journal.record(username, FAILED,
+                           message='Expired in the offline queue')
+
+            log_message('Registration expired in the offline queue',
+                        WARNING, 'offline_expired', user=username)
+
+    def new_bulk_user(self, username, password, on_complete):
+        """ This function starts a registration on behalf of a bulk job.
+
+        :param username: the username to be registered
+        :param password: the password for the new user
+        :param on_complete: the function called with the outcome
+
+        :return record: the PendingRegistration, or None
+
+        """
+
+        return self.new_user(username, password, priority=BULK,
+                             on_complete=on_complete)
+
+    def start_pending_users(self):
+        """ This function sends the command to IRC that clones an existing
+        template user, for each registration the engine is ready to start.
+        Each registration is placed on a ZNC backend (see BackendCluster),
+        and given to that backend's least busy admin session.  If no session
+        is signed on, registrations wait in the queue until one is.
+
+        """
+
+        # Refusing a registration frees a slot, which starts more from
+        # inside; those are left to the loop below instead
+        if self.starting:
+
+            return
+
+        self.starting = True
+
+        refused = True
+
+        while refused and connection_pool.pick() is not None:
+
+            refused = []
+
+            for record in self.engine.start_ready():
+
+                if not self.start_user(record):
+
+                    refused.append(record)
+
+            for record in refused:
+
+                # Either every backend is full, or the user already exists
+                # on one that is down (in which case it is worth retrying)
+                self.finish_creating_user(
+                    record, self.full_message, False,
+                    retryable=cluster.locate(record.username)
+                    not in connection_pool.healthy_backends)
+
+        self.starting = False
+
+    def start_user(self, record):
+        """ This function places a registration on a backend, and sends its
+        `cloneuser` to the least busy session there.
+
+        :param record: the PendingRegistration to start
+
+        :return: True if it was sent, or False if there was no backend for
+                 it (in which case it is taken back out of the engine)
+
+        """
+
+        backend = cluster.place(record.username,
+                                connection_pool.healthy_backends)
+
+        if backend is None:
+
+            self.engine.remove(record)
+
+            return False
+
+        session = connection_pool.pick(backend)
+
+        record.session = session
+        session.in_flight += 1
+
+        # Clones User
+        command = self.render_command(
+            'clone_user',
+            username=record.username,
+            password=record.password,
+            user_to_clone=cluster.backends[backend].user_to_clone,
+        )
+
+        record.clone_batch, replies = control_panel.execute(
+            [command],
+            priority=record.priority,
+            session=session,
+            on_sent=partial(self.clone_sent, record),
+        )
+
+        replies[0].addCallbacks(partial(self.clone_replied, record),
+                                partial(self.no_reply, record.username))
+
+        return True
+
+    def clone_replied(self, record, feedback):
+        """ This function is called with ZNC's reply to the `cloneuser` for
+        a registration.  It works out whether the user was created, and
+        then returns the status message to the client.
+
+        :param record: the PendingRegistration the reply belongs to
+        :param feedback: the reply from `*controlpanel`
+
+        """
+
+        kind, username = self.classify_feedback(feedback)
+
+        self.feedback_counts[kind] += 1
+
+        if kind == 'added' and username == record.username:
+
+            status_message = 'Success!  ' + feedback
+            valid_user = True
+
+        elif kind in ('not_added', 'error'):
+
+            status_message = feedback
+            valid_user = False
+
+        else:
+
+            # Not an answer to `cloneuser`, so the registration is left to
+            # its reply deadline
+            log_message('IRC - Unexpected reply for {}: {}'.format(
+                record.username, feedback), WARNING, 'unexpected_reply')
+
+            return
+
+        self.engine.remove(record)
+
+        if record.timed_out:
+
+            self.late_feedback(record, status_message, valid_user)
+
+            return
+
+        self.finish_creating_user(record, status_message, valid_user)
+
+    def no_reply(self, username, reason):
+        """ This function is called when a command for a user will never be
+        answered (because the session was lost, for example).  It is only
+        logged; a registration is failed by `session_lost` or by its reply
+        deadline.
+
+        :param username: the user the command was for
+        :param reason: the Failure
+
+        """
+
+        reason.trap(ControlPanelError)
+
+        log_message('IRC - No reply for {}: {}'.format(
+            username, reason.getErrorMessage()), WARNING, 'no_reply')
+
+    def clone_sent(self, record):
+        """ This function is called once the `cloneuser` for a registration
+        has actually been written to ZNC.  From then on, ZNC has
+        `settings.reply_timeout` seconds to answer before the registration
+        fails with a retryable error.
+
+        :param record: the PendingRegistration that was sent
+
+        """
+
+        record.mark_sent()
+
+        journal.record(record.username, CLONE_SENT,
+                       session=record.session.name)
+
+        record.deadline = reactor.callLater(settings.reply_timeout,
+                                            self.reply_timed_out, record)
+
+    def reply_timed_out(self, record):
+        """ This function is called when ZNC has not answered a `cloneuser`
+        in time.  The client is told to try again straight away.  The record
+        is kept for a while longer, so that a late reply can still be
+        matched to it (and, if the user was created after all, their
+        settings can still be finished).
+
+        :param record: the PendingRegistration that timed out
+
+        """
+
+        record.deadline = None
+
+        self.feedback_counts['timeout'] += 1
+
+        self.engine.expire(record)
+
+        self.finish_creating_user(record, self.timeout_message, False,
+                                  retryable=True)
+
+        reactor.callLater(settings.reply_timeout * 4, self.engine.forget,
+                          record)
+
+    def finish_creating_user(self, record, status_message, valid_user,
+                             retryable=False):
+        """ This function is called after feedback has been received from IRC
+        on whether or not the new user can be added.  If they can, it will
+        continue to alter their settings (such as username and password).  If
+        not, it will only return the status message to the client.
+
+        :param record: the PendingRegistration the feedback belongs to
+        :param status_message: the message that will be returned to the client
+        :param valid_user: a Bool describing whether or not the username
+                            is available
+        :param retryable: True if the failure was temporary, and the same
+                          request may succeed if it is tried again
+
+        """
+        record.cancel_deadline()
+
+        if record.session is not None:
+
+            record.session.in_flight -= 1
+
+        self.record_outcome(record, status_message, valid_user)
+
+        if valid_user or status_message == self.failure_message:
+
+            username_index.add(record.username)
+
+        if valid_user:
+
+            cluster.confirm(record.username)
+
+            journal.record(record.username, CLONED,
+                           backend=record.session.backend)
+
+            # Until the next snapshot, admin lookups see the settings it is
+            # about to be given
+            snapshots.add_registered(record.username,
+                                     record.session.backend)
+
+            self.alter_user_settings(record)
+
+        else:
+
+            cluster.cancel(record.username)
+
+        if not valid_user and record.sent:
+
+            journal.record(record.username, FAILED, message=status_message)
+
+        send_client_response(encode_reply('register', valid_user,
+                                          status_message,
+                                          username=record.username,
+                                          retry=retryable,
+                                          ), record.transport)
+
+        log_message(status_message, INFO, 'registration',
+                    user=record.username, valid=valid_user)
+
+        self.engine.complete(record)
+
+        if record.on_complete is not None:
+
+            record.on_complete(record, status_message, valid_user, retryable)
+
+        self.start_pending_users()
+
+        log_message('Registrations - queued', DEBUG, 'registration_queue',
+                    queued=self.engine.queue_depth,
+                    in_flight=self.engine.in_flight)
+
+        if record.session is not None:
+
+            log_message('IRC - backlog', DEBUG, 'irc_backlog',
+                        session=record.session.name,
+                        lines=record.session.scheduler.backlog,
+                        lines_per_second=record.session.scheduler.send_rate)
+
+    def record_outcome(self, record, status_message, valid_user):
+        """ This function records the outcome of a registration, and how long
+        each of its stages took, in the metrics registry.
+
+        :param record: the PendingRegistration that finished
+        :param status_message: the message that will be returned to the client
+        :param valid_user: True if the user was created
+
+        """
+
+        now = time.time()
+
+        if valid_user:
+
+            outcome = 'success'
+
+        else:
+
+            outcome = {
+                self.failure_message: 'duplicate',
+                self.timeout_message: 'timeout',
+                self.lost_message: 'lost',
+                self.full_message: 'full',
+            }.get(status_message, 'failed')
+
+        REGISTRATION_OUTCOMES.inc(outcome)
+
+        if record.started is not None:
+
+            REGISTRATION_STAGE_SECONDS.observe(record.started - record.created,
+                                               'queue')
+
+        if record.sent_at is not None and outcome not in ('timeout', 'lost'):
+
+            REGISTRATION_STAGE_SECONDS.observe(now - record.sent_at,
+                                               'znc_reply')
+
+        REGISTRATION_STAGE_SECONDS.observe(now - record.created, 'total')
+
+    def session_lost(self, session):
+        """ This function is called when an admin session loses its
+        connection to ZNC.  Registrations that were waiting on that session
+        are either moved to another session (if their command was never
+        sent) or failed with a message asking the user to try again.
+
+        :param session: the admin session (IRCFactory) that was lost
+
+        """
+
+        for record in self.engine.abandon(session):
+
+            self.finish_creating_user(record, self.lost_message, False,
+                                      retryable=True)
+
+        session.in_flight = 0
+
+        self.start_pending_users()
+
+    def alter_user_settings(self, record):
+        """ This function changes the necessary user settings, particularly
+        the password, nick, altnick, ident, and realname.  All of the
+        commands are sent to the scheduler as a single batch.
+
+        :param record: the PendingRegistration of the user being changed
+
+        """
+
+        commands = []
+
+        # Change Password
+        command = self.render_command('change_password',
+                                      username=record.username,
+                                      password=record.password,
+                                      )
+
+        commands.append(command)
+
+        # Change other info
+        for item in self.variable_list:
+
+            command = self.render_command('set_value',
+                                          username=record.username,
+                                          password=record.password,
+                                          variable=item,
+                                          value=record.username,
+                                          )
+
+            commands.append(command)
+
+        command = self.render_command('set_network_value',
+                                      variable='altnick',
+                                      username=record.username,
+                                      network='Freenode',
+                                      value=record.username,
+                                      )
+
+        commands.append(command)
+
+        replies = control_panel.execute(commands, priority=record.priority,
+                                        session=record.session,
+                                        on_sent=partial(journal.record,
+                                                        record.username,
+                                                        COMPLETE))[1]
+
+        for reply in replies:
+
+            reply.addCallbacks(partial(self.setting_replied, record.username),
+                               partial(self.no_reply, record.username))
+
+    def setting_replied(self, username, feedback):
+        """ This function is called with ZNC's reply to each of the commands
+        that change a new user's settings.  Anything but an acknowledgement
+        is logged.
+
+        :param username: the user whose setting was changed
+        :param feedback: the reply from `*controlpanel`
+
+        """
+
+        kind = self.classify_feedback(feedback)[0]
+
+        self.feedback_counts[kind] += 1
+
+        if kind != 'ack':
+
+            log_message('IRC - Setting not changed for {}: {}'.format(
+                username, feedback), WARNING, 'setting_not_changed')
+
+    def roll_back_partial_users(self, session):
+        """ This function deals with the users a previous run left
+        half-registered, according to the journal.  A user who was cloned
+        but not finished still has the template user's password, so they are
+        deleted.  A user whose `cloneuser` was sent but never answered may or
+        may not exist (and may not be ours), so they are only logged.  Only
+        the users on the session's own backend are dealt with; the rest wait
+        for a session on theirs.
+
+        :param session: the admin session to send the commands on
+
+        """
+
+        for username, entry in sorted(self.partial_users.items()):
+
+            if cluster.locate(username) != session.backend:
+
+                continue
+
+            del self.partial_users[username]
+
+            username = username.encode('utf-8')
+
+            if entry['step'] == CLONED:
+
+                log_message('Journal - Rolling back half-registered user '
+                            + username, WARNING, 'rollback')
+
+                deleted = control_panel.call(
+                    self.render_command('del_user', username=username),
+                    session=session)
+                deleted.addCallbacks(partial(self.rolled_back, username),
+                                     partial(self.no_reply, username))
+
+            else:
+
+                log_message('Journal - Outcome unknown for ' + username,
+                            WARNING, 'rollback')
+
+                journal.record(username, FAILED,
+                               message='Outcome unknown after restart')
+
+    def rolled_back(self, username, feedback):
+        """ This function is called once ZNC has answered the `deluser` for
+        a half-registered user.  Either way, the user no longer exists.
+
+        :param username: the user that was deleted
+        :param feedback: the reply from `*controlpanel`
+
+        """
+
+        username_index.discard(username)
+        cluster.release(username)
+
+        journal.record(username, ROLLED_BACK, message=feedback)
+
+    def run_account_action(self, action, username, priority=BULK):
+        """ This function runs a lifecycle action (delete, disable, enable
+        or password reset) on an existing account.  The command goes through
+        the same scheduler as registrations, so it is rate limited, and its
+        reply is matched to it by the `*controlpanel` client.  It is sent to
+        the backend that holds the account.  Disabling needs ZNC's
+        `blockuser` module to be loaded.
+
+        :param action: one of DELETE, DISABLE, ENABLE or RESET_PASSWORD
+        :param username: the account to act on
+        :param priority: the scheduler priority (default = BULK)
+
+        :return: a Deferred that fires with (succeeded, message).  For a
+                 password reset, the message is a dict holding the new
+                 password.  An invalid or reserved username fails without
+                 anything being sent.
+
+        """
+
+        errors = self.validate_account(username)
+
+        if errors:
+
+            return defer.succeed((False, '  '.join(errors)))
+
+        operation, module = self.lifecycle_commands[action][:2]
 
-        # TODO(kmjungersen) - add support for all commands
+        password = None
 
-    def add_user_from_raw_data(self, data):
-        """ This function will start the process of adding a new ZNC user.
-        It begins by retrieving a username and password from the socket via
-        `parse_user_info()`, and then validates the desired username. If
-        successful, it will add the user to ZNC, and then relay the
-        success/failure status and message back to the client.
+        if action == RESET_PASSWORD:
 
-        :param data: the raw data sent from the registration page client-side
-                     to the server via a SockJS connection
+            password = generate_password(''.join(
+                character for character in settings.password_chars
+                if not character.isspace()))
 
-        """
+        answered = control_panel.call(self.render_command(operation,
+                                                          username=username,
+                                                          password=password
+                                                          or ''),
+                                      priority, module=module,
+                                      backend=cluster.locate(username))
+        answered.addCallback(self.account_action_replied, action, username,
+                             password)
 
-        username, password = self.parse_user_info(data)
+        return answered
 
-        self.new_user(username, password)
+    def validate_account(self, username):
+        """ This function checks a username before a lifecycle action is
+        run on it.  The signup rules are not applied, so accounts made
+        outside them can still be managed; only names that would break the
+        command sent to ZNC, and reserved names, are refused.
 
-    def new_user(self, username, password):
-        """ This function is called every time we need to create a new user.
-        It simply sends the appropriate command to IRC, which clones an
-        existing template user.
+        :param username: the account to act on
 
-        :param username: the username to be registered
-        :param password: the password for the new user
+        :return errors: a list of error messages, empty if it is valid
 
         """
 
-        self.username = username
-        self.password = password
-
-        # Clones User
-        command = self.render_command('clone_user',
-                                      username=username,
-                                      password=password,
-                                      )
+        return user_validator.validate_existing(username)
 
-        send_irc_command(command)
+    def account_action_replied(self, feedback, action, username, password):
+        """ This function is called with ZNC's reply to a lifecycle action.
+        If it worked, it is recorded in the journal.
 
-    def finish_creating_user(self, status_message, valid_user):
-        """ This function is called after feedback has been received from IRC
-        on whether or not the new user can be added.  If they can, it will
-        continue to alter their settings (such as username and password).  If
-        not, it will only return the status message to the client.
+        :param feedback: the reply from ZNC
+        :param action: the action that was run
+        :param username: the account it was run on
+        :param password: the new password, for a password reset
 
-        :param status_message: the message that will be returned to the client
-        :param valid_user: a Bool describing whether or not the username
-                            is available
+        :return: a tuple of (succeeded, message)
 
         """
-        if valid_user:
 
-            self.alter_user_settings()
+        step, succeeded = self.lifecycle_commands[action][2:]
 
-        send_client_response(status_message)
+        if not succeeded.match(feedback):
 
-        log_message(status_message)
+            return False, feedback
 
-        self.username = ''
-        self.password = ''
+        if action == DELETE:
 
-    def alter_user_settings(self):
-        """ This function changes the necessary user settings, particularly
-        the password, nick, altnick, ident, and realname.
+            username_index.discard(username)
+            snapshots.current.remove(username)
+            cluster.release(username)
 
-        """
+        journal.record(username, step)
 
-        # Change Password
-        command = self.render_command('change_password',
-                                      username=self.username,
-                                      password=self.password,
-                                      )
+        log_message('Accounts - {} {}'.format(step, username), INFO,
+                    'account_action')
 
-        send_irc_command(command)
+        if password is not None:
 
-        # Change other info
-        for item in self.variable_list:
+            return True, {'password': password}
 
-            command = self.render_command('set_value',
-                                          username=self.username,
-                                          password=self.password,
-                                          variable=item,
-                                          value=self.username,
-                                          )
+        return True, feedback
 
-            send_irc_command(command)
+    def find_unused_accounts(self, min_age):
+        """ This function finds accounts that could be pruned: ones that
+        were registered here at least `min_age` seconds ago and have never
+        logged in.  Every backend is asked, so it needs ZNC's `lastseen`
+        module to be loaded on each of them.
 
-        command = self.render_command('set_network_value',
-                                      variable='altnick',
-                                      username=self.username,
-                                      network='Freenode',
-                                      value=self.username,
-                                      )
+        :param min_age: the youngest an account may be, in seconds
+
+        :return: a Deferred that fires with a sorted list of usernames
+
+        """
+
+        # So the journal is up to date before it is read
+        journal.flush()
+
+        found = defer.gatherResults([
+            threads.deferToThread(registration_times, settings.journal_file),
+        ] + [
+            control_panel.call(self.render_command('last_seen'), BULK,
+                               module=LAST_SEEN, backend=backend)
+            for backend in cluster.backends
+        ], consumeErrors=True)
 
-        send_irc_command(command)
+        found.addErrback(lambda error: error.value.subFailure)
+        found.addCallback(lambda results: select_unused(
+            [row for rows in results[1:] for row in rows], results[0],
+            time.time() - min_age, user_validator.reserved))
+
+        return found
 
     def render_command(self, operation, username='', password='', variable='',
-                       value='', network=''):
+                       value='', network='', user_to_clone=None):
         """ This function renders the appropriate command to send to ZNC.  It
         will pull the correct template command from `self.command_dict` based
         on the operation value passed here.  Then it will use any optional
@@ -182,12 +1234,14 @@ class UserAdmin():
         :param variable: the ZNC variable to be changed (default = '')
         :param value: the desired value for the ZNC variable being changed
                         (default = '')
+        :param user_to_clone: the template user to clone (default = the
+                              USER_TO_CLONE setting)
 
         :return command: the formatted command, which can then be sent to ZNC
 
         """
         replacements = {
-            '<user_to_clone>': settings.user_to_clone,
+            '<user_to_clone>': user_to_clone or settings.user_to_clone,
             '<username>': username,
             '<password>': password,
             '<variable>': variable,
@@ -203,58 +1257,72 @@ class UserAdmin():
 
         return command
 
-    def parse_irc_feedback(self, feedback):
-        """ This function takes the feedback from ZNC (via IRC) and parses
-        it to determine the status of the registration.  It then
-        returns the appropriate success/failure message to the client.
+    def classify_feedback(self, feedback):
+        """ This function sorts a line of feedback from ZNC into one of a
+        few kinds:
+
+            'added'     - a user was cloned (the username is also returned)
+            'not_added' - a `cloneuser` failed
+            'ack'       - a `set`/`setnetwork` was applied
+            'error'     - some other error
+            'unknown'   - anything else
 
         :param feedback: the string of feedback received from ZNC
 
+        :return: a tuple of (kind, username), where username is None unless
+                 the feedback names the user
+
         """
 
-        status_message = ''
-        valid_user = False
+        match = self.success_pattern.match(feedback)
 
-        if feedback == self.success_message.format(self.username):
+        if match:
 
-            status_message = 'Success!  ' + feedback
-            valid_user = True
+            return 'added', match.group('username')
 
-        elif feedback == self.failure_message.format(self.username):
+        if feedback.startswith(self.clone_failure_prefixes):
 
-            status_message = feedback
-            valid_user = False
+            return 'not_added', None
+
+        if self.acknowledgement_pattern.match(feedback):
 
-        self.finish_creating_user(status_message, valid_user)
+            return 'ack', None
 
-    @staticmethod
-    def parse_user_info(information):
-        """ This function will take the data passed over the SockJS connection
-        and convert it to a dict.  The data it is receiving is a string
-        of a dict.
+        if feedback.startswith('Error:'):
 
-        :param information: the data passed over the connection, which includes
-                            the desired username and password in the form of
-                            a string
+            return 'error', None
 
-        :return: desired_username: the username to be registered
-        :return: desired_password: the password for said user
+        return 'unknown', None
+
+    def late_feedback(self, record, status_message, valid_user):
+        """ This function handles a reply for a registration that has
+        already timed out.  The client has already been told to try again,
+        but if the user was created after all, their settings are still
+        changed so the account is not left as a copy of the template.
+
+        :param record: the timed out PendingRegistration
+        :param status_message: the status message from the reply
+        :param valid_user: True if the user was created
 
         """
 
-        # The literal conversion of a string to a dict
-        user_info = ast.literal_eval(information)
+        self.feedback_counts['late'] += 1
 
-        desired_username = user_info['username']
+        log_message('IRC - Late feedback for {}: {}'.format(record.username,
+                                                            status_message),
+                    WARNING, 'late_feedback')
+
+        if valid_user:
 
-        desired_password = user_info['password']
+            username_index.add(record.username)
 
-        return desired_username, desired_password
+            # The reservation was dropped when it timed out
+            cluster.assign(record.username, record.session.backend)
 
+            journal.record(record.username, CLONED,
+                           backend=record.session.backend)
 
-# Declare an instance of UserAdmin for use on both the SockJS and IRC
-# sides of the bot
-USER_ACTION = UserAdmin()
+            self.alter_user_settings(record)
 
 
 class SockJSProtocol(Protocol):
@@ -273,34 +1341,128 @@ class SockJSProtocol(Protocol):
     def connectionMade(self):
         """ The function that is called when a SockJS connection is made
 
-        If the factory does not already have a transports attribute, it
-        will add it before continuing.
+        The transport is added to the factory's registry, so that replies
+        for this connection can be routed back to it.
 
         """
 
-        log_message('SockJS - Connection Opened!')
+        self.factory.transports[id(self.transport)] = self.transport
 
-        if not hasattr(self.factory, "transports"):
-            self.factory.transports = set()
-        self.factory.transports.add(self.transport)
+        # Looked up once, as admission control needs it for every request
+        self.peer_ip = self.transport.getPeer().host
+
+        log_message('SockJS - Connection Opened!', INFO, 'sockjs_opened',
+                    open=self.factory.live_connections)
 
     def dataReceived(self, raw_data):
         """ This function is called when data is received on the connection.
 
-        It will take that data and begin the process of adding a user to ZNC.
+        It will check the frame against the wire format, and then begin the
+        work for each operation in it.  A malformed or oversized frame is
+        answered with an error and goes no further, as is any registration
+        that is refused by admission control or fails server-side
+        validation.
 
         """
 
+        received = time.time()
+
         raw_data = raw_data.encode('utf-8')
 
-        USER_ACTION.add_user_from_raw_data(raw_data)
+        try:
+
+            operations = parse_frame(raw_data)
+
+        except ProtocolError as error:
+
+            SOCKJS_FRAMES.inc('rejected')
+
+            log_message('SockJS - Rejected frame: ' + str(error), WARNING,
+                        'rejected_frame')
+
+            send_client_response(encode_reply(None, False, str(error)),
+                                 self.transport)
+
+            return
+
+        for operation in operations:
+
+            if operation['op'] == 'register':
+
+                if not self.admit(operation):
+
+                    continue
+
+                errors = user_validator.validate(operation['username'],
+                                                 operation['password'])
+
+                if errors:
+
+                    REGISTRATION_OUTCOMES.inc('invalid')
+
+                    send_client_response(encode_reply('register', False,
+                                                      '  '.join(errors),
+                                                      username=operation[
+                                                          'username'],
+                                                      retry=False,
+                                                      ), self.transport)
+
+                    continue
+
+            USER_ACTION.handle_operation(operation, self.transport)
+
+        SOCKJS_FRAMES.inc('accepted')
+
+        REGISTRATION_STAGE_SECONDS.observe(time.time() - received, 'receive')
+
+    def admit(self, operation):
+        """ This function asks admission control whether a registration may
+        go ahead.  If not, the client is told how long to wait before trying
+        again.
+
+        :param operation: the 'register' operation
+
+        :return: True if the registration may go ahead
+
+        """
+
+        reason, retry_after = admission.admit(self.peer_ip,
+                                              USER_ACTION.engine.queue_depth)
+
+        if reason is None:
+
+            return True
+
+        ADMISSION_REJECTIONS.inc(reason)
+
+        if reason == BUSY:
+
+            message = USER_ACTION.busy_message.format(retry_after)
+
+        else:
+
+            message = USER_ACTION.rate_limited_message.format(retry_after)
+
+        send_client_response(encode_reply('register', False, message,
+                                          username=operation['username'],
+                                          retry=True,
+                                          retry_after=retry_after,
+                                          ), self.transport)
+
+        return False
 
     def connectionLost(self, reason=''):
         """ The function that is called when something severs the connection
 
+        The transport is dropped from the factory's registry.  Any reply that
+        is still on its way for this connection will be discarded.
+
         """
 
-        log_message('Connection lost...')
+        self.factory.transports.pop(id(self.transport), None)
+
+        log_message('SockJS - Connection lost...', INFO, 'sockjs_closed',
+                    open=self.factory.live_connections)
 
 
 class SockJSFactory(Factory):
@@ -315,16 +1477,37 @@ class SockJSFactory(Factory):
 
         self.protocol = SockJSProtocol
 
-    def send(self, message):
+        # Every transport that is currently connected, keyed by id().  The
+        # txsockjs session objects are old-style ProtocolWrappers that pass
+        # attribute lookups (including __hash__) on to whichever HTTP request
+        # is attached at the time, so they can't be kept in a set.
+        self.transports = {}
+
+    @property
+    def live_connections(self):
+        """ The number of SockJS connections that are currently open.
+
+        """
+
+        return len(self.transports)
+
+    def send(self, message, transport):
         """ This function simply sends a message via SockJS back to the client.
         It is defined outside of the protocol class so that it can be accessed
         outside of the instance of this factory class.
 
+        If the client has already disconnected (or there is no client, as for
+        bulk and offline registrations), the message is dropped.
+
         :param message: the message to send back to the client
+        :param transport: the transport of the client to send the message to
 
         """
 
-        broadcast(message, self.transports)
+        if transport is not None and \
+                self.transports.get(id(transport)) is transport:
+
+            transport.write(message)
 
 
 class IRCProtocol(irc.IRCClient):
@@ -335,48 +1518,162 @@ class IRCProtocol(irc.IRCClient):
 
     """
 
-    nickname = settings.znc_username
-    password = settings.znc_password
-
     def __init__(self):
         """ Defines the 'control_panel' with which the bot will interact.
         Control_panel handles everything related to the addition/deletion
-        of users.
+        of users, and the other admin modules handle the rest (such as
+        disabling users).
 
         """
-        self.control_panel = '*controlpanel'
+        self.control_panel = CONTROL_PANEL
+        self.admin_modules = MODULES
 
     def connectionMade(self):
         """ This function is called when the bot successfully makes a new
-        connection with IRC.
+        connection with IRC.  The nickname and password are read from the
+        settings now, rather than when the class is defined, so a reloaded
+        config file is used on the next connection.
 
         """
 
+        self.nickname = settings.znc_username
+        self.password = settings.znc_password
+
+        # Send a PING when the connection has been quiet for this long, so
+        # the pool's health check always has recent activity to look at
+        self.heartbeatInterval = settings.health_timeout / 3
+
+        # Replies from the admin modules skip IRCClient's parsing, and
+        # channel chatter is dropped before it
+        self.line_filter = LineFilter(self.nickname, self.admin_modules,
+                                      self.admin_reply,
+                                      self.factory.lines_dropped)
+
         irc.IRCClient.connectionMade(self)
         self.factory.the_client = self
+        self.factory.last_activity = reactor.seconds()
 
-        log_message('IRC - Connection Made!')
+        log_message('IRC - Connection Made!', INFO, 'irc_connected',
+                    session=self.factory.name)
 
     def signedOn(self):
         """ This function is called when the bot is successfully signed on to
-        IRC.
+        IRC.  The session is marked healthy, its reconnect delay is reset,
+        and any queued work is started.
+
+        """
+
+        self.factory.session_ready()
+
+        if settings.quiet_admin_sessions:
+
+            self.quiet_admin_user()
+
+        # Sent before the user list is asked for, so the list is up to date.
+        # Only the users on this session's backend are rolled back.
+        if USER_ACTION.partial_users:
+
+            USER_ACTION.roll_back_partial_users(self.factory)
+
+        # The first snapshot also warms the username index
+        if not username_index.warmed:
+
+            snapshots.collect(self.factory)
+
+        USER_ACTION.start_pending_users()
+
+        # Users who signed up while ZNC was unreachable
+        USER_ACTION.drain_offline_queue()
+
+    def quiet_admin_user(self):
+        """ This function asks ZNC to stop keeping channel and query buffers
+        for the admin user while it is connected, so that no backlog is
+        played back to the session when it reconnects.  The replies are only
+        logged, as an older ZNC may not know the variables.
+
+        """
+
+        commands = ['set {} {} true'.format(variable, settings.znc_username)
+                    for variable in ('AutoClearChanBuffer',
+                                     'AutoClearQueryBuffer')]
+
+        quieted = control_panel.batch(commands, BULK, self.factory)
+        quieted.addCallbacks(self.buffers_quieted,
+                             partial(USER_ACTION.no_reply,
+                                     settings.znc_username))
+
+    def buffers_quieted(self, replies):
+        """ This function is called with ZNC's replies to `quiet_admin_user`.
+
+        :param replies: the reply to each `set`
+
+        """
+
+        log_message('IRC - Buffer playback: ' + '; '.join(replies), INFO,
+                    'buffers_quieted', session=self.factory.name)
+
+    def lineReceived(self, line):
+        """ This function is called for every line received from IRC.  It
+        records the time, so that the pool can tell the session is alive.
+        Replies from the admin modules, and chatter, are dealt with by the
+        line filter; only the other lines are parsed by IRCClient.
+
+        :param line: the raw line received from IRC
+
+        """
+
+        self.factory.last_activity = reactor.seconds()
+        self.factory.lines_received += 1
+
+        if not self.line_filter.handle(line):
+
+            irc.IRCClient.lineReceived(self, line)
+
+    def connectionLost(self, reason):
+        """ This function is called when the connection to IRC is lost.  Any
+        registrations waiting on this session are handed back to UserAdmin.
+
+        :param reason: the reason the connection was lost
 
         """
 
+        irc.IRCClient.connectionLost(self, reason)
+
+        self.factory.session_lost()
+
+        USER_ACTION.session_lost(self.factory)
+
+        control_panel.session_lost(self.factory)
+
+        log_message('IRC - Connection Lost!', WARNING, 'irc_disconnected',
+                    session=self.factory.name)
+
     def joined(self, channel):
         """ This function is called when the bot joins the specified channel.
+        The bot never joins a channel itself, but ZNC attaches it to the
+        admin user's channels on connect, so it detaches from them again
+        (without parting them on the network), and ZNC stops sending their
+        messages.
 
         :param channel: the channel that the bot has just joined
 
         """
 
+        if settings.quiet_admin_sessions:
+
+            log_message('IRC - Detaching from ' + channel, INFO,
+                        'channel_detached', session=self.factory.name)
+
+            self.factory.scheduler.enqueue(['DETACH ' + channel], BULK)
+
     def privmsg(self, user, channel, message):
         """ This function is called when the bot receives a message.  This is
         where we can interpret feedback from the ZNC control_panel.
 
         We do so by performing a logical evaluation to see if (a) the message
-        is a response from control_panel or (b) if someone has sent the bot a
-        private message.  It will ignore everything else.
+        is a response from control_panel (or another admin module) or (b) if
+        someone has sent the bot a private message.  It will ignore
+        everything else.
 
         :param user: the user that sent the message
         :param channel: the channel that message was sent on
@@ -387,15 +1684,31 @@ class IRCProtocol(irc.IRCClient):
 
         user = user.split('!', 1)[0]
 
-        if user == self.control_panel:
+        if user in self.admin_modules:
 
-            # Parse the information received back from control_panel
-            USER_ACTION.parse_irc_feedback(message)
+            self.admin_reply(user, message)
 
-        elif channel == self.nickname:
+        # Other ZNC modules (such as *status) are never answered, as they
+        # would answer back
+        elif channel == self.nickname and not user.startswith('*'):
 
             self.automated_response(user)
 
+    def admin_reply(self, module, message):
+        """ This function is called with every reply from an admin module,
+        either by `privmsg` or straight from the line filter.
+
+        :param module: the module the reply came from
+        :param message: the reply
+
+        """
+
+        # Hand the reply to the command it answers
+        if not control_panel.feed(self.factory, message, module):
+
+            log_message('IRC - Unexpected feedback: ' + message, WARNING,
+                        'unexpected_feedback')
+
     def automated_response(self, user):
         """ This function allows us to return an automated response to a user.
         This is called when a user private-messages the bot, and includes a
@@ -415,18 +1728,90 @@ class IRCProtocol(irc.IRCClient):
         self.msg(user, message)
 
 
-class IRCFactory(protocol.ClientFactory):
-    """ IRCFactory is a Twisted ClientFactory object.  It wraps the IRCClient
-    protocol object, and enables us to interact with IRC functions outside of
-    the object itself.
+class IRCFactory(protocol.ReconnectingClientFactory):
+    """ IRCFactory is a Twisted ReconnectingClientFactory object.  It wraps
+    the IRCClient protocol object, and enables us to interact with IRC
+    functions outside of the object itself.
+
+    Each IRCFactory is one admin session in the connection pool.  It
+    reconnects with exponential backoff whenever its connection drops, and
+    has its own command scheduler so that one slow session does not hold up
+    the others.
 
     """
 
-    def __init__(self):
-        """ (Class has no attributes)
+    def __init__(self, name=0, backend=None):
+        """ Sets up the session.  It is not healthy until it has signed on.
+
+        :param name: a name for the session, used in log messages
+        :param backend: the name of the ZNC backend it connects to
+
+        """
+
+        self.name = name
+        self.backend = backend
+        self.the_client = None
+        self.healthy = False
+        self.last_activity = 0
+        self.in_flight = 0
+
+        # Lines received, and lines the line filter dropped by reason, over
+        # every connection
+        self.lines_received = 0
+        self.lines_dropped = Counter()
+
+        self.maxDelay = settings.reconnect_max_delay
+
+        self.scheduler = CommandScheduler(self.send_line,
+                                          settings.irc_send_rate,
+                                          settings.irc_send_burst,
+                                          )
+        self.scheduler.pause()
+
+    @property
+    def load(self):
+        """ The amount of outstanding work on this session, used by the pool
+        to choose the least busy session.
+
+        """
+
+        return self.in_flight + self.scheduler.backlog
+
+    def session_ready(self):
+        """ Called once the session has signed on to ZNC.
+
+        """
+
+        self.healthy = True
+        self.resetDelay()
+        self.scheduler.resume()
+
+    def session_lost(self):
+        """ Called when the session's connection has been lost.  Queued
+        commands are held until the session reconnects.
+
+        """
+
+        self.healthy = False
+        self.the_client = None
+        self.scheduler.pause()
+
+    def drop(self, reason):
+        """ Closes an unresponsive connection, so that it will reconnect.
+
+        :param reason: why the connection is being dropped
 
         """
 
+        log_message('IRC - Dropping session: ' + reason, WARNING,
+                    'irc_dropped', session=self.name)
+
+        self.healthy = False
+
+        if self.the_client is not None:
+
+            self.the_client.transport.loseConnection()
+
     def buildProtocol(self, address):
         """ This function is called when building the reactor, and it builds
         the IRC Protocol.
@@ -453,95 +1838,423 @@ class IRCFactory(protocol.ClientFactory):
         """
 
         log_message('IRC/SockJS - Sending message to channel: ' +
-                    self.channel + message)
+                    self.channel + message, DEBUG, 'channel_message')
 
         self.the_client.msg(self.channel, message)
 
     def send_line(self, line):
         """ This the sendLine function of IRC, which (much like `msg`) is
         defined (seemingly redundantly) here so it can be used outside of the
-        factory instance.  This function will NOT log the line to the terminal
-        because sensitive information (i.e. - passwords) are being passed
-        through this function.
+        factory instance.  Lines are only logged at the debug level, and
+        with any passwords redacted, as sensitive information (i.e. -
+        passwords) is passed through this function.
 
         :param line: the command line to send to IRC
 
         """
 
+        if self.the_client is None:
+
+            log_message('IRC - Session not connected, line dropped', WARNING,
+                        'line_dropped', session=self.name)
+
+            return
+
+        if event_log.enabled(DEBUG):
+
+            log_message('IRC - Sending line', DEBUG, 'irc_line',
+                        session=self.name, line=line)
+
         self.the_client.sendLine(line)
 
 
-def log_message(message):
-    """ This function simply logs a message to the terminal output if 
-    verbose output was selected when running the script initially.  Twisted
-    has built in logging functionality, so if verbose output was enabled that
-    will be too.  It will prepend a time stamp and some server information to
-    the beginning of all messages printed through this function.
+def register_live_metrics():
+    """ This function registers the metrics that are read from the running
+    server (connections, queues, sessions and IRC traffic) when the metrics
+    are rendered, rather than being recorded as they change.
+
+    """
+
+    sessions = connection_pool.sessions
+
+    REGISTRY.gauge('znc_sockjs_connections',
+                   'Open SockJS connections',
+                   function=lambda: relay_factory.live_connections)
+    REGISTRY.gauge('znc_admission_offenders',
+                   'Source IPs currently refused as offenders',
+                   function=admission.blocked_count)
+    REGISTRY.gauge('znc_registrations_queued',
+                   'Registrations waiting for a free slot',
+                   function=lambda: USER_ACTION.engine.queue_depth)
+    REGISTRY.gauge('znc_offline_queue_length',
+                   'Registrations saved while ZNC was unreachable',
+                   function=lambda: len(offline_queue))
+    REGISTRY.gauge('znc_registrations_in_flight',
+                   'Registrations waiting on a reply from ZNC',
+                   function=lambda: USER_ACTION.engine.in_flight)
+    REGISTRY.gauge('znc_sessions_healthy',
+                   'Admin sessions currently signed on to ZNC',
+                   function=lambda: len(connection_pool.healthy_sessions))
+    REGISTRY.gauge('znc_irc_backlog_lines',
+                   'Lines waiting in the command schedulers',
+                   ('session',),
+                   function=lambda: dict((session.name,
+                                          session.scheduler.backlog)
+                                         for session in sessions))
+    REGISTRY.counter('znc_irc_lines_sent_total',
+                     'Lines sent to ZNC',
+                     ('session',),
+                     function=lambda: dict((session.name,
+                                            session.scheduler.lines_sent)
+                                           for session in sessions))
+    REGISTRY.counter('znc_irc_bytes_sent_total',
+                     'Bytes sent to ZNC',
+                     ('session',),
+                     function=lambda: dict((session.name,
+                                            session.scheduler.bytes_sent)
+                                           for session in sessions))
+    REGISTRY.counter('znc_irc_lines_received_total',
+                     'Lines received from ZNC',
+                     ('session',),
+                     function=lambda: dict((session.name,
+                                            session.lines_received)
+                                           for session in sessions))
+    REGISTRY.counter('znc_irc_lines_dropped_total',
+                     'Lines from ZNC dropped before parsing, by reason',
+                     ('session', 'reason'),
+                     function=lambda: dict(((session.name, reason), count)
+                                           for session in sessions
+                                           for reason, count
+                                           in session.lines_dropped.items()))
+    REGISTRY.counter('znc_feedback_total',
+                     'Feedback lines from *controlpanel, by kind',
+                     ('kind',),
+                     function=lambda: dict(USER_ACTION.feedback_counts))
+    REGISTRY.counter('znc_controlpanel_replies_total',
+                     'Feedback lines from *controlpanel, by how they were '
+                     'matched to a command',
+                     ('result',),
+                     function=lambda: dict(control_panel.counts))
+    REGISTRY.gauge('znc_controlpanel_waiting',
+                   'Commands waiting on a reply from *controlpanel',
+                   function=lambda: control_panel.waiting)
+    REGISTRY.gauge('znc_backend_users',
+                   'Users placed on each ZNC backend (including reserved)',
+                   ('backend',),
+                   function=lambda: dict((name, cluster.counts[name])
+                                         for name in cluster.backends))
+    REGISTRY.gauge('znc_snapshot_users',
+                   'Users in the latest snapshot of ZNC',
+                   function=lambda: len(snapshots.current.users))
+    REGISTRY.gauge('znc_snapshot_age_seconds',
+                   'Seconds since the latest snapshot of ZNC was taken',
+                   function=lambda: time.time() - (snapshots.current.taken_at
+                                                   or time.time()))
+
+
+def log_message(message, level=INFO, event='message', **fields):
+    """ This function records a message in the event log, which buffers it
+    and writes it to the terminal output as JSON, off the reactor thread.
+    Only messages at or above the configured log level are kept (the
+    `LOG_LEVEL` setting, or info if verbose output was selected).  Twisted
+    has built in logging functionality, so if verbose output was enabled
+    that will be recorded too.
 
     :param message: the message to be logged
+    :param level: the level of the message (DEBUG, INFO, WARNING or ERROR)
+    :param event: the name of the event, used for sampling and searching
+    :param fields: any other details worth recording (passwords are
+                   redacted)
+
+    """
+
+    event_log.log(level, event, message, **fields)
+
+
+def log_level(new_settings):
+    """ This function works out the lowest level of message that is logged.
+    Verbose output always includes info messages.
+
+    :param new_settings: the LocalSettings to read `LOG_LEVEL` from
+
+    :return: the level number
 
     """
 
     if verbose_output_enabled:
 
-        print message
+        return min(new_settings.log_level, INFO)
+
+    return new_settings.log_level
 
 
-def send_client_response(return_message):
+def send_client_response(return_message, transport):
     """ This function simply sends the appropriate status message back
     to the user via SockJS.
 
     :param return_message: the message to be returned to the user
+    :param transport: the SockJS transport of the user
+
+    """
+
+    relay_factory.send(return_message, transport)
+
+
+def settings_reloaded(new_settings):
+    """ This function passes reloaded settings on to everything that keeps
+    its own copy of them.  Settings that are read when they are used (such
+    as the user to clone, or the contact email) need nothing here.
+
+    :param new_settings: the new LocalSettings instance
 
     """
 
-    relay_factory.send(return_message)
+    global user_validator
+
+    user_validator = UserValidator(new_settings)
+
+    USER_ACTION.engine.max_in_flight = new_settings.max_in_flight
+
+    control_panel.reply_timeout = new_settings.reply_timeout
+
+    event_log.set_level(log_level(new_settings))
+    event_log.sampling = new_settings.log_sampling
+
+    snapshots.bucket.rate = float(new_settings.snapshot_command_rate)
+
+    # Buckets that already exist keep their old rate until they are evicted
+    admission.rate = new_settings.admission_rate
+    admission.burst = new_settings.admission_burst
+    admission.max_queued = new_settings.max_queued_registrations
+    admission.drain_rate = registration_drain_rate(new_settings)
 
+    # Users already in the offline queue keep their old expiry
+    offline_queue.max_items = new_settings.offline_queue_size
+    offline_queue.max_age = new_settings.offline_queue_max_age
+    USER_ACTION.offline_drain.interval = 1.0 / new_settings.offline_drain_rate
 
-def send_irc_command(command, prefix='PRIVMSG *controlpanel '):
-    """ This function simply sends a specified command to IRC.
+    for session in connection_pool.sessions:
 
-    :param command: a command to send to IRC/ZNC
-    :param prefix: The prefix to add to the command, which defaults to the
-                    prefix necessary for doing most user actions with ZNC
+        session.scheduler.bucket.rate = float(new_settings.irc_send_rate)
+        session.scheduler.bucket.burst = float(new_settings.irc_send_burst)
+
+    # There may now be room for more registrations
+    USER_ACTION.start_pending_users()
+
+
+def check_settings():
+    """ This function reloads the settings if the config file has changed.
+    It is called regularly by a LoopingCall, so it never raises.
 
     """
 
-    irc_command = prefix + command
+    try:
+
+        changed = settings.check_for_changes()
+
+    except ValueError as error:
+
+        log_message(str(error), ERROR, 'settings_error')
+
+        return
+
+    if changed:
 
-    irc_factory.send_line(irc_command)
+        log_message('Settings reloaded: ' + ', '.join(changed), INFO,
+                    'settings_reloaded')
+
+        for name in changed:
+
+            if name in settings.RESTART_REQUIRED:
+
+                log_message('Setting {} will take effect after a '
+                            'restart'.format(name), WARNING,
+                            'restart_required')
 
 
 if __name__ == '__main__':
 
+    # Imported here rather than at the top, so importing this module (from a
+    # test or a benchmark) doesn't pay for the entry point's dependencies
+    from docopt import docopt
+
     options = docopt(__doc__)
 
-    if options['--verbose']:
+    verbose_output_enabled = options['--verbose']
 
-        verbose_output_enabled = True
+    # The bulk file is read before anything connects to ZNC, so a mistake
+    # in it stops the run with a message rather than a traceback
+    bulk_users = None
 
-        log.startLogging(sys.stdout)
+    if options['--bulk']:
 
-    else:
+        try:
+
+            bulk_users = read_users(options['--bulk'])
+
+        except (EnvironmentError, ValueError) as error:
+
+            sys.exit('Could not read {}: {}'.format(options['--bulk'], error))
 
-        verbose_output_enabled = False
+    # Log messages are buffered, and written on a thread
+    event_log = EventLog(sys.stdout, log_level(settings),
+                         settings.log_sampling)
+    reactor.addSystemEventTrigger('before', 'shutdown', event_log.close)
+
+    if verbose_output_enabled:
+
+        log.startLoggingWithObserver(event_log.observe, setStdout=False)
+
+    else:
 
         print 'Server started!'
 
-    # Start building the factories
-    irc_factory = IRCFactory()
+    # The validator is built once (and again when the settings are
+    # reloaded), so every request only pays for the checks
+    user_validator = UserValidator(settings)
+
+    # Turns away registrations from clients that send too many, or when the
+    # queue is already longer than ZNC can get through
+    admission = AdmissionController(settings.admission_rate,
+                                    settings.admission_burst,
+                                    settings.max_queued_registrations,
+                                    registration_drain_rate(settings))
+
+    # Declare an instance of UserAdmin for use on both the SockJS and IRC
+    # sides of the bot
+    USER_ACTION = UserAdmin()
+
+    # Start building the factories, with ZNC_CONNECTIONS sessions for each
+    # backend
+    irc_sessions = [IRCFactory('{}/{}'.format(backend.name, number),
+                               backend.name)
+                    for backend in settings.backends
+                    for number in range(settings.znc_connections)]
+
+    connection_pool = ConnectionPool(irc_sessions, settings.health_timeout)
+
+    # Knows which backend each user is on, and places new ones
+    cluster = BackendCluster(settings.backends,
+                             placements(settings.journal_file),
+                             settings.backend_placement)
+
+    # Every command for `*controlpanel` is sent, and answered, through this
+    control_panel = ZNCControlPanel(connection_pool,
+                                    settings.max_concurrent_commands,
+                                    settings.reply_timeout)
 
     relay_factory = SockJSFactory()
 
-    sockjs_factory = TXSockJSFactory(relay_factory)
+    register_live_metrics()
+
+    # Keeps a snapshot of every user on ZNC, for admin lookups.  The first
+    # one is taken when a session signs on.
+    snapshots = SnapshotCollector(control_panel, settings.snapshot_file,
+                                  USER_ACTION.variable_list,
+                                  settings.snapshot_command_rate,
+                                  username_index,
+                                  [backend.name
+                                   for backend in settings.backends],
+                                  cluster)
+
+    snapshot_timer = task.LoopingCall(snapshots.collect)
+    snapshot_timer.start(settings.snapshot_interval, now=False)
+
+    # Watches the config file for changes
+    settings.add_listener(settings_reloaded)
+
+    settings_watcher = task.LoopingCall(check_settings)
+    settings_watcher.start(settings.reload_interval, now=False)
+
+    # Replays the journal, to find users a previous run left half-registered
+    USER_ACTION.partial_users = partial_users(settings.journal_file)
+
+    journal = Journal(settings.journal_file, settings.journal_flush_interval)
+    reactor.addSystemEventTrigger('before', 'shutdown', journal.close)
+
+    # Signups saved while ZNC was unreachable, including any a previous run
+    # left behind
+    offline_queue = OfflineQueue(settings.offline_queue_file,
+                                 settings.offline_queue_size,
+                                 settings.offline_queue_max_age)
+    reactor.addSystemEventTrigger('before', 'shutdown', offline_queue.close)
+
+    # Behind a reverse proxy, the client's IP is taken from this header
+    sockjs_options = {'proxy_header': settings.proxy_header or None}
+
+    # Connects the IRC side of the bot to every backend using SSL
+    for backend in settings.backends:
+
+        connection_pool.connect(backend.host, backend.port,
+                                ssl.ClientContextFactory(), backend.name)
+
+    if options['--bulk']:
+
+        # Runs a single bulk provisioning job, and then stops
+        bulk_job = BulkJob(bulk_users,
+                           USER_ACTION.new_bulk_user,
+                           Checkpoint(options['--checkpoint']),
+                           settings.bulk_window,
+                           USER_ACTION.validate_new_user,
+                           )
+
+        def finish_bulk_job(report):
+            """ Prints the throughput report once every user is done.
+
+            """
+
+            print format_report(report)
+
+            reactor.stop()
+
+        bulk_job.start().addCallback(finish_bulk_job)
+
+    else:
+
+        port = int(settings.register_port)
+
+        if options['--web']:
+
+            # Serves the pages, static files and SockJS from one site.
+            # Flask is only imported when it is needed.
+            import app as web_app
+            from web import build_web_site, SOCKJS_PATH
+
+            web_app.settings = settings
+            web_app.sockjs_url = '/' + SOCKJS_PATH
+            web_app.refresh_client_config()
+
+            # Redirects use the live placements, rather than the journal
+            web_app.locate_backend = cluster.backend_for
+
+            settings.add_listener(web_app.settings_reloaded)
+
+            reactor.listenTCP(port, build_web_site(web_app.app,
+                                                   relay_factory,
+                                                   settings.web_threads,
+                                                   sockjs_options))
+
+        else:
+
+            from txsockjs.factory import SockJSFactory as TXSockJSFactory
+
+            # Connects the SockJS side of the bot
+            reactor.listenTCP(port, TXSockJSFactory(relay_factory,
+                                                    sockjs_options))
 
-    # Connects the IRC side of the bot using SSL
-    reactor.connectSSL(settings.znc_ip, settings.znc_port, irc_factory,
-                       ssl.ClientContextFactory())
+        from admin import build_admin_site
 
-    # Connects the SockJS side of the bot
-    port = int(settings.register_port)
-    reactor.listenTCP(port, sockjs_factory)
+        # Serves the admin API, on localhost only
+        reactor.listenTCP(settings.admin_port,
+                          build_admin_site(USER_ACTION.new_bulk_user,
+                                           settings.bulk_window,
+                                           USER_ACTION.validate_new_user,
+                                           USER_ACTION.run_account_action,
+                                           USER_ACTION.find_unused_accounts,
+                                           settings.account_job_time_limit,
+                                           snapshots,
+                                           USER_ACTION.validate_account),
+                          interface='127.0.0.1')
 
     # Start the Twisted Reactor
     reactor.run()
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the metrics module.  It holds a small registry of counters, gauges
+and histograms, and renders them in the Prometheus text format.  It has no
+dependencies, so both the Twisted registration server and the Flask app can
+use it.
+
+Recording a value is a dict update (plus a bisect for histograms), so it is
+cheap enough to do on every request.  Values that already live elsewhere
+(such as the number of open connections) are read through a function only
+when the metrics are rendered.
+
+"""
+
+from bisect import bisect_left
+
+# The default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+def format_labels(label_names, label_values, extra=None):
+    """ Formats a set of labels for the Prometheus text format.
+
+    :param label_names: a tuple of label names
+    :param label_values: a tuple of values, in the same order
+    :param extra: an optional (name, value) pair to add at the end
+
+    :return: the labels as a string, such as '{stage="queue"}', or '' if
+             there are none
+
+    """
+
+    pairs = zip(label_names, label_values)
+
+    if extra is not None:
+
+        pairs.append(extra)
+
+    if not pairs:
+
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', ''))
+                          for name, value in pairs) + '}'
+
+
+class Metric():
+    """ The parts shared by every kind of metric.  A metric may have labels,
+    in which case each combination of label values is tracked separately.
+
+    A metric may also be given a function instead of being updated
+    directly.  The function is called when the metrics are rendered, and
+    returns either a number or, for a labelled metric, a dict of
+    {label value tuple: number}.
+
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        """ Creates the metric.
+
+        :param name: the metric name
+        :param help_text: a one-line description of the metric
+        :param label_names: a tuple of label names
+        :param function: an optional function that supplies the value
+
+        """
+
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.function = function
+        self.values = {}
+
+    def current_values(self):
+        """ The current value of each label combination.
+
+        :return: a dict of {label value tuple: number}
+
+        """
+
+        if self.function is None:
+
+            return self.values
+
+        value = self.function()
+
+        if isinstance(value, dict):
+
+            return dict((key if isinstance(key, tuple) else (key,), number)
+                        for key, number in value.items())
+
+        return {(): value}
+
+    def render(self):
+        """ Renders the metric in the Prometheus text format.
+
+        :return: a list of lines
+
+        """
+
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help_text),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+
+        for label_values, value in sorted(self.current_values().items()):
+
+            lines.append('{}{} {}'.format(self.name,
+                                          format_labels(self.label_names,
+                                                        label_values),
+                                          value))
+
+        return lines
+
+
+class Counter(Metric):
+    """ A value that only goes up.
+
+    """
+
+    kind = 'counter'
+
+    def inc(self, *label_values, **options):
+        """ Adds to the counter.
+
+        :param label_values: the label values, in order
+        :param amount: the amount to add (default = 1)
+
+        """
+
+        self.values[label_values] = \
+            self.values.get(label_values, 0) + options.get('amount', 1)
+
+
+class Gauge(Metric):
+    """ A value that can go up and down.
+
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        """ Sets the gauge.
+
+        :param value: the new value
+        :param label_values: the label values, in order
+
+        """
+
+        self.values[label_values] = value
+
+
+class Histogram(Metric):
+    """ Counts observations into buckets, and keeps their sum and count.
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(),
+                 buckets=LATENCY_BUCKETS):
+        """ Creates the histogram.
+
+        :param name: the metric name
+        :param help_text: a one-line description of the metric
+        :param label_names: a tuple of label names
+        :param buckets: the upper bound of each bucket, in increasing order
+
+        """
+
+        Metric.__init__(self, name, help_text, label_names)
+
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        """ Records an observation.
+
+        :param value: the observed value
+        :param label_values: the label values, in order
+
+        """
+
+        series = self.values.get(label_values)
+
+        if series is None:
+
+            # One count per bucket (plus +Inf), then the sum
+            series = self.values[label_values] = \
+                [0] * (len(self.buckets) + 1) + [0.0]
+
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        """ Renders the histogram in the Prometheus text format, with
+        cumulative buckets.
+
+        :return: a list of lines
+
+        """
+
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help_text),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+
+        for label_values, series in sorted(self.values.items()):
+
+            total = 0
+
+            for bound, count in zip(bounds, series):
+
+                total += count
+
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    format_labels(self.label_names, label_values,
+                                  ('le', bound)),
+                    total))
+
+            labels = format_labels(self.label_names, label_values)
+
+            lines.append('{}_sum{} {}'.format(self.name, labels, series[-1]))
+            lines.append('{}_count{} {}'.format(self.name, labels, total))
+
+        return lines
+
+
+class Registry():
+    """ A collection of metrics that are rendered together.
+
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """ Adds a metric to the registry.
+
+        :param metric: the metric to add
+
+        :return metric: the same metric, for convenience
+
+        """
+
+        self.metrics.append(metric)
+
+        return metric
+
+    def counter(self, name, help_text, label_names=(), function=None):
+        """ Creates and registers a Counter.
+
+        """
+
+        return self.register(Counter(name, help_text, label_names, function))
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        """ Creates and registers a Gauge.
+
+        """
+
+        return self.register(Gauge(name, help_text, label_names, function))
+
+    def histogram(self, name, help_text, label_names=(),
+                  buckets=LATENCY_BUCKETS):
+        """ Creates and registers a Histogram.
+
+        """
+
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        """ Renders every metric in the Prometheus text format.
+
+        :return: the complete exposition, as a string
+
+        """
+
+        lines = []
+
+        for metric in self.metrics:
+
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+# The registry used by the process
+REGISTRY = Registry()
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,285 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the offline queue.  While no admin session is signed on to ZNC
+(during a maintenance window, say), new registrations are accepted into
+this queue rather than being lost, and the user is told theirs is queued.
+Once a session signs on again, the queue is drained at a controlled rate
+(see `UserAdmin.drain_offline_queue` in `main.py`), so the backlog never
+floods ZNC or holds up live signups.
+
+The queue is kept in a JSON-lines file, one object per change:
+
+    {"op": "add", "user": "someone", "password": "...", "t": ...,
+     "expires": ...}
+    {"op": "remove", "user": "someone", "reason": "created"}
+
+Each addition is written and fsync'd before the user is told they are
+queued, so a queued registration survives a restart.  The file holds
+passwords until each registration is made, so only its owner may read it,
+and it is rewritten without the removed entries once they make up most of
+it.
+
+The queue is bounded: once it holds `max_items` registrations, no more are
+accepted.  Each one also has its own expiry, `max_age` seconds after it was
+queued, after which it is dropped rather than created long after the user
+has given up on it.
+
+"""
+
+from collections import OrderedDict
+import json
+import os
+import time
+
+# The kinds of change recorded in the file
+ADD = 'add'
+REMOVE = 'remove'
+
+# The file is only rewritten once it holds at least this many dead lines
+COMPACT_MINIMUM = 100
+
+
+class OfflineQueue():
+    """ A bounded, disk-backed queue of registrations, in the order they
+    arrived.  A registration is handed out for creation with `take`, and
+    stays in the queue (and on disk) until it is `remove`d, so one that is
+    interrupted is tried again.
+
+    """
+
+    def __init__(self, path, max_items=1000, max_age=86400):
+        """ Opens (or creates) the queue, and loads what a previous run left
+        in it.
+
+        :param path: the path of the queue file
+        :param max_items: the most registrations the queue may hold
+        :param max_age: the seconds a registration may wait before it
+                        expires
+
+        """
+
+        self.path = path
+        self.max_items = max_items
+        self.max_age = max_age
+
+        # {username: (password, queued at, expires at)}, oldest first
+        self.items = OrderedDict()
+
+        # Usernames handed out by `take`, and not yet removed or released
+        self.taken = set()
+
+        # Lines in the file that no longer describe a queued registration
+        self.dead_lines = 0
+
+        self.queue_file = None
+
+        self.load()
+        self.compact()
+
+    def __len__(self):
+
+        return len(self.items)
+
+    def __contains__(self, username):
+
+        return username in self.items
+
+    @property
+    def full(self):
+        """ Whether the queue has no room for another registration.
+
+        """
+
+        return len(self.items) >= self.max_items
+
+    def load(self):
+        """ Replays the queue file.  A torn last line (from a crash) is
+        skipped, as its registration was never acknowledged.
+
+        """
+
+        try:
+
+            queue_file = open(self.path)
+
+        except IOError:
+
+            return
+
+        with queue_file:
+
+            for line in queue_file:
+
+                try:
+
+                    entry = json.loads(line)
+
+                except ValueError:
+
+                    continue
+
+                if entry.get('op') == ADD:
+
+                    self.items[entry['user']] = (entry['password'],
+                                                 entry['t'],
+                                                 entry['expires'])
+
+                elif entry.get('op') == REMOVE:
+
+                    self.items.pop(entry['user'], None)
+
+    def add(self, username, password, now=None):
+        """ Queues a registration, and waits for it to reach the disk.
+
+        :param username: the username
+        :param password: the password
+        :param now: the current time (default = time.time())
+
+        :return: True if it was queued, or False if the queue is full or
+                 the username is already queued
+
+        """
+
+        if username in self.items or self.full:
+
+            return False
+
+        now = time.time() if now is None else now
+        expires = now + self.max_age
+
+        self.items[username] = (password, now, expires)
+
+        self.write({'op': ADD, 'user': username, 'password': password,
+                    't': round(now, 3), 'expires': round(expires, 3)})
+
+        return True
+
+    def take(self):
+        """ Hands out the oldest registration that isn't already handed out.
+
+        :return: a tuple of (username, password, queued at), or None if
+                 there is nothing to hand out
+
+        """
+
+        for username, (password, queued_at, _) in self.items.iteritems():
+
+            if username not in self.taken:
+
+                self.taken.add(username)
+
+                return username, password, queued_at
+
+        return None
+
+    def release(self, username):
+        """ Puts a registration that was handed out back in line, after it
+        failed for a reason that may pass (such as a lost connection).
+
+        :param username: the username
+
+        """
+
+        self.taken.discard(username)
+
+    def remove(self, username, reason):
+        """ Takes a registration out of the queue for good.
+
+        :param username: the username
+        :param reason: why it was removed (such as 'created')
+
+        """
+
+        if self.items.pop(username, None) is None:
+
+            return
+
+        self.taken.discard(username)
+
+        self.write({'op': REMOVE, 'user': username, 'reason': reason})
+
+        # Both its lines are now dead
+        self.dead_lines += 2
+
+        if self.dead_lines >= COMPACT_MINIMUM and \
+                self.dead_lines > len(self.items):
+
+            self.compact()
+
+    def expire(self, now=None):
+        """ Removes every registration that has passed its expiry, unless it
+        has been handed out.
+
+        :param now: the current time (default = time.time())
+
+        :return: a list of the usernames that expired
+
+        """
+
+        now = time.time() if now is None else now
+
+        expired = [username
+                   for username, (_, _, expires) in self.items.iteritems()
+                   if expires <= now and username not in self.taken]
+
+        for username in expired:
+
+            self.remove(username, 'expired')
+
+        return expired
+
+    def write(self, entry):
+        """ Appends an entry to the file, and waits for it to reach the
+        disk.
+
+        :param entry: the entry, as a dict
+
+        """
+
+        self.queue_file.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.queue_file.flush()
+        os.fsync(self.queue_file.fileno())
+
+    def compact(self):
+        """ Rewrites the file with only the queued registrations.  It is
+        written to a temporary file first and then renamed, so a crash never
+        loses the queue.
+
+        """
+
+        temporary_path = self.path + '.tmp'
+
+        descriptor = os.open(temporary_path,
+                             os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        os.fchmod(descriptor, 0600)
+
+        with os.fdopen(descriptor, 'w') as temporary_file:
+
+            for username, (password, queued_at, expires) in \
+                    self.items.iteritems():
+
+                temporary_file.write(json.dumps(
+                    {'op': ADD, 'user': username, 'password': password,
+                     't': queued_at, 'expires': expires},
+                    sort_keys=True) + '\n')
+
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+
+        os.rename(temporary_path, self.path)
+
+        if self.queue_file is not None:
+
+            self.queue_file.close()
+
+        self.queue_file = open(self.path, 'a')
+        self.dead_lines = 0
+
+    def close(self):
+        """ Closes the file.
+
+        """
+
+        self.queue_file.close()
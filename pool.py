@@ -0,0 +1,121 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the connection pool module.  It keeps several admin sessions open
+to ZNC, checks that they are still responsive, and hands out the least busy
+one whenever there is work to do.  When users are spread over several ZNC
+backends, each session belongs to one of them, and work for a backend only
+goes to its own sessions.
+
+"""
+
+from twisted.internet import task
+
+
+class ConnectionPool():
+    """ A pool of IRC admin sessions.  Each session is a reconnecting client
+    factory with its own connection to ZNC.  The pool does not reconnect
+    sessions itself, it only drops sessions that have stopped responding and
+    lets their factory reconnect with backoff.
+
+    """
+
+    def __init__(self, sessions, health_timeout=300.0, check_interval=30.0,
+                 reactor=None):
+        """ Creates the pool.  Nothing is connected until `connect()` is
+        called.
+
+        :param sessions: a list of session factories (see IRCFactory)
+        :param health_timeout: the number of seconds a session may go without
+                               receiving anything before it is dropped
+        :param check_interval: the number of seconds between health checks
+        :param reactor: the reactor used to connect and to schedule health
+                        checks (default = the global reactor)
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.sessions = sessions
+        self.health_timeout = health_timeout
+        self.check_interval = check_interval
+        self.reactor = reactor
+
+        self.health_check = task.LoopingCall(self.check_health)
+        self.health_check.clock = reactor
+
+    def connect(self, host, port, context_factory, backend=None):
+        """ Opens an SSL connection to ZNC for every session in the pool (or
+        every session of one backend), and starts the periodic health check.
+
+        :param host: the ZNC address
+        :param port: the ZNC port
+        :param context_factory: the SSL context factory to use
+        :param backend: the name of the backend to connect the sessions of
+                        (default = every session)
+
+        """
+
+        for session in self.sessions:
+
+            if backend is None or session.backend == backend:
+
+                self.reactor.connectSSL(host, port, session, context_factory)
+
+        if not self.health_check.running:
+
+            self.health_check.start(self.check_interval, now=False)
+
+    @property
+    def healthy_sessions(self):
+        """ The sessions that are currently signed on to ZNC.
+
+        """
+
+        return [session for session in self.sessions if session.healthy]
+
+    @property
+    def healthy_backends(self):
+        """ The names of the backends with at least one healthy session.
+
+        """
+
+        return set(session.backend for session in self.healthy_sessions)
+
+    def pick(self, backend=None):
+        """ Picks the session that should take the next piece of work.  This
+        is the healthy session with the least outstanding work.
+
+        :param backend: the name of the backend the work is for (default =
+                        any backend)
+
+        :return session: a session factory, or None if none are healthy
+
+        """
+
+        healthy = [session for session in self.healthy_sessions
+                   if backend is None or session.backend == backend]
+
+        if not healthy:
+
+            return None
+
+        return min(healthy, key=lambda session: session.load)
+
+    def check_health(self):
+        """ Drops any session that has not received a line from ZNC within
+        `health_timeout` seconds.  Its factory will then reconnect it.
+
+        """
+
+        now = self.reactor.seconds()
+
+        for session in self.healthy_sessions:
+
+            if now - session.last_activity > self.health_timeout:
+
+                session.drop('no activity for {:.0f} seconds'.format(
+                    now - session.last_activity))
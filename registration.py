@@ -0,0 +1,293 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the registration engine module.  It keeps a record of every
+registration that has been requested but not yet answered by ZNC, so that
+many signups can be in flight at the same time without overwriting each
+other.
+
+"""
+
+from collections import deque, OrderedDict
+import time
+
+from scheduler import INTERACTIVE, BULK
+
+
+class PendingRegistration():
+    """ A single registration request.  This is the correlation record that
+    ties a reply from ZNC back to the username and password that caused it.
+
+    """
+
+    def __init__(self, username, password, transport=None,
+                 priority=INTERACTIVE, on_complete=None):
+        """ Creating a record does not send anything to ZNC, it only stores
+        the information that will be needed once ZNC replies.
+
+        :param username: the username to be registered
+        :param password: the password for the new user
+        :param transport: the SockJS transport the status should go to
+        :param priority: the scheduler priority for this user's commands
+        :param on_complete: an optional function called with the outcome
+
+        """
+
+        self.username = username
+        self.password = password
+        self.transport = transport
+        self.priority = priority
+        self.on_complete = on_complete
+        self.created = time.time()
+        self.started = None
+
+        # The admin session the cloneuser was given to, and whether it has
+        # actually been written to ZNC yet
+        self.session = None
+        self.clone_batch = None
+        self.sent = False
+        self.sent_at = None
+
+        # The reactor call that fails this registration if ZNC never
+        # replies, and whether that has already happened
+        self.deadline = None
+        self.timed_out = False
+
+    def mark_sent(self):
+        """ Records that the `cloneuser` for this user has been written to
+        ZNC, so a reply can now be expected.
+
+        """
+
+        self.sent = True
+        self.sent_at = time.time()
+
+    def cancel_deadline(self):
+        """ Cancels the reply deadline, if one is still pending.
+
+        """
+
+        if self.deadline is not None and self.deadline.active():
+
+            self.deadline.cancel()
+
+        self.deadline = None
+
+
+class RegistrationEngine():
+    """ The RegistrationEngine holds every pending registration.  Records
+    are kept by username, and records that have had their `cloneuser` sent
+    are also kept in the order they were sent, which is the order that
+    `*controlpanel` will reply in.
+
+    """
+
+    def __init__(self, max_in_flight=50):
+        """ Sets up the empty queues.
+
+        :param max_in_flight: the number of registrations that may wait on a
+                              reply from ZNC at the same time
+
+        """
+
+        self.max_in_flight = max_in_flight
+
+        # Every known record, keyed by username
+        self.pending = OrderedDict()
+
+        # Records that have not yet been sent to ZNC, by priority
+        self.waiting = {
+            INTERACTIVE: deque(),
+            BULK: deque(),
+        }
+
+        # Records that have been sent, in the order ZNC will reply.  This
+        # also holds records that have timed out but may still be answered
+        # late, so that a late reply does not shift the order of the rest.
+        self.awaiting_reply = deque()
+        self.timed_out = 0
+
+    @property
+    def queue_depth(self):
+        """ The number of registrations waiting for a free slot.
+
+        """
+
+        return sum(len(queue) for queue in self.waiting.values())
+
+    @property
+    def in_flight(self):
+        """ The number of registrations waiting on a reply from ZNC, not
+        counting ones that have already timed out.
+
+        """
+
+        return len(self.awaiting_reply) - self.timed_out
+
+    def submit(self, username, password, transport=None,
+               priority=INTERACTIVE, on_complete=None):
+        """ Adds a new registration to the queue.  A username may only have
+        one pending registration at a time.
+
+        :param username: the username to be registered
+        :param password: the password for the new user
+        :param transport: the SockJS transport the status should go to
+        :param priority: the scheduler priority for this user's commands
+        :param on_complete: an optional function called with the outcome
+
+        :return record: the new PendingRegistration, or None if that username
+                        is already pending
+
+        """
+
+        if username in self.pending:
+
+            return None
+
+        record = PendingRegistration(username, password, transport,
+                                     priority, on_complete)
+
+        self.pending[username] = record
+        self.waiting[priority].append(record)
+
+        return record
+
+    def start_ready(self):
+        """ Moves as many waiting registrations as there are free slots into
+        the in-flight queue, interactive registrations first.  The caller is
+        responsible for sending the `cloneuser` command for each record
+        returned, in order.
+
+        :return started: a list of PendingRegistration objects to send
+
+        """
+
+        started = []
+
+        while self.in_flight < self.max_in_flight:
+
+            record = self.next_waiting()
+
+            if record is None:
+
+                break
+
+            record.started = time.time()
+
+            self.awaiting_reply.append(record)
+            started.append(record)
+
+        return started
+
+    def next_waiting(self):
+        """ Takes the next waiting record, highest priority first.
+
+        :return record: a PendingRegistration, or None if none are waiting
+
+        """
+
+        for priority in sorted(self.waiting):
+
+            if self.waiting[priority]:
+
+                return self.waiting[priority].popleft()
+
+        return None
+
+    def expire(self, record):
+        """ Marks an in-flight registration as timed out.  The record stays
+        in the reply order (so that a late reply is matched to it rather
+        than to the next registration), but no longer counts as in flight or
+        blocks a new registration for the same username.
+
+        :param record: the PendingRegistration that timed out
+
+        """
+
+        record.timed_out = True
+        self.timed_out += 1
+
+        self.complete(record)
+
+    def forget(self, record):
+        """ Drops a timed out registration that was never answered, once a
+        late reply is no longer expected.
+
+        :param record: the timed out PendingRegistration
+
+        """
+
+        self.remove(record)
+
+    def remove(self, record):
+        """ Takes a record out of the reply order, once it has been answered
+        (or an answer is no longer expected).
+
+        :param record: the PendingRegistration to remove
+
+        """
+
+        if record not in self.awaiting_reply:
+
+            return
+
+        self.awaiting_reply.remove(record)
+
+        if record.timed_out:
+
+            self.timed_out -= 1
+
+    def abandon(self, session):
+        """ Takes every in-flight registration off of a session that has
+        lost its connection.  Registrations whose `cloneuser` was never
+        written go back to the front of the queue to be tried on another
+        session.  The rest can no longer be answered, and are returned.
+
+        :param session: the admin session that was lost
+
+        :return lost: a list of PendingRegistration objects that were sent
+                      but never answered
+
+        """
+
+        lost = []
+        unsent = []
+
+        for record in [record for record in self.awaiting_reply
+                       if record.session is session]:
+
+            self.remove(record)
+
+            if record.timed_out:
+
+                continue
+
+            if record.sent:
+
+                lost.append(record)
+
+            else:
+
+                record.clone_batch.cancel()
+                record.session = None
+                record.clone_batch = None
+
+                unsent.append(record)
+
+        for record in reversed(unsent):
+
+            self.waiting[record.priority].appendleft(record)
+
+        return lost
+
+    def complete(self, record):
+        """ Forgets a registration once it has been answered.
+
+        :param record: the PendingRegistration that has finished
+
+        """
+
+        if self.pending.get(record.username) is record:
+
+            del self.pending[record.username]
@@ -0,0 +1,331 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the outbound command scheduler.  Every line sent to ZNC passes
+through it, so that a burst of signups is spread out at a steady rate
+instead of tripping ZNC/IRC flood protection.
+
+"""
+
+from collections import deque
+import time
+
+# Priorities - lower numbers are sent first
+INTERACTIVE = 0
+BULK = 1
+
+
+class TokenBucket():
+    """ A simple token bucket.  Tokens are added at a fixed rate up to a
+    maximum (the burst size), and each line sent costs one token.
+
+    """
+
+    def __init__(self, rate, burst, clock=time.time):
+        """ The bucket starts full.
+
+        :param rate: the number of tokens added per second
+        :param burst: the most tokens the bucket can hold
+        :param clock: a function returning the current time in seconds
+
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+
+        self.tokens = self.burst
+        self.updated = self.clock()
+
+    def refill(self):
+        """ Adds the tokens that have accumulated since the last refill.
+
+        """
+
+        now = self.clock()
+
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens=1):
+        """ Takes tokens from the bucket if there are enough of them.
+
+        :param tokens: the number of tokens to take
+
+        :return: True if the tokens were taken, False otherwise
+
+        """
+
+        self.refill()
+
+        if self.tokens >= tokens:
+
+            self.tokens -= tokens
+
+            return True
+
+        return False
+
+    def delay(self, tokens=1):
+        """ The time until enough tokens will be available.
+
+        :param tokens: the number of tokens wanted
+
+        :return: the number of seconds to wait, or 0 if they are available
+
+        """
+
+        self.refill()
+
+        if self.tokens >= tokens:
+
+            return 0
+
+        return (tokens - self.tokens) / self.rate
+
+
+class Batch():
+    """ A group of lines that are sent together, in order.  A batch that
+    has not started sending can still be cancelled.
+
+    """
+
+    def __init__(self, lines, on_sent=None, on_line_sent=None):
+        """ Creates the batch.
+
+        :param lines: a list of lines to send, in order
+        :param on_sent: an optional function called once the last line of
+                        the batch has been written
+        :param on_line_sent: an optional function called each time a line
+                             of the batch has been written
+
+        """
+
+        self.lines = deque(lines)
+        self.on_sent = on_sent
+        self.on_line_sent = on_line_sent
+        self.cancelled = False
+
+    def cancel(self):
+        """ Stops the batch from being sent, if it has not started yet.
+
+        """
+
+        self.cancelled = True
+
+
+class CommandScheduler():
+    """ The CommandScheduler sits between the `*controlpanel` client and the
+    IRC client.  Commands are queued in batches (usually all of the commands
+    for one user), and batches are sent whole and in order.  Interactive
+    batches are always sent ahead of bulk batches.
+
+    While the scheduler is paused (for example, while its connection to ZNC
+    is down) lines are held in the queue rather than sent.
+
+    """
+
+    def __init__(self, send, rate=5.0, burst=10, reactor=None,
+                 rate_window=10.0):
+        """ Sets up the queues and the token bucket.
+
+        :param send: the function that actually writes a line to IRC
+        :param rate: the number of lines that may be sent per second
+        :param burst: the number of lines that may be sent at once
+        :param reactor: the Twisted reactor used to schedule sends
+        :param rate_window: the number of seconds `send_rate` is averaged over
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.send = send
+        self.reactor = reactor
+        self.bucket = TokenBucket(rate, burst, clock=reactor.seconds)
+
+        self.queues = {
+            INTERACTIVE: deque(),
+            BULK: deque(),
+        }
+
+        self.current_batch = None
+        self.delayed_call = None
+        self.paused = False
+
+        # Metrics
+        self.backlog = 0
+        self.lines_sent = 0
+        self.bytes_sent = 0
+        self.rate_window = float(rate_window)
+        self.recent_sends = deque()
+
+    @property
+    def send_rate(self):
+        """ The number of lines sent per second, averaged over the last
+        `rate_window` seconds.
+
+        """
+
+        self.expire_recent_sends(self.reactor.seconds())
+
+        return len(self.recent_sends) / self.rate_window
+
+    def enqueue(self, lines, priority=INTERACTIVE, on_sent=None,
+                on_line_sent=None):
+        """ Queues a batch of lines to be sent together.
+
+        :param lines: a list of lines to send, in order
+        :param priority: INTERACTIVE or BULK
+        :param on_sent: an optional function called once the whole batch
+                        has been written
+        :param on_line_sent: an optional function called as each line is
+                             written
+
+        :return batch: the queued Batch
+
+        """
+
+        batch = Batch(lines, on_sent, on_line_sent)
+
+        if not batch.lines:
+
+            return batch
+
+        self.queues[priority].append(batch)
+        self.backlog += len(batch.lines)
+
+        if self.delayed_call is None:
+
+            self.drain()
+
+        return batch
+
+    def pause(self):
+        """ Stops sending until `resume()` is called.
+
+        """
+
+        self.paused = True
+
+        if self.delayed_call is not None:
+
+            self.delayed_call.cancel()
+            self.delayed_call = None
+
+    def resume(self):
+        """ Starts sending queued lines again.
+
+        """
+
+        self.paused = False
+
+        if self.delayed_call is None:
+
+            self.drain()
+
+    def drain(self):
+        """ Sends as many queued lines as the token bucket allows, and then
+        schedules itself to run again when more tokens are available.
+
+        """
+
+        self.delayed_call = None
+
+        while not self.paused:
+
+            if self.current_batch is None and not self.backlog:
+
+                return
+
+            wait = self.bucket.delay()
+
+            if wait > 0:
+
+                self.delayed_call = self.reactor.callLater(wait, self.drain)
+
+                return
+
+            # The next batch is only picked once a line can be sent, so a
+            # batch queued or cancelled during the wait is accounted for
+            if self.current_batch is None:
+
+                self.current_batch = self.next_batch()
+
+                if self.current_batch is None:
+
+                    return
+
+            self.bucket.consume()
+
+            batch = self.current_batch
+
+            self.send_now(batch.lines.popleft())
+
+            if batch.on_line_sent is not None:
+
+                batch.on_line_sent()
+
+            if not batch.lines:
+
+                self.current_batch = None
+
+                if batch.on_sent is not None:
+
+                    batch.on_sent()
+
+    def next_batch(self):
+        """ Picks the next batch to send, highest priority first.  Cancelled
+        batches are thrown away.
+
+        :return batch: a Batch, or None if nothing is queued
+
+        """
+
+        for priority in sorted(self.queues):
+
+            queue = self.queues[priority]
+
+            while queue:
+
+                batch = queue.popleft()
+
+                if not batch.cancelled:
+
+                    return batch
+
+                self.backlog -= len(batch.lines)
+
+        return None
+
+    def send_now(self, line):
+        """ Writes a single line to IRC and records it in the metrics.
+
+        :param line: the line to send
+
+        """
+
+        now = self.reactor.seconds()
+
+        self.backlog -= 1
+        self.lines_sent += 1
+        self.bytes_sent += len(line)
+        self.recent_sends.append(now)
+        self.expire_recent_sends(now)
+
+        self.send(line)
+
+    def expire_recent_sends(self, now):
+        """ Forgets sends that are older than the rate window.
+
+        :param now: the current time in seconds
+
+        """
+
+        while self.recent_sends and \
+                self.recent_sends[0] <= now - self.rate_window:
+
+            self.recent_sends.popleft()
@@ -0,0 +1,532 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the snapshot module.  A background job regularly asks ZNC for every
+user, their key settings (nick, altnick, ident and realname) and their
+networks, and keeps the answers in a compact in-memory index.  Admin
+lookups are answered from the index, without sending ZNC a single line.
+
+The settings come from the `ListUsers` table where ZNC includes them, so a
+snapshot costs one command, plus one `ListNetworks` per user.  Those are
+sent at bulk priority and at `command_rate` commands per second, well below
+the rate registrations use.
+
+When users are spread over several ZNC backends, each backend is listed in
+turn, and each user's backend is kept with them.  A backend that can't be
+reached keeps its users from the previous snapshot.
+
+Each snapshot is written to disk (atomically, off the reactor thread), and
+the last one is loaded at startup so lookups work before ZNC is reachable.
+
+"""
+
+from twisted.internet import defer, task, threads
+
+from bisect import bisect_left, insort
+import json
+import os
+import time
+
+from controlpanel import ControlPanelError
+from scheduler import BULK, TokenBucket
+
+# The order of the fields each user is stored with
+FIELDS = ('nick', 'altnick', 'ident', 'realname', 'networks', 'backend')
+
+
+class Snapshot():
+    """ An index of every user on ZNC.  Users are kept in a dict for exact
+    lookups, alongside a sorted list of lower case usernames for prefix
+    searches, and a dict of nicks.
+
+    """
+
+    def __init__(self, users=None, taken_at=None):
+        """ Builds the index.
+
+        :param users: a dict of {username: tuple of FIELDS}
+        :param taken_at: when the snapshot was taken, or None if it never
+                         was
+
+        """
+
+        self.users = {}
+        self.taken_at = taken_at
+
+        # (lower case username, username), sorted
+        self.sorted_names = []
+
+        # {lower case nick: username}
+        self.nicks = {}
+
+        for username, fields in (users or {}).iteritems():
+
+            self.add(username, fields)
+
+    def add(self, username, fields):
+        """ Adds a user to the index, or replaces them.
+
+        :param username: the username
+        :param fields: a tuple of FIELDS
+
+        """
+
+        if username in self.users:
+
+            self.remove(username)
+
+        fields = tuple(fields)
+
+        self.users[username] = fields
+
+        insort(self.sorted_names, (username.lower(), username))
+
+        if fields[0]:
+
+            self.nicks[fields[0].lower()] = username
+
+    def remove(self, username):
+        """ Takes a user out of the index.
+
+        :param username: the username
+
+        """
+
+        fields = self.users.pop(username, None)
+
+        if fields is None:
+
+            return
+
+        key = (username.lower(), username)
+        position = bisect_left(self.sorted_names, key)
+
+        if position < len(self.sorted_names) and \
+                self.sorted_names[position] == key:
+
+            del self.sorted_names[position]
+
+        if fields[0] and self.nicks.get(fields[0].lower()) == username:
+
+            del self.nicks[fields[0].lower()]
+
+    def lookup(self, username):
+        """ Finds a user.
+
+        :param username: the username
+
+        :return: a dict of the user's fields, or None
+
+        """
+
+        fields = self.users.get(username)
+
+        if fields is None:
+
+            return None
+
+        user = dict(zip(FIELDS, fields))
+        user['username'] = username
+
+        return user
+
+    def find_nick(self, nick):
+        """ Finds the user with a nick.
+
+        :param nick: the nick (any case)
+
+        :return: the username, or None
+
+        """
+
+        return self.nicks.get(nick.lower())
+
+    def search(self, prefix, limit=50):
+        """ Finds the usernames that start with a prefix, in order.
+
+        :param prefix: the prefix (any case)
+        :param limit: the most usernames to return
+
+        :return: a list of usernames
+
+        """
+
+        prefix = prefix.lower()
+        position = bisect_left(self.sorted_names, (prefix,))
+
+        found = []
+
+        for lowered, username in self.sorted_names[position:]:
+
+            if not lowered.startswith(prefix) or len(found) >= limit:
+
+                break
+
+            found.append(username)
+
+        return found
+
+    def to_json(self):
+        """ Encodes the snapshot for saving.
+
+        :return: a JSON string
+
+        """
+
+        return json.dumps({'taken_at': self.taken_at, 'fields': FIELDS,
+                           'users': self.users}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data):
+        """ Decodes a saved snapshot.
+
+        :param data: a JSON string from `to_json`
+
+        :return: a Snapshot
+
+        """
+
+        decoded = json.loads(data)
+
+        return cls(decoded['users'], decoded['taken_at'])
+
+    def save(self, path):
+        """ Writes the snapshot to disk.  It is written to a temporary file
+        first and then renamed, so a crash never leaves a half-written
+        snapshot behind.  This blocks, so call it from a thread.
+
+        :param path: the path of the snapshot file
+
+        """
+
+        temporary_path = path + '.tmp'
+
+        with open(temporary_path, 'w') as snapshot_file:
+
+            snapshot_file.write(self.to_json())
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+        os.rename(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a snapshot from disk.
+
+        :param path: the path of the snapshot file
+
+        :return: a Snapshot, which is empty if the file is missing or
+                 unreadable
+
+        """
+
+        try:
+
+            with open(path) as snapshot_file:
+
+                return cls.from_json(snapshot_file.read())
+
+        except (IOError, ValueError, KeyError):
+
+            return cls()
+
+
+class SnapshotCollector():
+    """ Collects snapshots from ZNC through the `*controlpanel` client, one
+    at a time.
+
+    """
+
+    def __init__(self, control_panel, path, variables, command_rate=1.0,
+                 username_index=None, backends=(None,), cluster=None,
+                 reactor=None):
+        """ Creates the collector.  The last saved snapshot is loaded.
+
+        :param control_panel: the ZNCControlPanel to send commands with
+        :param path: the path the snapshot is saved to
+        :param variables: the user variables to collect (they must be in
+                          FIELDS)
+        :param command_rate: the most commands per second a snapshot sends
+        :param username_index: an optional index that is refreshed from
+                               each `ListUsers` table (see UsernameIndex)
+        :param backends: the names of the ZNC backends to list, the first
+                         of which is the primary
+        :param cluster: an optional BackendCluster, whose placements are
+                        brought up to date from each snapshot
+        :param reactor: the reactor used to pace commands (default = the
+                        global reactor)
+
+        """
+
+        if reactor is None:
+
+            from twisted.internet import reactor
+
+        self.control_panel = control_panel
+        self.path = path
+        self.variables = variables
+        self.username_index = username_index
+        self.backends = backends
+        self.cluster = cluster
+        self.reactor = reactor
+        self.bucket = TokenBucket(command_rate, 1, clock=reactor.seconds)
+
+        self.current = Snapshot.load(path)
+        self.running = False
+        self.last_duration = None
+        self.commands_sent = 0
+
+    def collect(self, session=None):
+        """ Starts a snapshot, unless one is already running.
+
+        :param session: the admin session to ask for its backend's user list
+                        on (default = least busy)
+
+        :return: a Deferred that fires with the new Snapshot (or None if
+                 one was already running, or it failed)
+
+        """
+
+        if self.running:
+
+            return defer.succeed(None)
+
+        self.running = True
+
+        collected = self.run(session)
+        collected.addErrback(self.failed)
+        collected.addBoth(self.finished)
+
+        return collected
+
+    @defer.inlineCallbacks
+    def run(self, session):
+        """ Collects a snapshot: the `ListUsers` table of every backend
+        first, then each user's networks, and any variables the table did
+        not include.
+
+        :param session: the admin session to ask for its backend's user list
+                        on
+
+        :return: a Deferred that fires with the new Snapshot
+
+        """
+
+        started = time.time()
+
+        if self.username_index is not None:
+
+            self.username_index.begin_refresh()
+
+        # {backend: rows of its `ListUsers` table}
+        tables = {}
+        error = None
+
+        for backend in self.backends:
+
+            on_session = session if session is not None and \
+                session.backend == backend else None
+
+            try:
+
+                tables[backend] = yield self.send('listusers', on_session,
+                                                  backend)
+
+            except ControlPanelError as listing_error:
+
+                error = listing_error
+
+        if not tables:
+
+            raise error
+
+        # Users on a backend that couldn't be listed are kept as they were
+        users = dict(
+            (username, fields)
+            for username, fields in self.current.users.iteritems()
+            if self.backend_of(fields) not in tables)
+
+        listed = dict((backend, [row['username'] for row in rows
+                                 if row.get('username')])
+                      for backend, rows in tables.iteritems())
+
+        if self.username_index is not None:
+
+            self.username_index.finish_refresh(
+                [username for usernames in listed.values()
+                 for username in usernames] + users.keys())
+
+        if self.cluster is not None:
+
+            self.cluster.learn(listed)
+
+        for backend, rows in tables.iteritems():
+
+            for row in rows:
+
+                username = row.get('username')
+
+                if not username:
+
+                    continue
+
+                values = {'backend': backend}
+
+                for variable in self.variables:
+
+                    if variable in row:
+
+                        values[variable] = row[variable]
+
+                    else:
+
+                        values[variable] = yield self.get_variable(
+                            variable, username, backend)
+
+                values['networks'] = yield self.get_networks(username,
+                                                             backend)
+
+                users[username] = tuple(values.get(field, '')
+                                        for field in FIELDS)
+
+        snapshot = Snapshot(users, started)
+
+        yield threads.deferToThread(snapshot.save, self.path)
+
+        self.current = snapshot
+        self.last_duration = time.time() - started
+
+        defer.returnValue(snapshot)
+
+    def add_registered(self, username, backend):
+        """ Adds a newly registered user to the current snapshot, with the
+        settings it is about to be given (each variable set to the
+        username), so admin lookups find it before the next snapshot.  Its
+        networks are not known yet.
+
+        :param username: the username
+        :param backend: the backend the user was created on
+
+        """
+
+        values = dict((variable, username) for variable in self.variables)
+        values['backend'] = backend
+
+        self.current.add(username, [values.get(field) for field in FIELDS])
+
+    def backend_of(self, fields):
+        """ Finds the backend a user from a snapshot is on.  Snapshots saved
+        before there were several backends don't say, so those users are on
+        the primary.
+
+        :param fields: the user's tuple of FIELDS
+
+        :return: the backend name
+
+        """
+
+        backend = dict(zip(FIELDS, fields)).get('backend')
+
+        return self.backends[0] if backend is None else backend
+
+    def send(self, command, session=None, backend=None):
+        """ Sends a command once the rate allows it.
+
+        :param command: the command, without the prefix
+        :param session: the admin session to send on (default = least busy)
+        :param backend: the ZNC backend to send to, when no session is given
+
+        :return: a Deferred that fires with the reply
+
+        """
+
+        wait = self.bucket.delay()
+
+        if wait > 0:
+
+            return task.deferLater(self.reactor, wait, self.send, command,
+                                   session, backend)
+
+        self.bucket.consume()
+        self.commands_sent += 1
+
+        return self.control_panel.call(command, BULK, session,
+                                       backend=backend)
+
+    @defer.inlineCallbacks
+    def get_variable(self, variable, username, backend=None):
+        """ Asks ZNC for one of a user's variables.
+
+        :param variable: the variable
+        :param username: the user
+        :param backend: the backend the user is on
+
+        :return: a Deferred that fires with the value, or '' if it could not
+                 be found
+
+        """
+
+        try:
+
+            reply = yield self.send('get {} {}'.format(variable, username),
+                                    backend=backend)
+
+        except ControlPanelError:
+
+            defer.returnValue('')
+
+        name, separator, value = reply.partition(' = ')
+
+        defer.returnValue(value if separator else '')
+
+    @defer.inlineCallbacks
+    def get_networks(self, username, backend=None):
+        """ Asks ZNC for the names of a user's networks.
+
+        :param username: the user
+        :param backend: the backend the user is on
+
+        :return: a Deferred that fires with a list of network names, or
+                 None if they could not be found
+
+        """
+
+        try:
+
+            rows = yield self.send('listnetworks ' + username,
+                                   backend=backend)
+
+        except ControlPanelError:
+
+            defer.returnValue(None)
+
+        defer.returnValue([row['network'] for row in rows
+                           if row.get('network')])
+
+    def failed(self, reason):
+        """ Gives up on a snapshot that could not list the users, or could
+        not be saved.
+
+        :param reason: the Failure
+
+        """
+
+        reason.trap(ControlPanelError, EnvironmentError)
+
+        if self.username_index is not None:
+
+            self.username_index.cancel_refresh()
+
+        return None
+
+    def finished(self, result):
+        """ Marks the collector as free for the next snapshot.
+
+        :param result: the Snapshot, or None
+
+        """
+
+        self.running = False
+
+        return result
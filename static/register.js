@@ -8,6 +8,10 @@
 * with the registration server to pass the appropriate user information for
 * registration.
 *
+* Messages follow the wire format defined in `wire.py`: each frame is a JSON
+* object with a protocol version and a list of operations, and each reply is
+* a JSON object describing the outcome of one operation.
+*
 * */
 
 $(function() {
@@ -17,33 +21,117 @@ $(function() {
     var SOCKJS_ADDRESS;
     var USERNAME_CHARACTERS;
     var PASSWORD_CHARACTERS;
+    var PASSWORD_MAX_LENGTH;
 
-    $.ajax({
-        type: "GET",
-        url: "/register/config/",
-        success: function (data) {
-            SOCKJS_ADDRESS = 'http://' + data.REGISTER_IP + ':' +
-                data.REGISTER_PORT;
-
-            USERNAME_CHARACTERS = data.USERNAME_CHARACTERS;
-            PASSWORD_CHARACTERS = data.PASSWORD_CHARACTERS;
-        },
-        error: function(jqXHR, textStatus, errorThrown) {
-            console.log("failed!!!");
-            console.log(jqXHR.status);
-        }
-    });
+    function applyConfig(data) {
+
+        // An explicit SockJS URL wins, such as the shared /sockjs path
+        // when the pages and SockJS are served from one port
+        SOCKJS_ADDRESS = data.SOCKJS_URL || ('http://' +
+            data.REGISTER_IP + ':' + data.REGISTER_PORT);
+
+        USERNAME_CHARACTERS = data.USERNAME_CHARACTERS;
+        PASSWORD_CHARACTERS = data.PASSWORD_CHARACTERS;
+        PASSWORD_MAX_LENGTH = data.PASSWORD_MAX_LENGTH;
+    }
 
-    function createDict(username, password) {
+    // The config is usually written into the page, which saves a request
+    if (window.REGISTER_CONFIG) {
 
-        var user_dict = '';
+        applyConfig(window.REGISTER_CONFIG);
+    }
 
-        user_dict = "{ \"username\" : \"" + username + "\" , "
-                    + " \"password\" : \"" + password + "\" }";
+    else {
 
-        return user_dict
+        $.ajax({
+            type: "GET",
+            url: "/register/config/",
+            success: applyConfig,
+            error: function(jqXHR, textStatus, errorThrown) {
+                console.log("failed!!!");
+                console.log(jqXHR.status);
+            }
+        });
     }
 
+    var PROTOCOL_VERSION = 1;
+
+    function createFrame(username, password) {
+
+        var frame = {
+            v: PROTOCOL_VERSION,
+            ops: [
+                {op: "register", username: username, password: password}
+            ]
+        };
+
+        return JSON.stringify(frame);
+    }
+
+    // Live username availability check - a single SockJS connection is kept
+    // open for checks while the user types, and only the latest name is sent
+    var checkSock = null;
+    var checkTimer = null;
+    var latestCheck = null;
+
+    function createCheckFrame(username) {
+
+        var frame = {
+            v: PROTOCOL_VERSION,
+            ops: [
+                {op: "check", username: username}
+            ]
+        };
+
+        return JSON.stringify(frame);
+    }
+
+    function checkAvailability(username) {
+
+        latestCheck = createCheckFrame(username);
+
+        if (checkSock === null) {
+
+            checkSock = new SockJS(SOCKJS_ADDRESS);
+
+            checkSock.onopen = function () {
+                checkSock.send(latestCheck);
+            };
+
+            checkSock.onmessage = function (e) {
+                var reply = JSON.parse(e.data);
+
+                // Ignore answers for a name the user has since changed
+                if (reply.op === "check" &&
+                        reply.username === $( "#username" ).val()) {
+                    $( "#availability" ).text(reply.message);
+                }
+            };
+
+            checkSock.onclose = function () {
+                checkSock = null;
+            };
+        }
+
+        else if (checkSock.readyState === SockJS.OPEN) {
+            checkSock.send(latestCheck);
+        }
+    }
+
+    $( "#username" ).on("input", function () {
+
+        var username = $( this ).val();
+
+        clearTimeout(checkTimer);
+        $( "#availability" ).text("");
+
+        if (username.length >= 6 && SOCKJS_ADDRESS) {
+            checkTimer = setTimeout(function () {
+                checkAvailability(username);
+            }, 400);
+        }
+    });
+
     $( "form" ).submit(function(event) {
 
         event.preventDefault();
@@ -74,7 +162,8 @@ $(function() {
             errors.push("Error: Username length is not within limits");
         }
 
-        if (password.length < 6) {
+        if ((password.length < 6) ||
+                (password.length > PASSWORD_MAX_LENGTH)) {
 
             check = false;
             errors.push("Error: Password length is not within limits");
@@ -108,7 +197,7 @@ $(function() {
 
         if (check) {
 
-            var info = createDict(username, password);
+            var info = createFrame(username, password);
 
             var Sock = new SockJS(SOCKJS_ADDRESS);
 
@@ -120,25 +209,31 @@ $(function() {
 
             Sock.onmessage = function (e) {
                 // On incoming messages
-                if (!(e.data.charAt(0) === '{')) {
-
-                    // Message recieved, sock needs to be closed
-                    // ASAP to leave the line open
-                    Sock.close();
-                    console.log(e.data);
-
-                    // On success
-                    if (e.data.charAt(0) === 'S') {
-                        alert(e.data);
-                        $("#status").text("");
-
-                        //redirect to homepage
-                        window.location.href = "/";
-                    }
-                    // On fail
-                    else {
-                        $("#status").text(e.data);
-                    }
+                var reply = JSON.parse(e.data);
+
+                // Message recieved, sock needs to be closed
+                // ASAP to leave the line open
+                Sock.close();
+                console.log(reply.message);
+
+                // Queued while ZNC is unreachable; the account is created
+                // later, so there is no page to go to yet
+                if (reply.queued) {
+                    $("#status").text(reply.message);
+                }
+                // On success
+                else if (reply.ok) {
+                    alert(reply.message);
+                    $("#status").text("");
+
+                    //redirect to homepage, whose links lead to the user's
+                    //own ZNC server
+                    window.location.href = "/?user=" +
+                        encodeURIComponent(reply.username);
+                }
+                // On fail
+                else {
+                    $("#status").text(reply.message);
                 }
             };
 
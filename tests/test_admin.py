@@ -0,0 +1,186 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the admin API.
+
+"""
+
+from StringIO import StringIO
+import json
+import string
+import time
+import unittest
+
+from twisted.internet import defer
+from twisted.web.test.requesthelper import DummyRequest
+
+from admin import AccountsResource, BulkResource, DETAILS_TTL, JOB_TTL
+from lifecycle import DELETE, RESET_PASSWORD
+from validation import UserValidator
+
+
+class Settings():
+    """ The settings UserValidator reads.
+
+    """
+
+    username_chars = string.ascii_letters + string.digits + '_'
+    password_chars = string.ascii_letters + string.digits
+    reserved_usernames = []
+    znc_username = 'zncadmin'
+    user_to_clone = 'template'
+
+
+class AccountsResourceTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.sent = []
+
+        def run(action, username):
+
+            self.sent.append((action, username))
+
+            return defer.succeed((True, 'done'))
+
+        self.resource = AccountsResource(
+            run, None, validate=UserValidator(Settings()).validate_existing)
+
+    def post(self, action, body='', **args):
+
+        request = DummyRequest([action])
+        request.args = dict((name, [value]) for name, value in args.items())
+        request.content = StringIO(body)
+
+        return request, json.loads(self.resource.render_POST(request))
+
+    def test_valid_usernames_start_a_job(self):
+
+        request, response = self.post(DELETE, 'someone\nsomeother\n')
+
+        self.assertEqual(request.responseCode, 202)
+        self.assertEqual(response['total'], 2)
+        self.assertEqual(self.sent, [(DELETE, 'someone'),
+                                     (DELETE, 'someother')])
+
+    def test_accounts_outside_the_signup_rules_are_allowed(self):
+
+        request, response = self.post(DELETE,
+                                      'bo\nj.doe-from-the-old-server\n')
+
+        self.assertEqual(request.responseCode, 202)
+        self.assertEqual(self.sent, [(DELETE, 'bo'),
+                                     (DELETE, 'j.doe-from-the-old-server')])
+
+    def test_line_breaks_in_a_username_are_refused(self):
+
+        request, response = self.post(DELETE,
+                                      user='someone\r\nPRIVMSG *status :x')
+
+        self.assertEqual(request.responseCode, 400)
+        self.assertEqual(list(response['invalid']),
+                         ['someone\r\nPRIVMSG *status :x'])
+        self.assertEqual(self.sent, [])
+
+    def test_one_bad_username_refuses_the_whole_request(self):
+
+        request, response = self.post(DELETE, 'someone\nsome one\nzncadmin\n')
+
+        self.assertEqual(request.responseCode, 400)
+        self.assertEqual(sorted(response['invalid']),
+                         ['some one', 'zncadmin'])
+        self.assertEqual(self.sent, [])
+
+
+class JobRetentionTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.resource = AccountsResource(
+            lambda action, username: defer.succeed(
+                (True, {'password': 'new-' + username})), None)
+
+    def start(self, action, *usernames):
+
+        request = DummyRequest([action])
+        request.args = {'user': list(usernames)}
+
+        return json.loads(self.resource.render_POST(request))['job']
+
+    def get(self, *path):
+
+        request = DummyRequest(list(path) or [''])
+
+        return json.loads(self.resource.render_GET(request))
+
+    def test_new_passwords_are_reported_once(self):
+
+        job_id = self.start(RESET_PASSWORD, 'someone')
+
+        self.assertEqual(self.get(job_id)['details'],
+                         {'someone': {'password': 'new-someone'}})
+        self.assertEqual(self.get(job_id)['details'], {})
+
+    def test_unread_passwords_are_forgotten(self):
+
+        job_id = self.start(RESET_PASSWORD, 'someone')
+
+        self.resource.jobs[job_id].finished = time.time() - DETAILS_TTL - 1
+
+        report = self.get(job_id)
+
+        self.assertEqual(report['details'], {})
+        self.assertEqual(report['succeeded'], 1)
+
+    def test_finished_jobs_expire(self):
+
+        job_id = self.start(DELETE, 'someone')
+
+        self.resource.jobs[job_id].finished = time.time() - JOB_TTL - 1
+
+        self.assertEqual(self.get(), [])
+        self.assertEqual(self.get(job_id), {'error': 'no such job'})
+
+    def test_oldest_finished_jobs_are_dropped_first(self):
+
+        self.resource.max_jobs = 2
+
+        for _ in range(3):
+
+            self.start(DELETE, 'someone')
+
+        self.assertEqual(self.get(), ['2', '3'])
+
+    def test_running_jobs_are_kept(self):
+
+        self.resource = AccountsResource(
+            lambda action, username: defer.Deferred(), None)
+        self.resource.max_jobs = 2
+
+        for _ in range(3):
+
+            self.start(DELETE, 'someone')
+
+        self.assertEqual(self.get(), ['1', '2', '3'])
+
+    def test_bulk_jobs_are_capped(self):
+
+        resource = BulkResource(lambda username, password, done: None)
+        resource.max_jobs = 2
+
+        for _ in range(3):
+
+            request = DummyRequest([''])
+            request.args = {}
+            request.content = StringIO('someone,password\n')
+
+            resource.render_POST(request)
+
+        self.assertEqual(json.loads(resource.render_GET(DummyRequest(['']))),
+                         ['2', '3'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
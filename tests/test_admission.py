@@ -0,0 +1,76 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for admission control.
+
+"""
+
+import unittest
+
+from admission import AdmissionController, BUSY, OFFENDER, RATE_LIMITED
+
+
+class Clock():
+
+    def __init__(self):
+
+        self.now = 1000.0
+
+    def __call__(self):
+
+        return self.now
+
+
+class AdmissionTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = Clock()
+        self.admission = AdmissionController(1.0, 1, 10, 2.0, strike_limit=3,
+                                             penalty=300, strike_window=60,
+                                             clock=self.clock)
+
+    def test_rate_limit_and_busy_queue(self):
+
+        self.assertEqual(self.admission.admit('ip', 0), (None, 0))
+        self.assertEqual(self.admission.admit('ip', 0)[0], RATE_LIMITED)
+
+        self.clock.now += 1
+
+        # The token is handed back, so a busy queue costs nothing
+        self.assertEqual(self.admission.admit('ip', 13), (BUSY, 2))
+        self.assertEqual(self.admission.admit('ip', 0), (None, 0))
+
+    def test_repeated_refusals_make_an_offender(self):
+
+        self.admission.admit('ip', 0)
+
+        for _ in range(2):
+
+            self.assertEqual(self.admission.admit('ip', 0)[0], RATE_LIMITED)
+
+        self.assertEqual(self.admission.admit('ip', 0), (RATE_LIMITED, 300))
+        self.assertEqual(self.admission.admit('ip', 0), (OFFENDER, 300))
+        self.assertEqual(self.admission.blocked_count(), 1)
+
+        self.clock.now += 300
+
+        self.assertEqual(self.admission.admit('ip', 0), (None, 0))
+
+    def test_occasional_refusals_are_forgotten(self):
+
+        # A refusal every few minutes, far more than strike_limit in all
+        for _ in range(10):
+
+            self.assertEqual(self.admission.admit('ip', 0), (None, 0))
+            self.assertEqual(self.admission.admit('ip', 0)[0], RATE_LIMITED)
+
+            self.clock.now += 120
+
+        self.assertEqual(self.admission.blocked_count(), 0)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
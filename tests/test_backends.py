@@ -0,0 +1,160 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for placing users on ZNC backends.
+
+"""
+
+from collections import Counter
+import unittest
+
+from backends import Backend, BackendCluster, HashRing, LEAST_LOADED, \
+    parse_backend, parse_backends
+
+USERNAMES = ['user{:04d}'.format(number) for number in range(2000)]
+
+
+def backends(*weights):
+
+    return [Backend('znc{}'.format(number), '10.0.0.{}'.format(number), 6697,
+                    weight=weight)
+            for number, weight in enumerate(weights, 1)]
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_options(self):
+
+        backend = parse_backend('znc1', '10.0.0.1:6697 weight=2 '
+                                'capacity=5000 clone=TEMPLATE', 'default')
+
+        self.assertEqual((backend.host, backend.port, backend.weight,
+                          backend.capacity, backend.user_to_clone),
+                         ('10.0.0.1', 6697, 2.0, 5000, 'TEMPLATE'))
+        self.assertEqual(backend.web_url, 'https://10.0.0.1:6697/')
+
+    def test_invalid_backends(self):
+
+        for value in ('', 'nohost', '10.0.0.1:6697 speed=2'):
+
+            self.assertRaises(ValueError, parse_backend, 'znc1', value, None)
+
+    def test_single_default_backend(self):
+
+        only, = parse_backends([], 'localhost', 6697, 'template')
+
+        self.assertEqual((only.host, only.user_to_clone),
+                         ('localhost', 'template'))
+
+
+class HashRingTests(unittest.TestCase):
+
+    def test_every_backend_is_walked_once(self):
+
+        ring = HashRing(backends(1, 1, 1))
+
+        for username in USERNAMES[:50]:
+
+            self.assertEqual(sorted(ring.walk(username)),
+                             ['znc1', 'znc2', 'znc3'])
+
+    def test_users_are_spread_by_weight(self):
+
+        ring = HashRing(backends(1, 3))
+
+        counts = Counter(next(ring.walk(username)) for username in USERNAMES)
+
+        share = counts['znc2'] / float(len(USERNAMES))
+
+        self.assertTrue(0.65 < share < 0.85, share)
+
+    def test_adding_a_backend_only_moves_users_to_it(self):
+
+        before = HashRing(backends(1, 1))
+        after = HashRing(backends(1, 1, 1))
+
+        for username in USERNAMES:
+
+            first = next(after.walk(username))
+
+            if first != 'znc3':
+
+                self.assertEqual(first, next(before.walk(username)))
+
+
+class BackendClusterTests(unittest.TestCase):
+
+    def test_existing_users_stay_where_they_are(self):
+
+        cluster = BackendCluster(backends(1, 1),
+                                 {'someone': 'znc2', 'old': 'gone'})
+
+        self.assertEqual(cluster.locate('someone'), 'znc2')
+        self.assertEqual(cluster.locate('old'), 'znc1')
+        self.assertEqual(cluster.locate('unknown'), 'znc1')
+
+        # ZNC refuses the duplicate, on the backend that holds it
+        self.assertEqual(cluster.place('someone', ['znc1', 'znc2']), 'znc2')
+        self.assertIsNone(cluster.place('someone', ['znc1']))
+
+    def test_full_and_unavailable_backends_are_skipped(self):
+
+        pool = backends(1, 1)
+        pool[0].capacity = 1
+        cluster = BackendCluster(pool, {'someone': 'znc1'})
+
+        for username in USERNAMES[:20]:
+
+            self.assertEqual(cluster.place(username, ['znc1', 'znc2']),
+                             'znc2')
+
+        self.assertIsNone(cluster.place('another', ['znc1']))
+
+    def test_reservations_count_until_cancelled(self):
+
+        pool = backends(1)
+        pool[0].capacity = 1
+        cluster = BackendCluster(pool)
+
+        self.assertEqual(cluster.place('first', ['znc1']), 'znc1')
+        self.assertIsNone(cluster.place('second', ['znc1']))
+
+        cluster.cancel('first')
+
+        self.assertEqual(cluster.place('second', ['znc1']), 'znc1')
+
+        cluster.confirm('second')
+        cluster.cancel('second')
+
+        self.assertEqual(cluster.locate('second'), 'znc1')
+        self.assertEqual(cluster.counts['znc1'], 1)
+
+    def test_least_loaded_fills_the_emptiest_backend(self):
+
+        cluster = BackendCluster(backends(1, 2), strategy=LEAST_LOADED)
+
+        for username in USERNAMES[:30]:
+
+            cluster.place(username, ['znc1', 'znc2'])
+
+        self.assertEqual((cluster.counts['znc1'], cluster.counts['znc2']),
+                         (10, 20))
+
+    def test_snapshots_correct_the_placements(self):
+
+        cluster = BackendCluster(backends(1, 1), {'moved': 'znc1',
+                                                  'deleted': 'znc1'})
+        cluster.place('pending', ['znc1'])
+
+        cluster.learn({'znc1': ['pending'], 'znc2': ['moved']})
+
+        self.assertEqual(cluster.locate('moved'), 'znc2')
+        self.assertNotIn('deleted', cluster.placements)
+        self.assertEqual(cluster.locate('pending'), 'znc1')
+        self.assertEqual(cluster.counts, Counter({'znc1': 1, 'znc2': 1}))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
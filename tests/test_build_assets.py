@@ -0,0 +1,110 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the static asset build.
+
+"""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from build_assets import (build, compressed_copies, fingerprint, rewrite_css,
+                          MANIFEST_NAME)
+
+
+class BuildAssetsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def test_fingerprint_depends_on_contents(self):
+
+        first = fingerprint('css/styles.css', 'a { }')
+
+        self.assertTrue(first.startswith('css/styles.'))
+        self.assertTrue(first.endswith('.css'))
+        self.assertEqual(first, fingerprint('css/styles.css', 'a { }'))
+        self.assertNotEqual(first, fingerprint('css/styles.css', 'b { }'))
+
+    def test_rewrite_css(self):
+
+        manifest = {'img/logo.png': 'img/logo.0123456789.png'}
+        data = ('a { background: url("../img/logo.png"); }\n'
+                'b { background: url(http://example.com/x.png); }\n'
+                'c { background: url(missing.png); }\n')
+
+        rewritten = rewrite_css('css/styles.css', data, manifest)
+
+        self.assertIn('url("../img/logo.0123456789.png")', rewritten)
+        self.assertIn('url(http://example.com/x.png)', rewritten)
+        self.assertIn('url(missing.png)', rewritten)
+
+    def test_compressed_copies(self):
+
+        data = 'repeated text ' * 100
+        copies = compressed_copies(data)
+
+        self.assertIn('.gz', copies)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=StringIO(copies['.gz'])).read(), data)
+
+        # The same input always gives the same output
+        self.assertEqual(compressed_copies(data)['.gz'], copies['.gz'])
+
+    def test_compressed_copies_leaves_out_larger(self):
+
+        self.assertEqual(compressed_copies('x'), {})
+
+    def test_build(self):
+
+        static = os.path.join(self.folder, 'static')
+        out = os.path.join(static, 'assets')
+
+        os.makedirs(os.path.join(static, 'img'))
+        os.makedirs(os.path.join(static, 'css'))
+
+        with open(os.path.join(static, 'img', 'logo.png'), 'wb') as image:
+
+            image.write('not really an image')
+
+        with open(os.path.join(static, 'css', 'styles.css'), 'wb') as css:
+
+            css.write('a { background: url(../img/logo.png); }\n' * 50)
+
+        build(static, out)
+
+        # A second build must not pick up its own output
+        built = build(static, out)
+
+        self.assertEqual(sorted(name for name, _, _, _ in built),
+                         ['css/styles.css', 'img/logo.png'])
+
+        with open(os.path.join(out, MANIFEST_NAME)) as manifest_file:
+
+            manifest = json.load(manifest_file)
+
+        with open(os.path.join(out, manifest['css/styles.css'])) as css:
+
+            self.assertIn(os.path.basename(manifest['img/logo.png']),
+                          css.read())
+
+        self.assertTrue(os.path.exists(
+            os.path.join(out, manifest['css/styles.css'] + '.gz')))
+        self.assertFalse(os.path.exists(
+            os.path.join(out, manifest['img/logo.png'] + '.gz')))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for bulk provisioning.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bulk import BulkJob, Checkpoint, parse_users, percentile
+from registration import PendingRegistration
+
+
+class FakeEngine():
+    """ Stands in for UserAdmin.new_bulk_user.  Users whose names start
+    with 'now' are answered before `submit` returns (as when every backend
+    is full); the rest wait until `answer` is called.
+
+    """
+
+    def __init__(self):
+
+        self.waiting = []
+        self.most_in_flight = 0
+
+    def submit(self, username, password, on_complete):
+
+        record = PendingRegistration(username, password,
+                                     on_complete=on_complete)
+
+        if username.startswith('now'):
+
+            on_complete(record, 'Error: full', False, False)
+
+        else:
+
+            self.waiting.append(record)
+            self.most_in_flight = max(self.most_in_flight,
+                                      len(self.waiting))
+
+        return record
+
+    def answer(self):
+
+        record = self.waiting.pop(0)
+
+        record.on_complete(record, 'User added', True, False)
+
+
+class BulkJobTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.folder, 'checkpoint')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def test_window_accounting_with_synchronous_answers(self):
+
+        users = [('later1', 'p'), ('now1', 'p'), ('later2', 'p'),
+                 ('now2', 'p'), ('later3', 'p'), ('now3', 'p')]
+        engine = FakeEngine()
+        job = BulkJob(users, engine.submit, Checkpoint(self.checkpoint_path),
+                      window=2)
+
+        reports = []
+        job.start().addCallback(reports.append)
+
+        # Answered users free their slot, but never finish the job early
+        self.assertEqual(reports, [])
+        self.assertEqual(job.outstanding, len(engine.waiting))
+        self.assertLessEqual(engine.most_in_flight, 2)
+
+        while engine.waiting:
+
+            engine.answer()
+
+            self.assertGreaterEqual(job.outstanding, 0)
+
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0]['succeeded'], 3)
+        self.assertEqual(reports[0]['failed'], 3)
+        self.assertEqual(Checkpoint(self.checkpoint_path).done,
+                         set(username for username, _ in users))
+
+    def test_refused_submission_frees_its_slot(self):
+
+        job = BulkJob([('a', 'p'), ('b', 'p')], lambda *args: None,
+                      window=1)
+
+        reports = []
+        job.start().addCallback(reports.append)
+
+        self.assertEqual(job.outstanding, 0)
+        self.assertEqual(reports[0]['failed'], 2)
+
+    def test_checkpointed_users_are_skipped(self):
+
+        checkpoint = Checkpoint(self.checkpoint_path)
+        checkpoint.record('a', 'User added')
+        checkpoint.close()
+
+        engine = FakeEngine()
+        job = BulkJob([('a', 'p'), ('b', 'p')], engine.submit,
+                      Checkpoint(self.checkpoint_path))
+        job.start()
+
+        self.assertEqual(job.skipped, 1)
+        self.assertEqual([record.username for record in engine.waiting],
+                         ['b'])
+
+
+class ParseTests(unittest.TestCase):
+
+    def test_csv_and_jsonl(self):
+
+        self.assertEqual(parse_users(['alice,secret', 'bob,hunter2']),
+                         [('alice', 'secret'), ('bob', 'hunter2')])
+        self.assertEqual(parse_users(['{"username": "alice", '
+                                      '"password": "secret"}'], 'jsonl'),
+                         [('alice', 'secret')])
+
+    def test_row_without_a_password(self):
+
+        with self.assertRaises(ValueError) as raised:
+
+            parse_users('alice,pw\nbob\n'.splitlines(True))
+
+        self.assertEqual(str(raised.exception),
+                         'line 2: expected username,password')
+
+    def test_jsonl_line_without_a_password(self):
+
+        with self.assertRaises(ValueError) as raised:
+
+            parse_users(['{"username": "alice", "password": "pw"}',
+                         '{"username": "bob"}'], 'jsonl')
+
+        self.assertTrue(str(raised.exception).startswith('line 2: '))
+
+    def test_percentile(self):
+
+        self.assertEqual(percentile([4, 1, 3, 2], 0.5), 3)
+        self.assertEqual(percentile([4, 1, 3, 2], 0.99), 4)
+        self.assertEqual(percentile([], 0.5), 0)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
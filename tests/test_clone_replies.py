@@ -0,0 +1,281 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for how registrations handle ZNC's replies to `cloneuser`: sorting
+the feedback, the reply deadline, and replies that arrive after it.
+
+"""
+
+import json
+import unittest
+
+from twisted.internet.task import Clock
+
+import main
+from backends import Backend, BackendCluster
+from controlpanel import ZNCControlPanel
+from pool import ConnectionPool
+
+
+class Settings():
+    """ The settings a registration reads.
+
+    """
+
+    max_in_flight = 10
+    reply_timeout = 30
+    user_to_clone = 'template'
+
+
+class FakeScheduler():
+    """ Writes each batch as soon as it is queued.
+
+    """
+
+    def __init__(self):
+
+        self.written = []
+        self.backlog = 0
+        self.send_rate = 0
+
+    def enqueue(self, lines, priority, on_sent=None, on_line_sent=None):
+
+        for line in lines:
+
+            self.written.append(line)
+
+            if on_line_sent is not None:
+
+                on_line_sent()
+
+        if on_sent is not None:
+
+            on_sent()
+
+
+class FakeSession():
+    """ Stands in for an IRCFactory that is signed on.
+
+    """
+
+    def __init__(self, backend):
+
+        self.name = backend + '/0'
+        self.backend = backend
+        self.healthy = True
+        self.in_flight = 0
+        self.scheduler = FakeScheduler()
+
+    @property
+    def load(self):
+
+        return self.in_flight
+
+
+class Recorder():
+    """ Records every call made to any of its methods.
+
+    """
+
+    def __init__(self):
+
+        self.calls = []
+
+    def __getattr__(self, name):
+
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+
+class CloneReplyTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = Clock()
+        self.session = FakeSession('znc1')
+
+        pool = ConnectionPool([self.session], reactor=self.clock)
+
+        fakes = {
+            'reactor': self.clock,
+            'settings': Settings(),
+            'connection_pool': pool,
+            'control_panel': ZNCControlPanel(pool, reactor=self.clock),
+            'cluster': BackendCluster([Backend('znc1', 'localhost', 6697,
+                                               user_to_clone='template')]),
+            'username_index': main.UsernameIndex(),
+            'journal': Recorder(),
+            'snapshots': Recorder(),
+            'relay_factory': Recorder(),
+            'event_log': Recorder(),
+        }
+
+        self.saved = dict((name, getattr(main, name, None))
+                          for name in fakes)
+
+        for name, fake in fakes.items():
+
+            setattr(main, name, fake)
+
+        self.user_admin = main.UserAdmin()
+
+    def tearDown(self):
+
+        for name, value in self.saved.items():
+
+            setattr(main, name, value)
+
+    def register(self, username):
+        """ Starts a registration, as `new_user` does once it is admitted.
+
+        :param username: the username
+
+        :return: the PendingRegistration
+
+        """
+
+        record = self.user_admin.engine.submit(username, 'password')
+        self.user_admin.start_pending_users()
+
+        return record
+
+    def replies_sent(self):
+        """ The messages sent back to clients, decoded.
+
+        """
+
+        return [json.loads(args[0]) for name, args, _ in
+                main.relay_factory.calls if name == 'send']
+
+    def events(self, event):
+        """ The messages logged as an event.
+
+        """
+
+        return [args[2] for name, args, _ in main.event_log.calls
+                if name == 'log' and args[1] == event]
+
+    def test_classify_feedback(self):
+
+        classify = self.user_admin.classify_feedback
+
+        self.assertEqual(classify('User [someone] added!'),
+                         ('added', 'someone'))
+        self.assertEqual(classify('Error: User not added! [User already '
+                                  'exists]'), ('not_added', None))
+        self.assertEqual(classify('Error: Cloning failed: [x]'),
+                         ('not_added', None))
+        self.assertEqual(classify('Nick = someone'), ('ack', None))
+        self.assertEqual(classify('Password has been changed!'),
+                         ('ack', None))
+        self.assertEqual(classify('User [someone] deleted!'), ('ack', None))
+        self.assertEqual(classify('Error: No such user [x]'),
+                         ('error', None))
+        self.assertEqual(classify('Welcome to ZNC'), ('unknown', None))
+
+    def test_reply_before_the_deadline(self):
+
+        record = self.register('someone')
+
+        self.assertEqual(self.session.scheduler.written,
+                         ['PRIVMSG *controlpanel cloneuser template someone'])
+        self.assertTrue(record.sent)
+
+        main.control_panel.feed(self.session, 'User [someone] added!')
+
+        self.assertEqual(len(self.replies_sent()), 1)
+        self.assertTrue(self.replies_sent()[0]['ok'])
+        self.assertTrue(main.username_index.is_taken('someone'))
+
+        # The deadline was cancelled, and the settings were sent
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.session.scheduler.written), 7)
+
+    def test_unexpected_reply_is_left_to_the_deadline(self):
+
+        record = self.register('someone')
+
+        main.control_panel.feed(self.session, 'Welcome to ZNC')
+
+        self.assertEqual(self.replies_sent(), [])
+        self.assertEqual(len(self.events('unexpected_reply')), 1)
+        self.assertIsNotNone(record.deadline)
+
+    def test_deadline(self):
+
+        record = self.register('someone')
+
+        self.clock.advance(Settings.reply_timeout)
+
+        self.assertTrue(record.timed_out)
+        self.assertEqual(self.user_admin.feedback_counts['timeout'], 1)
+        self.assertEqual(self.session.in_flight, 0)
+        self.assertEqual(len(self.replies_sent()), 1)
+        self.assertEqual(self.replies_sent()[0]['message'],
+                         self.user_admin.timeout_message)
+        self.assertTrue(self.replies_sent()[0]['retry'])
+
+        # The username is free to be tried again straight away
+        self.assertNotIn('someone', self.user_admin.engine.pending)
+
+        # The record is kept for a late reply, and then forgotten
+        self.assertEqual(list(self.user_admin.engine.awaiting_reply),
+                         [record])
+
+        self.clock.advance(Settings.reply_timeout * 4)
+
+        self.assertEqual(len(self.user_admin.engine.awaiting_reply), 0)
+
+    def test_late_failure_is_logged_and_dropped(self):
+
+        self.register('someone')
+        self.clock.advance(Settings.reply_timeout)
+
+        main.control_panel.feed(self.session, 'Error: User not added! '
+                                              '[User already exists]')
+
+        self.assertEqual(len(self.replies_sent()), 1)
+        self.assertEqual(self.user_admin.feedback_counts['late'], 1)
+        self.assertEqual(len(self.events('late_feedback')), 1)
+        self.assertEqual(len(self.user_admin.engine.awaiting_reply), 0)
+        self.assertEqual(len(self.session.scheduler.written), 1)
+
+    def test_late_success_finishes_the_account_quietly(self):
+
+        self.register('someone')
+        self.clock.advance(Settings.reply_timeout)
+
+        main.control_panel.feed(self.session, 'User [someone] added!')
+
+        # The client was already told to try again, and hears nothing more
+        self.assertEqual(len(self.replies_sent()), 1)
+        self.assertEqual(len(self.events('late_feedback')), 1)
+
+        # The account is still given its own settings
+        self.assertTrue(main.username_index.is_taken('someone'))
+        self.assertEqual(main.cluster.locate('someone'), 'znc1')
+        self.assertEqual(len(self.session.scheduler.written), 7)
+
+    def test_late_reply_is_not_given_to_the_next_registration(self):
+
+        self.register('someone')
+        self.clock.advance(Settings.reply_timeout)
+
+        retried = self.register('someone')
+
+        main.control_panel.feed(self.session, 'Error: User not added! '
+                                              '[User already exists]')
+
+        # The first reply belonged to the expired registration
+        self.assertFalse(retried.timed_out)
+        self.assertEqual(len(self.replies_sent()), 1)
+
+        main.control_panel.feed(self.session, 'User [someone] added!')
+
+        self.assertEqual(len(self.replies_sent()), 2)
+        self.assertTrue(self.replies_sent()[1]['ok'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the `*controlpanel` client.
+
+"""
+
+import unittest
+
+from twisted.internet.task import Clock
+
+from controlpanel import (ZNCControlPanel, NoReply, NoSession,
+                          ReplyTimeout, SessionLost, BLOCK_USER)
+
+
+class FakeScheduler():
+    """ Writes each batch as soon as it is queued.
+
+    """
+
+    def __init__(self):
+
+        self.written = []
+
+    def enqueue(self, lines, priority, on_sent=None, on_line_sent=None):
+
+        for line in lines:
+
+            self.written.append(line)
+
+            if on_line_sent is not None:
+
+                on_line_sent()
+
+        if on_sent is not None:
+
+            on_sent()
+
+
+class FakeSession():
+
+    def __init__(self):
+
+        self.scheduler = FakeScheduler()
+
+
+class FakePool():
+
+    def __init__(self, session):
+
+        self.session = session
+
+    def pick(self, backend=None):
+
+        return self.session
+
+
+class ControlPanelTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = Clock()
+        self.session = FakeSession()
+        self.panel = ZNCControlPanel(FakePool(self.session),
+                                     reply_timeout=5, reactor=self.clock)
+
+    def collect(self, deferred):
+        """ Records what a Deferred fires with.
+
+        :param deferred: the Deferred
+
+        :return: a list that will hold the result, or the Failure
+
+        """
+
+        results = []
+        deferred.addBoth(results.append)
+
+        return results
+
+    def test_replies_are_matched_in_order(self):
+
+        first = self.collect(self.panel.call('deluser one'))
+        second = self.collect(self.panel.call('set nick two x'))
+
+        self.assertEqual(self.session.scheduler.written,
+                         ['PRIVMSG *controlpanel deluser one',
+                          'PRIVMSG *controlpanel set nick two x'])
+
+        self.panel.feed(self.session, 'User [one] deleted!')
+        self.panel.feed(self.session, 'Nick = x')
+
+        self.assertEqual(first, ['User [one] deleted!'])
+        self.assertEqual(second, ['Nick = x'])
+        self.assertEqual(self.panel.waiting, 0)
+
+    def test_table_reply(self):
+
+        result = self.collect(self.panel.call('ListUsers'))
+
+        for line in ('+------+', '| Username | Networks |', '+------+',
+                     '| one | 1 |', '| two | 0 |', '+------+'):
+
+            self.panel.feed(self.session, line)
+
+        self.assertEqual(result, [[{'username': 'one', 'networks': '1'},
+                                   {'username': 'two', 'networks': '0'}]])
+
+    def test_single_line_table_reply_is_empty(self):
+
+        result = self.collect(self.panel.call('ListNetworks one'))
+
+        self.panel.feed(self.session, 'No networks')
+
+        self.assertEqual(result, [[]])
+
+    def test_timeout_keeps_place_in_fifo(self):
+
+        first = self.collect(self.panel.call('set nick one x'))
+        second = self.collect(self.panel.call('set nick two y'))
+
+        self.clock.advance(5)
+
+        first[0].trap(ReplyTimeout)
+        second[0].trap(ReplyTimeout)
+
+        # The late reply is used up by the first command, not handed on
+        self.panel.feed(self.session, 'Nick = x')
+
+        self.assertEqual(self.panel.counts['late'], 1)
+        self.assertEqual(self.panel.waiting, 1)
+
+    def test_named_reply_skips_unanswered_commands(self):
+
+        first = self.collect(self.panel.call('deluser one'))
+        second = self.collect(self.panel.call('deluser two'))
+
+        self.panel.feed(self.session, 'User [two] deleted!')
+
+        first[0].trap(NoReply)
+        self.assertEqual(second, ['User [two] deleted!'])
+        self.assertEqual(self.panel.counts['skipped'], 1)
+
+    def test_other_module_does_not_match(self):
+
+        result = self.collect(self.panel.call('block one',
+                                              module=BLOCK_USER))
+
+        self.assertFalse(self.panel.feed(self.session, 'stray line'))
+        self.assertTrue(self.panel.feed(self.session, 'Blocked [one]',
+                                        module=BLOCK_USER))
+
+        self.assertEqual(result, ['Blocked [one]'])
+        self.assertEqual(self.panel.counts['unmatched'], 1)
+
+    def test_session_lost(self):
+
+        result = self.collect(self.panel.call('deluser one'))
+
+        self.panel.session_lost(self.session)
+
+        result[0].trap(SessionLost)
+        self.assertEqual(self.panel.waiting, 0)
+
+    def test_no_session(self):
+
+        self.panel.pool.session = None
+
+        result = self.collect(self.panel.call('deluser one'))
+
+        result[0].trap(NoSession)
+
+    def test_batch_fails_with_first_error(self):
+
+        result = self.collect(self.panel.batch(['deluser one',
+                                                'deluser two']))
+
+        self.panel.feed(self.session, 'User [two] deleted!')
+
+        result[0].trap(NoReply)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
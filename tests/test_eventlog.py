@@ -0,0 +1,242 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the event log.
+
+"""
+
+import json
+import threading
+import unittest
+from StringIO import StringIO
+
+from twisted.internet.task import Clock
+from twisted.python import failure, threadable
+
+from eventlog import (EventLog, parse_level, parse_sampling, redact, DEBUG,
+                      INFO, WARNING, REDACTED)
+
+
+class FakeThreadPool():
+    """ Runs each job straight away, on the calling thread.
+
+    """
+
+    def callInThreadWithCallback(self, on_result, function, *args):
+
+        try:
+
+            result = function(*args)
+
+        except Exception:
+
+            on_result(False, failure.Failure())
+
+        else:
+
+            on_result(True, result)
+
+
+class FakeReactor(Clock):
+    """ A Clock that also records calls handed over from other threads,
+    and has a thread pool.
+
+    """
+
+    def __init__(self):
+
+        Clock.__init__(self)
+
+        self.from_thread = []
+        self.pool = FakeThreadPool()
+
+    def callFromThread(self, function, *args, **kwargs):
+
+        self.from_thread.append((function, args, kwargs))
+
+    def run_from_thread(self):
+
+        calls, self.from_thread = self.from_thread, []
+
+        for function, args, kwargs in calls:
+
+            function(*args, **kwargs)
+
+    def getThreadPool(self):
+
+        return self.pool
+
+
+class ParsingTest(unittest.TestCase):
+
+    def test_parse_level(self):
+
+        self.assertEqual(parse_level(' Warning '), WARNING)
+        self.assertRaises(ValueError, parse_level, 'loud')
+
+    def test_parse_sampling(self):
+
+        self.assertEqual(parse_sampling('sockjs_opened:10, irc_line:100,'),
+                         {'sockjs_opened': 10, 'irc_line': 100})
+
+        for text in ('sockjs_opened', 'sockjs_opened:0', ':5', 'x:y'):
+
+            self.assertRaises(ValueError, parse_sampling, text)
+
+    def test_redact(self):
+
+        self.assertEqual(redact('PRIVMSG *controlpanel AddUser bob hunter2'),
+                         'PRIVMSG *controlpanel AddUser bob ' + REDACTED)
+        self.assertEqual(redact('set password bob hunter2'),
+                         'set password bob ' + REDACTED)
+        self.assertEqual(redact('PASS admin:hunter2'), 'PASS ' + REDACTED)
+        self.assertEqual(redact('deluser bob'), 'deluser bob')
+
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.reactor = FakeReactor()
+        self.stream = StringIO()
+        self.event_log = EventLog(self.stream, INFO, flush_interval=0.5,
+                                  max_buffered=3, reactor=self.reactor)
+
+        # Act as if the reactor were running on this thread
+        self.io_thread = threadable.ioThread
+        threadable.registerAsIOThread()
+
+    def tearDown(self):
+
+        threadable.ioThread = self.io_thread
+
+    def lines(self):
+
+        return [json.loads(line)
+                for line in self.stream.getvalue().splitlines()]
+
+    def test_level(self):
+
+        self.event_log.log(DEBUG, 'hidden')
+        self.event_log.log(INFO, 'shown')
+
+        self.assertEqual([entry['event'] for entry in self.event_log.buffer],
+                         ['shown'])
+
+        self.event_log.set_level('debug')
+        self.assertTrue(self.event_log.enabled(DEBUG))
+
+    def test_sampling(self):
+
+        self.event_log.sampling = {'opened': 2}
+
+        for _ in range(3):
+
+            self.event_log.log(INFO, 'opened')
+
+        self.assertEqual(len(self.event_log.buffer), 2)
+        self.assertEqual(self.event_log.buffer[0]['sampled'], 2)
+
+    def test_secret_fields_and_commands_are_masked(self):
+
+        self.event_log.log(INFO, 'sent', 'AddUser bob hunter2',
+                           password='hunter2', line='PASS admin:hunter2')
+
+        entry = self.event_log.buffer[0]
+
+        self.assertEqual(entry['msg'], 'AddUser bob ' + REDACTED)
+        self.assertEqual(entry['password'], REDACTED)
+        self.assertEqual(entry['line'], 'PASS ' + REDACTED)
+
+    def test_full_buffer_drops_events(self):
+
+        for _ in range(5):
+
+            self.event_log.log(INFO, 'event')
+
+        self.assertEqual(len(self.event_log.buffer), 3)
+        self.assertEqual(self.event_log.dropped, 2)
+
+    def test_flush_after_interval(self):
+
+        self.event_log.log(INFO, 'first')
+        self.event_log.log(INFO, 'second')
+
+        self.assertEqual(self.stream.getvalue(), '')
+
+        self.reactor.advance(0.5)
+        self.reactor.run_from_thread()
+
+        self.assertEqual([entry['event'] for entry in self.lines()],
+                         ['first', 'second'])
+        self.assertEqual(self.event_log.written, 2)
+        self.assertEqual(self.event_log.buffer, [])
+        self.assertFalse(self.event_log.writing)
+
+    def test_flush_waits_for_running_write(self):
+
+        self.event_log.log(INFO, 'first')
+        self.reactor.advance(0.5)
+
+        # The first write has not reported back yet
+        self.event_log.log(INFO, 'second')
+        self.reactor.advance(0.5)
+
+        self.assertEqual(len(self.event_log.buffer), 1)
+
+        self.reactor.run_from_thread()
+        self.reactor.advance(0.5)
+        self.reactor.run_from_thread()
+
+        self.assertEqual(self.event_log.written, 2)
+
+    def test_close_writes_straight_away(self):
+
+        self.event_log.log(INFO, 'last')
+        self.event_log.close()
+
+        self.assertEqual([entry['event'] for entry in self.lines()],
+                         ['last'])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_observe_on_reactor_thread(self):
+
+        self.event_log.observe({'message': ('hello',), 'isError': 0,
+                                'system': 'test'})
+
+        entry = self.event_log.buffer[0]
+
+        self.assertEqual((entry['event'], entry['msg'], entry['system']),
+                         ('twisted', 'hello', 'test'))
+        self.assertEqual(self.reactor.from_thread, [])
+
+    def test_observe_from_another_thread(self):
+
+        thread = threading.Thread(target=self.event_log.observe, args=(
+            {'message': ('from a thread',), 'isError': 0},))
+        thread.start()
+        thread.join()
+
+        # Nothing is touched until the reactor thread runs the call
+        self.assertEqual(self.event_log.buffer, [])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+        self.reactor.run_from_thread()
+
+        self.assertEqual(self.event_log.buffer[0]['msg'], 'from a thread')
+        self.assertEqual(len(self.reactor.getDelayedCalls()), 1)
+
+    def test_observe_before_reactor_starts(self):
+
+        threadable.ioThread = None
+
+        self.event_log.observe({'message': ('starting',), 'isError': 0})
+
+        self.assertEqual(self.event_log.buffer[0]['msg'], 'starting')
+        self.assertEqual(self.reactor.from_thread, [])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the registration journal.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from journal import Journal, partial_users, placements, read_entries, \
+    registration_times, CLONE_SENT, CLONED, COMPLETE, DELETED, QUEUED
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'journal.jsonl')
+        self.clock = task.Clock()
+        self.journal = Journal(self.path, flush_interval=1.0,
+                               reactor=self.clock)
+
+    def tearDown(self):
+
+        self.journal.close()
+
+        shutil.rmtree(self.folder)
+
+    def test_entries_are_written_together_each_interval(self):
+
+        self.journal.record('someone', CLONE_SENT, session='default/0')
+        self.journal.record('someone', CLONED, backend='default')
+
+        self.assertEqual(list(read_entries(self.path)), [])
+
+        self.clock.advance(1.0)
+
+        self.assertEqual([entry['step'] for entry
+                          in read_entries(self.path)], [CLONE_SENT, CLONED])
+        self.assertEqual(self.journal.entries_written, 2)
+
+    def test_passwords_are_never_written(self):
+
+        self.journal.record('someone', CLONED, password='secret')
+        self.journal.flush()
+
+        with open(self.path) as journal_file:
+
+            self.assertNotIn('secret', journal_file.read())
+
+    def test_replay(self):
+
+        for username, steps in (('done', [CLONE_SENT, CLONED, COMPLETE]),
+                                ('half', [CLONE_SENT, CLONED]),
+                                ('queued', [QUEUED]),
+                                ('gone', [CLONED, COMPLETE, DELETED])):
+
+            for step in steps:
+
+                self.journal.record(username, step,
+                                    **({'backend': 'znc2'}
+                                       if step == CLONED else {}))
+
+        self.journal.close()
+
+        # A torn last line is skipped, and the next run starts a new one
+        with open(self.path, 'a') as journal_file:
+
+            journal_file.write('{"user": "torn", "st')
+
+        self.journal = Journal(self.path, reactor=self.clock)
+        self.journal.record('after', COMPLETE)
+        self.journal.flush()
+
+        self.assertEqual(sorted(partial_users(self.path)), ['half'])
+        self.assertEqual(sorted(registration_times(self.path)),
+                         ['after', 'done'])
+        self.assertEqual(placements(self.path), {'done': 'znc2',
+                                                 'half': 'znc2'})
+        self.assertEqual([entry['step'] for entry
+                          in read_entries(self.path, 'after')], [COMPLETE])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
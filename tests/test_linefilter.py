@@ -0,0 +1,80 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the inbound IRC line filter.
+
+"""
+
+import unittest
+
+from linefilter import LineFilter, CHANNEL_INFO, CHANNEL_MESSAGE, MEMBERSHIP
+
+
+class LineFilterTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.replies = []
+        self.filter = LineFilter('zncadmin', ['*controlpanel', '*blockuser'],
+                                 lambda module, message:
+                                 self.replies.append((module, message)))
+
+    def assertPassed(self, line):
+
+        self.assertFalse(self.filter.handle(line), line)
+
+    def assertDropped(self, line, reason):
+
+        before = self.filter.dropped[reason]
+
+        self.assertTrue(self.filter.handle(line), line)
+        self.assertEqual(self.filter.dropped[reason], before + 1, line)
+
+    def test_admin_replies_skip_parsing(self):
+
+        self.assertTrue(self.filter.handle(
+            ':*controlpanel!znc@znc.in PRIVMSG zncadmin :User [x] added!'))
+        self.assertTrue(self.filter.handle(
+            ':*blockuser!znc@znc.in PRIVMSG zncadmin :Blocked [x]'))
+
+        self.assertEqual(self.replies,
+                         [('*controlpanel', 'User [x] added!'),
+                          ('*blockuser', 'Blocked [x]')])
+
+    def test_ctcp_and_other_modules_are_parsed(self):
+
+        self.assertPassed(':*controlpanel!znc@znc.in PRIVMSG zncadmin '
+                          ':\x01VERSION\x01')
+        self.assertPassed(':*controlpanel!znc@znc.in PRIVMSG zncadmin :a\x10b')
+        self.assertPassed(':*status!znc@znc.in PRIVMSG zncadmin :Connected')
+        self.assertPassed(':someone!u@host PRIVMSG zncadmin :hello')
+
+        self.assertEqual(self.replies, [])
+
+    def test_chatter_is_dropped_by_reason(self):
+
+        self.assertDropped(':someone!u@host PRIVMSG #cos :hi all',
+                           CHANNEL_MESSAGE)
+        self.assertDropped(':someone!u@host NOTICE &local :hi',
+                           CHANNEL_MESSAGE)
+        self.assertDropped(':someone!u@host JOIN #cos', MEMBERSHIP)
+        self.assertDropped(':someone!u@host QUIT :bye', MEMBERSHIP)
+        self.assertDropped(':someone!u@host MODE #cos +o other', MEMBERSHIP)
+        self.assertDropped(':irc.server 353 zncadmin = #cos :a b c',
+                           CHANNEL_INFO)
+        self.assertDropped(':irc.server 332 zncadmin #cos :Topic',
+                           CHANNEL_INFO)
+
+    def test_own_membership_and_session_lines_are_parsed(self):
+
+        self.assertPassed(':zncadmin!u@host JOIN #cos')
+        self.assertPassed(':zncadmin!u@host NICK zncadmin_')
+        self.assertPassed(':irc.server 001 zncadmin :Welcome')
+        self.assertPassed('PING :irc.server')
+        self.assertPassed(':zncadmin MODE zncadmin +i')
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for loading the settings and their cache.
+
+"""
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from load_settings import CACHE_SUFFIX, LocalSettings, load_local_settings
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'znc_settings.conf.example')
+
+
+class SettingsCacheTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.folder, 'znc_settings.conf')
+        self.cache_file = self.config_file + CACHE_SUFFIX
+
+        shutil.copy(EXAMPLE, self.config_file)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def test_cached_settings_match_parsed_settings(self):
+
+        parsed = load_local_settings(self.config_file)
+        cached = load_local_settings(self.config_file)
+
+        self.assertEqual(vars(cached), vars(parsed))
+        self.assertIsInstance(cached.znc_password, str)
+        self.assertEqual(cached.backends, parsed.backends)
+
+    def test_cache_is_private_json(self):
+
+        load_local_settings(self.config_file)
+
+        with open(self.cache_file) as cache:
+
+            self.assertIn('settings', json.load(cache))
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_file).st_mode),
+                         0600)
+
+    def test_changed_config_file_is_parsed_again(self):
+
+        load_local_settings(self.config_file)
+
+        with open(self.config_file, 'a') as config_file:
+
+            config_file.write('\n[PERFORMANCE OPTIONS]\n'
+                              'offline_drain_rate = 7\n')
+
+        self.assertEqual(
+            load_local_settings(self.config_file).offline_drain_rate, 7)
+
+    def test_unusable_caches_are_ignored(self):
+
+        load_local_settings(self.config_file)
+
+        os.chmod(self.cache_file, 0666)
+
+        # Only a cache that was used could have an unexpected value
+        with open(self.cache_file) as cache:
+
+            cached = json.load(cache)
+
+        cached['settings']['znc_ip'] = 'elsewhere'
+
+        with open(self.cache_file, 'w') as cache:
+
+            json.dump(cached, cache)
+
+        self.assertNotEqual(load_local_settings(self.config_file).znc_ip,
+                            'elsewhere')
+
+        with open(self.cache_file, 'w') as cache:
+
+            cache.write('{"key": [')
+
+        self.assertIsInstance(load_local_settings(self.config_file),
+                              LocalSettings)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the metrics registry and its Prometheus text output.
+
+"""
+
+import unittest
+
+from metrics import Registry, format_labels
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.registry = Registry()
+
+    def test_format_labels(self):
+
+        self.assertEqual(format_labels((), ()), '')
+        self.assertEqual(format_labels(('stage',), ('queue',)),
+                         '{stage="queue"}')
+        self.assertEqual(format_labels(('a',), ('say "hi"',), ('le', '0.5')),
+                         '{a="say hi",le="0.5"}')
+
+    def test_counter(self):
+
+        requests = self.registry.counter('requests_total', 'Requests',
+                                         ('endpoint', 'status'))
+
+        requests.inc('/', 200)
+        requests.inc('/', 200)
+        requests.inc('/check', 400, amount=3)
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP requests_total Requests\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{endpoint="/",status="200"} 2\n'
+                         'requests_total{endpoint="/check",status="400"} 3\n')
+
+    def test_gauge_from_function(self):
+
+        self.registry.gauge('open', 'Open connections', function=lambda: 4)
+        self.registry.gauge('backlog', 'Lines queued', ('session',),
+                            function=lambda: {'znc1/0': 7})
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP open Open connections\n'
+                         '# TYPE open gauge\n'
+                         'open 4\n'
+                         '# HELP backlog Lines queued\n'
+                         '# TYPE backlog gauge\n'
+                         'backlog{session="znc1/0"} 7\n')
+
+    def test_histogram(self):
+
+        latency = self.registry.histogram('latency_seconds', 'Latency',
+                                          ('stage',), buckets=(0.1, 1.0))
+
+        latency.observe(0.05, 'queue')
+        latency.observe(0.1, 'queue')
+        latency.observe(0.5, 'queue')
+        latency.observe(2.0, 'queue')
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{stage="queue",le="0.1"} 2',
+            'latency_seconds_bucket{stage="queue",le="1.0"} 3',
+            'latency_seconds_bucket{stage="queue",le="+Inf"} 4',
+            'latency_seconds_sum{stage="queue"} 2.65',
+            'latency_seconds_count{stage="queue"} 4',
+        ])
+
+    def test_empty_metric_has_only_its_header(self):
+
+        self.registry.counter('unused_total', 'Never used')
+
+        self.assertEqual(self.registry.render(),
+                         '# HELP unused_total Never used\n'
+                         '# TYPE unused_total counter\n')
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the offline registration queue.
+
+"""
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import offline_queue
+from offline_queue import OfflineQueue
+
+
+class OfflineQueueTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'offline_queue.jsonl')
+        self.queue = OfflineQueue(self.path, max_items=3, max_age=60)
+
+    def tearDown(self):
+
+        self.queue.close()
+
+        shutil.rmtree(self.folder)
+
+    def reopen(self):
+
+        self.queue.close()
+        self.queue = OfflineQueue(self.path, max_items=3, max_age=60)
+
+    def lines(self):
+
+        with open(self.path) as queue_file:
+
+            return [json.loads(line) for line in queue_file]
+
+    def test_bounded_and_private(self):
+
+        for username in ('first', 'second', 'third'):
+
+            self.assertTrue(self.queue.add(username, 'secret'))
+
+        self.assertFalse(self.queue.add('fourth', 'secret'))
+        self.assertFalse(self.queue.add('first', 'again'))
+        self.assertTrue(self.queue.full)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+
+    def test_take_and_release(self):
+
+        self.queue.add('first', 'one', now=100)
+        self.queue.add('second', 'two', now=101)
+
+        self.assertEqual(self.queue.take(), ('first', 'one', 100))
+        self.assertEqual(self.queue.take(), ('second', 'two', 101))
+        self.assertIsNone(self.queue.take())
+
+        self.queue.release('first')
+
+        self.assertEqual(self.queue.take(), ('first', 'one', 100))
+
+        self.queue.remove('first', 'created')
+
+        self.assertNotIn('first', self.queue)
+        self.assertEqual(len(self.queue), 1)
+
+    def test_expiry_skips_taken_registrations(self):
+
+        self.queue.add('taken', 'one', now=100)
+        self.queue.add('waiting', 'two', now=100)
+        self.queue.add('fresh', 'three', now=150)
+
+        self.queue.take()
+
+        self.assertEqual(self.queue.expire(now=161), ['waiting'])
+        self.assertEqual(sorted(self.queue.items), ['fresh', 'taken'])
+
+        self.queue.release('taken')
+
+        self.assertEqual(self.queue.expire(now=161), ['taken'])
+
+    def test_survives_a_restart_and_a_torn_line(self):
+
+        self.queue.add('first', 'one', now=100)
+        self.queue.add('second', 'two', now=101)
+        self.queue.take()
+        self.queue.remove('first', 'created')
+        self.queue.close()
+
+        with open(self.path, 'a') as queue_file:
+
+            queue_file.write('{"op": "add", "user": "tor')
+
+        self.queue = OfflineQueue(self.path, max_items=3, max_age=60)
+
+        self.assertEqual(list(self.queue.items), ['second'])
+        self.assertEqual(self.queue.take(), ('second', 'two', 101))
+
+        # Loading compacts the file, so the next entry starts a new line
+        self.queue.add('third', 'three', now=102)
+        self.reopen()
+
+        self.assertEqual(list(self.queue.items), ['second', 'third'])
+
+    def test_compacts_once_most_lines_are_dead(self):
+
+        original = offline_queue.COMPACT_MINIMUM
+        offline_queue.COMPACT_MINIMUM = 4
+        self.addCleanup(setattr, offline_queue, 'COMPACT_MINIMUM', original)
+
+        self.queue.add('kept', 'one')
+        self.queue.add('first', 'two')
+        self.queue.remove('first', 'created')
+
+        # Two dead lines, below the minimum
+        self.assertEqual(len(self.lines()), 3)
+
+        self.queue.add('second', 'three')
+        self.queue.remove('second', 'failed')
+
+        self.assertEqual([line['user'] for line in self.lines()], ['kept'])
+        self.assertEqual(self.queue.dead_lines, 0)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0600)
+
+        # Still appends after the rewrite
+        self.queue.add('third', 'four')
+        self.reopen()
+
+        self.assertEqual(list(self.queue.items), ['kept', 'third'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
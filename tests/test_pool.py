@@ -0,0 +1,132 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the connection pool.
+
+"""
+
+import unittest
+
+from twisted.internet.task import Clock
+
+from pool import ConnectionPool
+
+
+class FakeReactor(Clock):
+    """ A Clock that records the connections it is asked to open.
+
+    """
+
+    def __init__(self):
+
+        Clock.__init__(self)
+
+        self.connected = []
+
+    def connectSSL(self, host, port, factory, context_factory):
+
+        self.connected.append((host, port, factory.name))
+
+
+class FakeSession():
+    """ Stands in for an IRCFactory.
+
+    """
+
+    def __init__(self, name, backend='znc1', healthy=True, load=0,
+                 last_activity=0):
+
+        self.name = name
+        self.backend = backend
+        self.healthy = healthy
+        self.load = load
+        self.last_activity = last_activity
+        self.dropped = []
+
+    def drop(self, reason):
+
+        self.healthy = False
+        self.dropped.append(reason)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.reactor = FakeReactor()
+
+    def test_pick_least_busy_healthy_session(self):
+
+        idle_but_down = FakeSession('down', healthy=False, load=0)
+        busy = FakeSession('busy', load=5)
+        quiet = FakeSession('quiet', load=1)
+
+        pool = ConnectionPool([idle_but_down, busy, quiet],
+                              reactor=self.reactor)
+
+        self.assertIs(pool.pick(), quiet)
+
+        quiet.healthy = False
+
+        self.assertIs(pool.pick(), busy)
+
+        busy.healthy = False
+
+        self.assertIsNone(pool.pick())
+
+    def test_pick_by_backend(self):
+
+        first = FakeSession('first', 'znc1', load=5)
+        second = FakeSession('second', 'znc2', load=1)
+        down = FakeSession('down', 'znc3', healthy=False)
+
+        pool = ConnectionPool([first, second, down], reactor=self.reactor)
+
+        self.assertIs(pool.pick('znc1'), first)
+        self.assertIsNone(pool.pick('znc3'))
+        self.assertEqual(pool.healthy_backends, set(['znc1', 'znc2']))
+
+    def test_connect_one_backend(self):
+
+        pool = ConnectionPool([FakeSession('first', 'znc1'),
+                               FakeSession('second', 'znc2')],
+                              reactor=self.reactor)
+
+        pool.connect('znc.example.com', 6697, None, 'znc2')
+        pool.connect('znc.example.com', 6697, None, 'znc2')
+
+        self.assertEqual(self.reactor.connected,
+                         [('znc.example.com', 6697, 'second')] * 2)
+
+        # The health check is only started once
+        self.assertEqual(len(self.reactor.getDelayedCalls()), 1)
+
+    def test_quiet_sessions_are_dropped(self):
+
+        active = FakeSession('active')
+        quiet = FakeSession('quiet')
+        down = FakeSession('down', healthy=False)
+
+        pool = ConnectionPool([active, quiet, down], health_timeout=60,
+                              check_interval=30, reactor=self.reactor)
+        pool.connect('znc.example.com', 6697, None)
+
+        self.reactor.advance(30)
+        active.last_activity = self.reactor.seconds()
+        self.reactor.advance(30)
+
+        self.assertEqual(quiet.dropped, [])
+
+        active.last_activity = self.reactor.seconds()
+        self.reactor.advance(30)
+
+        self.assertEqual(quiet.dropped, ['no activity for 90 seconds'])
+        self.assertEqual(active.dropped, [])
+        self.assertEqual(down.dropped, [])
+        self.assertEqual(pool.healthy_sessions, [active])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
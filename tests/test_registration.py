@@ -0,0 +1,215 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the registration engine.
+
+"""
+
+import unittest
+
+from twisted.internet.task import Clock
+
+from registration import RegistrationEngine
+from scheduler import INTERACTIVE, BULK
+
+
+class FakeBatch():
+    """ Stands in for a scheduler Batch.
+
+    """
+
+    def __init__(self):
+
+        self.cancelled = False
+
+    def cancel(self):
+
+        self.cancelled = True
+
+
+class RegistrationEngineTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.engine = RegistrationEngine(max_in_flight=2)
+
+    def start(self, session='session'):
+        """ Starts what is ready, as UserAdmin does, and gives each started
+        record to a session.
+
+        :param session: the session the records are given to
+
+        :return: the usernames started
+
+        """
+
+        started = self.engine.start_ready()
+
+        for record in started:
+
+            record.session = session
+            record.clone_batch = FakeBatch()
+
+        return [record.username for record in started]
+
+    def test_one_pending_registration_per_username(self):
+
+        self.assertIsNotNone(self.engine.submit('someone', 'password'))
+        self.assertIsNone(self.engine.submit('someone', 'other'))
+
+    def test_interactive_starts_before_bulk(self):
+
+        self.engine.submit('bulk1', 'password', priority=BULK)
+        self.engine.submit('bulk2', 'password', priority=BULK)
+        self.engine.submit('live1', 'password', priority=INTERACTIVE)
+
+        self.assertEqual(self.start(), ['live1', 'bulk1'])
+        self.assertEqual(self.engine.queue_depth, 1)
+        self.assertEqual(self.engine.in_flight, 2)
+
+        # No free slot until one is answered
+        self.assertEqual(self.start(), [])
+
+    def test_answered_registration_frees_its_slot(self):
+
+        for username in ('one', 'two', 'three'):
+
+            self.engine.submit(username, 'password')
+
+        self.start()
+
+        record = self.engine.pending['one']
+        self.engine.remove(record)
+        self.engine.complete(record)
+
+        self.assertNotIn('one', self.engine.pending)
+        self.assertEqual(self.start(), ['three'])
+
+    def test_expired_registration_keeps_its_place(self):
+
+        self.engine.submit('one', 'password')
+        self.engine.submit('two', 'password')
+        self.engine.submit('three', 'password')
+        self.start()
+
+        expired = self.engine.pending['one']
+        self.engine.expire(expired)
+
+        # It no longer counts as in flight, or blocks its username
+        self.assertEqual(self.engine.in_flight, 1)
+        self.assertNotIn('one', self.engine.pending)
+        self.assertEqual(self.start(), ['three'])
+
+        retried = self.engine.submit('one', 'password')
+
+        # A late reply is still matched to the expired record first
+        self.assertIs(self.engine.awaiting_reply[0], expired)
+
+        self.engine.remove(expired)
+        self.engine.complete(expired)
+
+        self.assertEqual(self.engine.timed_out, 0)
+        self.assertIs(self.engine.pending['one'], retried)
+
+    def test_forget_expired_registration(self):
+
+        self.engine.submit('one', 'password')
+        self.start()
+
+        record = self.engine.pending['one']
+        self.engine.expire(record)
+        self.engine.forget(record)
+
+        self.assertEqual(len(self.engine.awaiting_reply), 0)
+        self.assertEqual(self.engine.timed_out, 0)
+        self.assertEqual(self.engine.in_flight, 0)
+
+        # Removing it again changes nothing
+        self.engine.remove(record)
+
+        self.assertEqual(self.engine.timed_out, 0)
+
+    def test_abandon(self):
+
+        for username in ('sent', 'unsent', 'waiting'):
+
+            self.engine.submit(username, 'password')
+
+        self.start('lost')
+        self.engine.pending['sent'].mark_sent()
+        unsent_batch = self.engine.pending['unsent'].clone_batch
+
+        lost = self.engine.abandon('lost')
+
+        self.assertEqual([record.username for record in lost], ['sent'])
+        self.assertTrue(unsent_batch.cancelled)
+        self.assertEqual(self.engine.in_flight, 0)
+
+        # The unsent registration goes back ahead of those still waiting
+        self.assertEqual(self.start('other'), ['unsent', 'waiting'])
+        self.assertEqual(self.engine.pending['unsent'].session, 'other')
+
+    def test_abandon_skips_expired_registrations(self):
+
+        self.engine.submit('one', 'password')
+        self.start('lost')
+
+        record = self.engine.pending['one']
+        record.mark_sent()
+        self.engine.expire(record)
+
+        self.assertEqual(self.engine.abandon('lost'), [])
+        self.assertEqual(self.engine.timed_out, 0)
+
+    def test_abandon_leaves_other_sessions(self):
+
+        self.engine.submit('one', 'password')
+        self.engine.submit('two', 'password')
+        self.start('first')
+
+        self.engine.pending['two'].session = 'second'
+
+        self.engine.abandon('first')
+
+        self.assertEqual([record.username
+                          for record in self.engine.awaiting_reply], ['two'])
+
+    def test_complete_leaves_a_newer_record(self):
+
+        old = self.engine.submit('one', 'password')
+        self.engine.complete(old)
+
+        new = self.engine.submit('one', 'password')
+        self.engine.complete(old)
+
+        self.assertIs(self.engine.pending['one'], new)
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_cancel_deadline(self):
+
+        clock = Clock()
+        fired = []
+
+        record = RegistrationEngine().submit('one', 'password')
+        record.deadline = clock.callLater(5, fired.append, True)
+
+        record.cancel_deadline()
+        clock.advance(10)
+
+        self.assertEqual(fired, [])
+        self.assertIsNone(record.deadline)
+
+        # Cancelling a deadline that already fired is harmless
+        record.deadline = clock.callLater(5, fired.append, True)
+        clock.advance(5)
+        record.cancel_deadline()
+
+        self.assertEqual(fired, [True])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the outbound command scheduler.
+
+"""
+
+import unittest
+
+from twisted.internet.task import Clock
+
+from scheduler import CommandScheduler, TokenBucket, INTERACTIVE, BULK
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refill(self):
+
+        clock = Clock()
+        bucket = TokenBucket(2, 4, clock=clock.seconds)
+
+        for _ in range(4):
+
+            self.assertTrue(bucket.consume())
+
+        self.assertFalse(bucket.consume())
+        self.assertEqual(bucket.delay(), 0.5)
+
+        clock.advance(0.5)
+
+        self.assertTrue(bucket.consume())
+
+        # It never holds more than the burst size
+        clock.advance(100)
+        bucket.refill()
+
+        self.assertEqual(bucket.tokens, 4)
+
+
+class CommandSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = Clock()
+        self.sent = []
+        self.scheduler = CommandScheduler(self.sent.append, rate=1, burst=2,
+                                          reactor=self.clock)
+
+    def test_burst_then_rate(self):
+
+        self.scheduler.enqueue(['one', 'two', 'three', 'four'])
+
+        self.assertEqual(self.sent, ['one', 'two'])
+        self.assertEqual(self.scheduler.backlog, 2)
+
+        self.clock.advance(1)
+
+        self.assertEqual(self.sent, ['one', 'two', 'three'])
+
+        self.clock.advance(1)
+
+        self.assertEqual(self.sent, ['one', 'two', 'three', 'four'])
+        self.assertEqual(self.scheduler.backlog, 0)
+        self.assertEqual(self.scheduler.lines_sent, 4)
+
+    def test_interactive_ahead_of_bulk(self):
+
+        self.scheduler.enqueue(['first'])
+        self.scheduler.enqueue(['second'])
+        self.scheduler.enqueue(['bulk'], BULK)
+
+        # Queued while the bulk batch waits for a token
+        self.scheduler.enqueue(['live'], INTERACTIVE)
+
+        self.clock.advance(2)
+
+        self.assertEqual(self.sent, ['first', 'second', 'live', 'bulk'])
+
+    def test_batches_are_kept_together(self):
+
+        self.scheduler.enqueue(['x'])
+        self.scheduler.enqueue(['bulk 1', 'bulk 2', 'bulk 3'], BULK)
+
+        # An interactive batch waits for the bulk batch already started
+        self.scheduler.enqueue(['live'], INTERACTIVE)
+
+        self.clock.pump([1] * 4)
+
+        self.assertEqual(self.sent, ['x', 'bulk 1', 'bulk 2', 'bulk 3',
+                                     'live'])
+
+    def test_callbacks(self):
+
+        lines_sent = []
+        batches_sent = []
+
+        self.scheduler.enqueue(['one', 'two', 'three'],
+                               on_sent=lambda: batches_sent.append(True),
+                               on_line_sent=lambda: lines_sent.append(True))
+
+        self.assertEqual((len(lines_sent), batches_sent), (2, []))
+
+        self.clock.advance(1)
+
+        self.assertEqual((len(lines_sent), batches_sent), (3, [True]))
+
+    def test_pause_and_resume(self):
+
+        self.scheduler.pause()
+        self.scheduler.enqueue(['one', 'two', 'three'])
+
+        self.clock.advance(10)
+
+        self.assertEqual(self.sent, [])
+
+        self.scheduler.resume()
+
+        self.assertEqual(self.sent, ['one', 'two'])
+
+        self.scheduler.pause()
+        self.clock.advance(10)
+
+        self.assertEqual(self.sent, ['one', 'two'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+        self.scheduler.resume()
+
+        self.assertEqual(self.sent, ['one', 'two', 'three'])
+
+    def test_cancel(self):
+
+        self.scheduler.enqueue(['a', 'b'])
+        cancelled = self.scheduler.enqueue(['cancelled 1', 'cancelled 2'])
+        self.scheduler.enqueue(['c'])
+
+        cancelled.cancel()
+
+        self.clock.pump([1] * 5)
+
+        self.assertEqual(self.sent, ['a', 'b', 'c'])
+        self.assertEqual(self.scheduler.backlog, 0)
+
+    def test_empty_batch(self):
+
+        self.scheduler.enqueue([])
+
+        self.assertEqual(self.scheduler.backlog, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_send_rate(self):
+
+        self.scheduler = CommandScheduler(self.sent.append, rate=10,
+                                          burst=10, reactor=self.clock,
+                                          rate_window=10)
+
+        self.scheduler.enqueue(['line'] * 5)
+
+        self.assertEqual(self.scheduler.send_rate, 0.5)
+
+        self.clock.advance(10)
+
+        self.assertEqual(self.scheduler.send_rate, 0)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the snapshot index and collector.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from snapshot import Snapshot, SnapshotCollector
+
+VARIABLES = ['nick', 'altnick', 'ident', 'realname']
+
+
+class SnapshotTests(unittest.TestCase):
+
+    def test_lookup_by_username_prefix_and_nick(self):
+
+        snapshot = Snapshot()
+        snapshot.add('Someone', ('Nick', 'Nick_', 'some', 'Some One', [],
+                                 'default'))
+        snapshot.add('someother', ('Other', None, None, None, [], 'default'))
+
+        self.assertEqual(snapshot.lookup('Someone')['ident'], 'some')
+        self.assertEqual(snapshot.search('SOME'), ['Someone', 'someother'])
+        self.assertEqual(snapshot.find_nick('nick'), 'Someone')
+
+        snapshot.remove('Someone')
+
+        self.assertIsNone(snapshot.lookup('Someone'))
+        self.assertIsNone(snapshot.find_nick('nick'))
+        self.assertEqual(snapshot.search('some'), ['someother'])
+
+
+class CollectorTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.collector = SnapshotCollector(
+            None, os.path.join(self.folder, 'snapshot.json'), VARIABLES,
+            backends=('primary', 'second'), reactor=task.Clock())
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def test_registered_user_keeps_its_backend(self):
+
+        self.collector.add_registered('someone', 'second')
+
+        user = self.collector.current.lookup('someone')
+
+        self.assertEqual(user['backend'], 'second')
+        self.assertEqual(user['nick'], 'someone')
+        self.assertEqual(user['realname'], 'someone')
+        self.assertIsNone(user['networks'])
+        self.assertEqual(self.collector.backend_of(
+            self.collector.current.users['someone']), 'second')
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the index of existing usernames.
+
+"""
+
+import unittest
+
+import main
+
+
+class Recorder():
+    """ Stands in for the event log.
+
+    """
+
+    def __init__(self):
+
+        self.calls = []
+
+    def log(self, *args, **kwargs):
+
+        self.calls.append(args)
+
+
+class UsernameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.event_log = getattr(main, 'event_log', None)
+        main.event_log = Recorder()
+
+        self.index = main.UsernameIndex()
+
+    def tearDown(self):
+
+        main.event_log = self.event_log
+
+    def test_add_and_discard(self):
+
+        self.index.add('someone')
+
+        self.assertTrue(self.index.is_taken('someone'))
+
+        self.index.discard('someone')
+
+        self.assertFalse(self.index.is_taken('someone'))
+        self.assertIsNone(self.index.changes)
+
+    def test_refresh_replaces_the_index(self):
+
+        self.index.add('stale')
+
+        self.index.begin_refresh()
+        self.index.finish_refresh(['one', 'two'])
+
+        self.assertTrue(self.index.warmed)
+        self.assertEqual(self.index.usernames, set(['one', 'two']))
+        self.assertIsNone(self.index.changes)
+
+    def test_add_during_refresh_is_kept(self):
+
+        self.index.begin_refresh()
+
+        # Added after ZNC printed its table, so the table does not have it
+        self.index.add('new')
+
+        self.index.finish_refresh(['one', 'two'])
+
+        self.assertTrue(self.index.is_taken('new'))
+        self.assertTrue(self.index.is_taken('one'))
+
+    def test_discard_during_refresh_is_kept(self):
+
+        self.index.begin_refresh()
+
+        # Deleted after ZNC printed its table, so the table still has it
+        self.index.discard('one')
+
+        self.index.finish_refresh(['one', 'two'])
+
+        self.assertFalse(self.index.is_taken('one'))
+        self.assertTrue(self.index.is_taken('two'))
+
+    def test_last_change_during_refresh_wins(self):
+
+        self.index.begin_refresh()
+        self.index.add('someone')
+        self.index.discard('someone')
+        self.index.add('other')
+        self.index.discard('two')
+        self.index.add('two')
+        self.index.finish_refresh(['two'])
+
+        self.assertEqual(self.index.usernames, set(['other', 'two']))
+
+    def test_cancelled_refresh(self):
+
+        self.index.add('someone')
+
+        self.index.begin_refresh()
+        self.index.add('other')
+        self.index.cancel_refresh()
+
+        self.assertIsNone(self.index.changes)
+        self.assertFalse(self.index.warmed)
+        self.assertEqual(self.index.usernames, set(['someone', 'other']))
+
+
+if __name__ == '__main__':
+
+    unittest.main()
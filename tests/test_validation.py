@@ -0,0 +1,116 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for server-side validation.
+
+"""
+
+import string
+import unittest
+
+from validation import (UserValidator, RESERVED_USERNAMES,
+                        USERNAME_MIN_LENGTH, USERNAME_MAX_LENGTH,
+                        PASSWORD_MIN_LENGTH, PASSWORD_MAX_LENGTH)
+
+
+class Settings():
+    """ The settings UserValidator reads.
+
+    """
+
+    username_chars = string.ascii_lowercase + string.digits + '_'
+    password_chars = string.ascii_letters + string.digits + '!@#'
+    reserved_usernames = ['helpdesk']
+    znc_username = 'zncadmin'
+    user_to_clone = 'template'
+
+
+class UserValidatorTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.validator = UserValidator(Settings())
+
+    def test_valid(self):
+
+        self.assertEqual(self.validator.validate('someone', 'Secret!1'), [])
+
+    def test_username_length(self):
+
+        for length in (USERNAME_MIN_LENGTH, USERNAME_MAX_LENGTH):
+
+            self.assertEqual(self.validator.validate_username('a' * length),
+                             [])
+
+        for length in (USERNAME_MIN_LENGTH - 1, USERNAME_MAX_LENGTH + 1):
+
+            self.assertEqual(self.validator.validate_username('a' * length),
+                             ['Error: Username length is not within limits'])
+
+    def test_username_characters(self):
+
+        for username in ('Someone', 'some one', 'someone\r\n', 'someone\n',
+                         'some-one'):
+
+            self.assertEqual(self.validator.validate_username(username),
+                             ['Error: Invalid character(s) in username'])
+
+        self.assertEqual(self.validator.validate_username('a b'),
+                         ['Error: Username length is not within limits',
+                          'Error: Invalid character(s) in username'])
+
+    def test_reserved_usernames(self):
+
+        for username in RESERVED_USERNAMES + ['helpdesk', 'zncadmin',
+                                              'template']:
+
+            if USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH:
+
+                self.assertEqual(self.validator.validate_username(username),
+                                 ['Error: That username is reserved'])
+
+        self.assertIn('root', self.validator.reserved)
+        self.assertIn('zncadmin', self.validator.reserved)
+
+    def test_password_length(self):
+
+        for length in (PASSWORD_MIN_LENGTH, PASSWORD_MAX_LENGTH):
+
+            self.assertEqual(self.validator.validate_password('a' * length),
+                             [])
+
+        for length in (PASSWORD_MIN_LENGTH - 1, PASSWORD_MAX_LENGTH + 1):
+
+            self.assertEqual(self.validator.validate_password('a' * length),
+                             ['Error: Password length is not within limits'])
+
+    def test_password_characters(self):
+
+        self.assertEqual(self.validator.validate_password('secret password'),
+                         ['Error: Invalid character(s) in password'])
+        self.assertEqual(self.validator.validate_password('secret\n'),
+                         ['Error: Invalid character(s) in password'])
+
+    def test_existing_accounts(self):
+
+        # Accounts made outside the signup rules can still be managed
+        for username in ('bo', 'J.Doe-99', 'a' * 40):
+
+            self.assertEqual(self.validator.validate_existing(username), [])
+
+        for username in ('some one', 'someone\r\nQUIT', 'some\x00one',
+                         'tab\there'):
+
+            self.assertEqual(self.validator.validate_existing(username),
+                             ['Error: Invalid character(s) in username'])
+
+        self.assertEqual(self.validator.validate_existing(''),
+                         ['Error: No username given'])
+        self.assertEqual(self.validator.validate_existing('Admin'),
+                         ['Error: That username is reserved'])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the unified web server's asset serving.
+
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.web.test.requesthelper import DummyRequest
+
+from build_assets import ASSET_MAX_AGE
+from web import AssetFile, accepted_encodings
+
+SCRIPT = 'var registered = true;\n' * 50
+
+
+class AcceptEncodingTests(unittest.TestCase):
+
+    def test_refused_encodings_are_left_out(self):
+
+        self.assertEqual(accepted_encodings('gzip, deflate, br;q=0'),
+                         set(['gzip', 'deflate']))
+        self.assertEqual(accepted_encodings('GZIP;q=0.5'), set(['gzip']))
+        self.assertEqual(accepted_encodings(None), set())
+
+
+class AssetFileTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'register.0123456789.js')
+
+        with open(self.path, 'w') as script:
+
+            script.write(SCRIPT)
+
+        with gzip.open(self.path + '.gz', 'wb') as compressed:
+
+            compressed.write(SCRIPT)
+
+        self.assets = AssetFile(self.folder)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.folder)
+
+    def get(self, name, accept_encoding=None):
+
+        request = DummyRequest([name])
+
+        if accept_encoding is not None:
+
+            request.headers['accept-encoding'] = accept_encoding
+
+        resource = self.assets.getChild(name, request)
+        resource.render(request)
+
+        return request, ''.join(request.written)
+
+    def test_compressed_copy_is_sent_when_accepted(self):
+
+        request, body = self.get('register.0123456789.js', 'gzip, br;q=0')
+
+        headers = request.outgoingHeaders
+
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertIn('javascript', headers['content-type'])
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(headers['cache-control'],
+                         'public, max-age={}, immutable'.format(
+                             ASSET_MAX_AGE))
+        self.assertEqual(len(body), os.path.getsize(self.path + '.gz'))
+
+    def test_plain_copy_is_sent_otherwise(self):
+
+        request, body = self.get('register.0123456789.js')
+
+        self.assertNotIn('content-encoding', request.outgoingHeaders)
+        self.assertEqual(body, SCRIPT)
+
+    def test_folder_is_not_listed(self):
+
+        request, _ = self.get('')
+
+        self.assertEqual(request.responseCode, 404)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
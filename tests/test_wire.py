@@ -0,0 +1,90 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+Tests for the SockJS wire format.
+
+"""
+
+import json
+import unittest
+
+from wire import encode_reply, parse_frame, ProtocolError, MAX_FIELD_LENGTH, \
+    MAX_FRAME_SIZE, MAX_OPERATIONS, PROTOCOL_VERSION
+
+
+def frame(*operations, **fields):
+
+    body = {'v': PROTOCOL_VERSION, 'ops': list(operations)}
+    body.update(fields)
+
+    return json.dumps(body)
+
+
+REGISTER = {'op': 'register', 'username': 'someone', 'password': 'secret'}
+
+
+class ParseFrameTests(unittest.TestCase):
+
+    def test_operations_are_decoded_to_byte_strings(self):
+
+        operations = parse_frame(frame(REGISTER,
+                                       {'op': 'check', 'username': u'caf\xe9'},
+                                       ))
+
+        self.assertEqual(operations[0], dict(REGISTER))
+        self.assertEqual(operations[1], {'op': 'check',
+                                         'username': 'caf\xc3\xa9'})
+        self.assertIsInstance(operations[0]['username'], str)
+
+    def test_frame_limits(self):
+
+        self.assertRaises(ProtocolError, parse_frame,
+                          ' ' * (MAX_FRAME_SIZE + 1))
+        self.assertRaises(ProtocolError, parse_frame,
+                          frame(*[{'op': 'check', 'username': 'x'}] *
+                                (MAX_OPERATIONS + 1)))
+        self.assertRaises(ProtocolError, parse_frame, frame())
+
+        parse_frame(frame(*[{'op': 'check', 'username': 'x'}] *
+                          MAX_OPERATIONS))
+
+    def test_field_limits(self):
+
+        longest = dict(REGISTER, password='x' * MAX_FIELD_LENGTH)
+
+        parse_frame(frame(longest))
+
+        self.assertRaises(ProtocolError, parse_frame,
+                          frame(dict(longest, password=longest['password']
+                                     + 'x')))
+        self.assertRaises(ProtocolError, parse_frame,
+                          frame({'op': 'register', 'username': 'someone'}))
+        self.assertRaises(ProtocolError, parse_frame,
+                          frame(dict(REGISTER, username=['someone'])))
+
+    def test_malformed_frames(self):
+
+        for raw_data in ('not json', '[]', json.dumps({'ops': [REGISTER]}),
+                         frame(REGISTER, v=PROTOCOL_VERSION + 1),
+                         frame({'op': 'deluser', 'username': 'someone'}),
+                         frame('register')):
+
+            self.assertRaises(ProtocolError, parse_frame, raw_data)
+
+
+class EncodeReplyTests(unittest.TestCase):
+
+    def test_reply_fields(self):
+
+        reply = json.loads(encode_reply('register', True, 'queued',
+                                        username='someone', queued=True))
+
+        self.assertEqual(reply, {'v': PROTOCOL_VERSION, 'op': 'register',
+                                 'ok': True, 'message': 'queued',
+                                 'username': 'someone', 'queued': True})
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the server-side validation module.  The registration page checks
+usernames and passwords before sending them, but nothing stops a client
+from skipping the page, so the registration server checks them again here
+before any command is sent to ZNC.
+
+The allowed characters come from the config file, and are compiled into
+regular expressions once, when the validator is built.
+
+"""
+
+import re
+
+# These match the limits enforced by `register.js`, which is sent the
+# password maximum in the client config
+USERNAME_MIN_LENGTH = 6
+USERNAME_MAX_LENGTH = 16
+PASSWORD_MIN_LENGTH = 6
+PASSWORD_MAX_LENGTH = 128
+
+# Names that can never be registered, regardless of the config file
+RESERVED_USERNAMES = [
+    'admin',
+    'administrator',
+    'root',
+    'znc',
+    'status',
+    'controlpanel',
+]
+
+
+class UserValidator():
+    """ Checks a requested username and password against the allowed
+    characters, the length limits, and the reserved name list.
+
+    """
+
+    def __init__(self, settings):
+        """ Builds the validator from the app's settings.
+
+        :param settings: a LocalSettings instance
+
+        """
+
+        self.username_pattern = self.compile_pattern(settings.username_chars,
+                                                     USERNAME_MIN_LENGTH,
+                                                     USERNAME_MAX_LENGTH)
+        self.username_chars = frozenset(settings.username_chars)
+
+        self.password_pattern = self.compile_pattern(settings.password_chars,
+                                                     PASSWORD_MIN_LENGTH,
+                                                     PASSWORD_MAX_LENGTH)
+        self.password_chars = frozenset(settings.password_chars)
+
+        reserved = RESERVED_USERNAMES + settings.reserved_usernames + [
+            settings.znc_username,
+            settings.user_to_clone,
+        ]
+
+        self.reserved = frozenset(name.lower() for name in reserved if name)
+
+    @staticmethod
+    def compile_pattern(characters, min_length, max_length):
+        """ Compiles a regular expression that matches a whole string made
+        only of the given characters, within the given length limits.
+
+        :param characters: a string of every allowed character
+        :param min_length: the shortest allowed length
+        :param max_length: the longest allowed length
+
+        :return: the compiled regular expression
+
+        """
+
+        character_class = ''.join(re.escape(character)
+                                  for character in sorted(set(characters)))
+
+        # `\Z` rather than `$`, which would also match before a trailing
+        # line break
+        return re.compile(r'^[{}]{{{},{}}}\Z'.format(character_class,
+                                                     min_length,
+                                                     max_length))
+
+    def validate(self, username, password):
+        """ Checks a username and password.  The common case (a valid
+        request) only costs two regular expression matches and a set lookup.
+
+        :param username: the requested username
+        :param password: the requested password
+
+        :return errors: a list of error messages, empty if the request is
+                        valid
+
+        """
+
+        return self.validate_username(username) + \
+            self.validate_password(password)
+
+    def validate_username(self, username):
+        """ Checks a username on its own.
+
+        :param username: the requested username
+
+        :return errors: a list of error messages, empty if it is valid
+
+        """
+
+        errors = []
+
+        if not self.username_pattern.match(username):
+
+            if not USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH:
+
+                errors.append('Error: Username length is not within limits')
+
+            if not self.username_chars.issuperset(username):
+
+                errors.append('Error: Invalid character(s) in username')
+
+        elif username.lower() in self.reserved:
+
+            errors.append('Error: That username is reserved')
+
+        return errors
+
+    def validate_existing(self, username):
+        """ Checks the name of an account that already exists, before a
+        command is run on it.  The account may have been made outside the
+        signup rules, so only what would break the command line (an empty
+        name, spaces or control characters) and reserved names are refused.
+
+        :param username: the account's username
+
+        :return errors: a list of error messages, empty if it is valid
+
+        """
+
+        errors = []
+
+        if not username:
+
+            errors.append('Error: No username given')
+
+        elif any(character.isspace() or ord(character) < 32 or
+                 ord(character) == 127 for character in username):
+
+            errors.append('Error: Invalid character(s) in username')
+
+        elif username.lower() in self.reserved:
+
+            errors.append('Error: That username is reserved')
+
+        return errors
+
+    def validate_password(self, password):
+        """ Checks a password on its own.
+
+        :param password: the requested password
+
+        :return errors: a list of error messages, empty if it is valid
+
+        """
+
+        errors = []
+
+        if not self.password_pattern.match(password):
+
+            if not PASSWORD_MIN_LENGTH <= len(password) <= PASSWORD_MAX_LENGTH:
+
+                errors.append('Error: Password length is not within limits')
+
+            if not self.password_chars.issuperset(password):
+
+                errors.append('Error: Invalid character(s) in password')
+
+        return errors
@@ -0,0 +1,186 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the unified web server.  It lets the registration server (`main.py
+--web`) serve the Flask registration pages and the SockJS endpoint from a
+single Twisted site, on a single port:
+
+    /sockjs/...     the SockJS endpoint used by `register.js`
+    /static/...     static files, served by Twisted directly
+    /assets/...     the hashed, precompressed copies of the static files
+                    built by `build_assets.py`, served by Twisted directly
+    anything else   the Flask app in `app.py`, run on the reactor's thread
+                    pool so a slow page never blocks a registration
+
+"""
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.static import File, getTypeAndEncoding
+from twisted.web.wsgi import WSGIResource
+
+from txsockjs.factory import SockJSResource
+
+import os
+
+from build_assets import ASSET_MAX_AGE, ASSET_ENCODINGS
+
+# The path that the SockJS endpoint is mounted on
+SOCKJS_PATH = 'sockjs'
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'static')
+
+# Where `build_assets.py` writes the hashed assets
+ASSETS_FOLDER = os.path.join(STATIC_FOLDER, 'build')
+
+
+def accepted_encodings(header):
+    """ This function reads the encodings a browser accepts.
+
+    :param header: the Accept-Encoding header, or None
+
+    :return: a set of encoding names, leaving out any refused with q=0
+
+    """
+
+    accepted = set()
+
+    for part in (header or '').split(','):
+
+        name, _, parameters = part.partition(';')
+        quality = parameters.strip()
+
+        if not name.strip():
+
+            continue
+
+        if quality.startswith('q='):
+
+            try:
+
+                if float(quality[2:]) <= 0:
+
+                    continue
+
+            except ValueError:
+
+                continue
+
+        accepted.add(name.strip().lower())
+
+    return accepted
+
+
+class AssetFile(File):
+    """ Serves the hashed assets, in the same way as the `asset` route of
+    the Flask app: the best precompressed copy the browser accepts is sent
+    as is, and every asset may be cached for a year.  The folder itself is
+    never listed.
+
+    """
+
+    def directoryListing(self):
+
+        return self.childNotFound
+
+    def render_GET(self, request):
+        """ Sends the asset, or its best compressed copy.
+
+        :param request: the twisted.web request
+
+        :return: the response body, or NOT_DONE_YET
+
+        """
+
+        self.restat(False)
+
+        if not self.isfile():
+
+            return File.render_GET(self, request)
+
+        accepted = accepted_encodings(request.getHeader('accept-encoding'))
+
+        served = self
+
+        for encoding, suffix in ASSET_ENCODINGS:
+
+            if encoding in accepted and os.path.isfile(self.path + suffix):
+
+                served = File(self.path + suffix, self.defaultType)
+                served.type = getTypeAndEncoding(self.basename(),
+                                                 self.contentTypes,
+                                                 self.contentEncodings,
+                                                 self.defaultType)[0]
+                served.encoding = encoding
+
+                break
+
+        request.setHeader('vary', 'Accept-Encoding')
+        request.setHeader('cache-control',
+                          'public, max-age={}, immutable'.format(
+                              ASSET_MAX_AGE))
+
+        return File.render_GET(served, request)
+
+    render_HEAD = render_GET
+
+
+class WSGIRoot(Resource):
+    """ A root resource that serves its own children (SockJS and static
+    files), and hands every other path to a WSGI app.
+
+    """
+
+    def __init__(self, wsgi_resource):
+        """ Creates the root.
+
+        :param wsgi_resource: the WSGIResource for any path without a child
+
+        """
+
+        Resource.__init__(self)
+
+        self.wsgi_resource = wsgi_resource
+
+    def getChild(self, path, request):
+        """ Hands a path with no matching child to the WSGI app, with the
+        path segment put back so the app sees the whole URL.
+
+        :param path: the first segment of the request path
+        :param request: the twisted.web request
+
+        :return: the WSGIResource
+
+        """
+
+        request.prepath.pop()
+        request.postpath.insert(0, path)
+
+        return self.wsgi_resource
+
+
+def build_web_site(wsgi_app, relay_factory, threads=10, sockjs_options=None):
+    """ Builds the unified web site.
+
+    :param wsgi_app: the WSGI app to serve pages from (the Flask app)
+    :param relay_factory: the factory that builds a protocol for each SockJS
+                          connection
+    :param threads: the most threads used to run the WSGI app
+    :param sockjs_options: options for the SockJS endpoint (see txsockjs)
+
+    :return: a twisted.web Site, ready to be passed to `listenTCP`
+
+    """
+
+    reactor.suggestThreadPoolSize(threads)
+
+    root = WSGIRoot(WSGIResource(reactor, reactor.getThreadPool(),
+                                 wsgi_app))
+    root.putChild(SOCKJS_PATH, SockJSResource(relay_factory, sockjs_options))
+    root.putChild('static', File(STATIC_FOLDER))
+    root.putChild('assets', AssetFile(ASSETS_FOLDER))
+
+    return Site(root)
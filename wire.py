@@ -0,0 +1,153 @@
+"""
+ZNC WEB REGISTRATION APPLICATION
+---------------------------------
+
+This is the wire format module.  It defines the messages that the
+registration page (`register.js`) and the registration server exchange over
+SockJS.  Every frame is a small JSON object:
+
+    {"v": 1, "ops": [{"op": "register",
+                      "username": "...",
+                      "password": "..."}]}
+
+and every reply is a JSON object describing the outcome of one operation:
+
+    {"v": 1, "op": "register", "ok": true, "message": "...", ...}
+
+A "check" operation (with only a username) asks whether a username can be
+registered, and is answered with an extra "available" field.  A "register"
+that arrives while ZNC is unreachable may be answered with "queued": true,
+meaning it was saved and the account will be created later.
+
+Frames are checked for size before they are parsed, and for shape after, so
+a malformed frame never reaches the registration engine.
+
+"""
+
+import json
+
+PROTOCOL_VERSION = 1
+
+# The largest frame (in bytes) that will be parsed at all
+MAX_FRAME_SIZE = 4096
+
+# The most operations a single frame may carry
+MAX_OPERATIONS = 8
+
+# The longest a single field may be
+MAX_FIELD_LENGTH = 256
+
+# The fields each operation requires
+OPERATIONS = {
+    'register': ('username', 'password'),
+    'check': ('username',),
+}
+
+
+class ProtocolError(Exception):
+    """ Raised when a frame does not follow the wire format.
+
+    """
+
+
+def parse_frame(raw_data):
+    """ This function checks and decodes a frame received over SockJS.
+
+    :param raw_data: the frame, as a byte string
+
+    :return operations: a list of dicts, one per operation, each holding
+                        'op' and that operation's fields as byte strings
+
+    :raises ProtocolError: if the frame is too large or is malformed
+
+    """
+
+    if len(raw_data) > MAX_FRAME_SIZE:
+
+        raise ProtocolError('Frame is too large')
+
+    try:
+
+        frame = json.loads(raw_data)
+
+    except ValueError:
+
+        raise ProtocolError('Frame is not valid JSON')
+
+    if not isinstance(frame, dict) or frame.get('v') != PROTOCOL_VERSION:
+
+        raise ProtocolError('Unsupported protocol version')
+
+    raw_operations = frame.get('ops')
+
+    if not isinstance(raw_operations, list) or not raw_operations:
+
+        raise ProtocolError('Frame has no operations')
+
+    if len(raw_operations) > MAX_OPERATIONS:
+
+        raise ProtocolError('Frame has too many operations')
+
+    return [parse_operation(raw_operation)
+            for raw_operation in raw_operations]
+
+
+def parse_operation(raw_operation):
+    """ This function checks a single operation from a frame.
+
+    :param raw_operation: the decoded operation object
+
+    :return operation: a dict holding 'op' and the operation's fields
+
+    :raises ProtocolError: if the operation is unknown or malformed
+
+    """
+
+    if not isinstance(raw_operation, dict):
+
+        raise ProtocolError('Operation is not an object')
+
+    name = raw_operation.get('op')
+
+    if name not in OPERATIONS:
+
+        raise ProtocolError('Unknown operation')
+
+    operation = {'op': str(name)}
+
+    for field in OPERATIONS[name]:
+
+        value = raw_operation.get(field)
+
+        if not isinstance(value, basestring) or \
+                len(value) > MAX_FIELD_LENGTH:
+
+            raise ProtocolError('Missing or invalid field: ' + field)
+
+        operation[field] = value.encode('utf-8')
+
+    return operation
+
+
+def encode_reply(operation, ok, message, **fields):
+    """ This function builds a reply frame.
+
+    :param operation: the name of the operation being answered, or None if
+                      the frame could not be parsed
+    :param ok: True if the operation succeeded
+    :param message: a message that can be shown to the user
+    :param fields: any other fields to include in the reply
+
+    :return: the reply, as a JSON string
+
+    """
+
+    reply = {
+        'v': PROTOCOL_VERSION,
+        'op': operation,
+        'ok': ok,
+        'message': message,
+    }
+    reply.update(fields)
+
+    return json.dumps(reply)